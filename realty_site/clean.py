@@ -4,12 +4,13 @@ import django
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'realty_site.settings')
 django.setup()
 
-from realty.models import Message
+from django.core.management import call_command
+
 
 def cleanup_old_messages():
-    # Удаляем сообщения без диалогов
-    count, _ = Message.objects.filter(dialogue__isnull=True).delete()
-    print(f"Удалено {count} старых сообщений без диалогов")
+    # Сообщения заблокированных пользователей и переписка старше срока хранения
+    call_command('run_maintenance', verbosity=2)
+
 
 if __name__ == '__main__':
-    cleanup_old_messages()
\ No newline at end of file
+    cleanup_old_messages()
@@ -1,29 +1,139 @@
+"""Админка, рассчитанная на миллионы строк.
+
+В списках:
+
+* связанные объекты подгружаются через ``list_select_related``, а не
+  отдельным запросом на строку (``__str__`` сообщений, комментариев и
+  изображений обращается к внешним ключам);
+* внешние ключи в формах выбираются через autocomplete вместо ``<select>``
+  со всеми пользователями и объявлениями;
+* сортировка по первичному ключу, фильтры — только по индексированным полям,
+  поиск — без полей TextField;
+* без фильтров число строк берётся из статистики планировщика
+  (``EstimatedCountPaginator``), полный ``COUNT(*)`` не выполняется.
+"""
+from django.conf import settings
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import CustomUser, Property, PropertyImage, Comment, Message, Blacklist
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.utils.functional import cached_property
+
+from .models import CustomUser, Property, PropertyImage, Comment, Message, Blacklist, ArchivedProperty
+
+
+def estimated_count(queryset):
+    """Оценка числа строк таблицы без COUNT(*) или None, если оценки нет.
+
+    PostgreSQL — ``pg_class.reltuples`` (обновляется autovacuum/ANALYZE),
+    SQLite — первое число ``sqlite_stat1`` после ANALYZE (``PRAGMA optimize``).
+    """
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+            elif connection.vendor == 'sqlite':
+                # Первое число stat — строк в индексе; у частичных индексов меньше, поэтому MAX
+                cursor.execute('SELECT MAX(CAST(stat AS INTEGER)) FROM sqlite_stat1 WHERE tbl = %s', [table])
+            else:
+                return None
+            row = cursor.fetchone()
+    except DatabaseError:
+        return None
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """Для списка без фильтров — оценка из статистики, если таблица большая"""
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_count(queryset)
+            if estimate is not None and estimate >= getattr(settings, 'ADMIN_ESTIMATED_COUNT_THRESHOLD', 100000):
+                return estimate
+        return queryset.count()
+
+
+class ScalableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ('-pk',)
+
 
 @admin.register(CustomUser)
 class CustomUserAdmin(UserAdmin):
     list_display = ('username', 'email', 'first_name', 'last_name', 'user_type', 'is_staff')
-    list_filter = ('user_type', 'is_staff', 'is_superuser')
+    # Только индексированные поля: фильтр по is_staff/is_superuser сканировал бы всю таблицу
+    list_filter = ('user_type',)
     fieldsets = UserAdmin.fieldsets + (
         ('Дополнительная информация', {
             'fields': ('user_type', 'phone', 'bio', 'avatar', 'gender')
         }),
     )
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ('-pk',)
+
 
 class PropertyImageInline(admin.TabularInline):
     model = PropertyImage
     extra = 1
 
+
 @admin.register(Property)
-class PropertyAdmin(admin.ModelAdmin):
+class PropertyAdmin(ScalableAdmin):
     list_display = ('title', 'price', 'property_type', 'status', 'created_by', 'created_at')
+    list_select_related = ('created_by',)
     list_filter = ('property_type', 'status', 'created_at')
-    search_fields = ('title', 'description', 'location')
+    search_fields = ('title', 'location')
+    autocomplete_fields = ('created_by',)
     inlines = [PropertyImageInline]
 
-admin.site.register(PropertyImage)
-admin.site.register(Comment)
-admin.site.register(Message)
-admin.site.register(Blacklist)
\ No newline at end of file
+
+@admin.register(ArchivedProperty)
+class ArchivedPropertyAdmin(ScalableAdmin):
+    list_display = ('title', 'price', 'property_type', 'status', 'created_by', 'archived_at')
+    list_select_related = ('created_by',)
+    # Только индексированные поля (property_type — ведущий столбец индекса архива)
+    list_filter = ('property_type',)
+    search_fields = ('title', 'location')
+    autocomplete_fields = ('created_by',)
+
+
+@admin.register(PropertyImage)
+class PropertyImageAdmin(ScalableAdmin):
+    list_display = ('__str__', 'image', 'is_main')
+    list_select_related = ('property',)
+    autocomplete_fields = ('property',)
+
+
+@admin.register(Comment)
+class CommentAdmin(ScalableAdmin):
+    list_display = ('__str__', 'property', 'created_at')
+    list_select_related = ('author', 'property')
+    autocomplete_fields = ('author', 'property')
+
+
+@admin.register(Message)
+class MessageAdmin(ScalableAdmin):
+    list_display = ('sender', 'receiver', 'short_content', 'created_at', 'is_read')
+    list_select_related = ('sender', 'receiver')
+    list_filter = ('created_at',)
+    autocomplete_fields = ('sender', 'receiver')
+
+    @admin.display(description='Сообщение')
+    def short_content(self, obj):
+        return obj.content[:50]
+
+
+@admin.register(Blacklist)
+class BlacklistAdmin(ScalableAdmin):
+    list_display = ('user', 'blocked_user', 'created_at', 'messages_purged')
+    list_select_related = ('user', 'blocked_user')
+    autocomplete_fields = ('user', 'blocked_user')
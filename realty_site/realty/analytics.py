@@ -0,0 +1,192 @@
+"""Аналитика рынка: сводная таблица ``MarketStats``.
+
+Строка сводки — тип недвижимости, город (первая часть адреса до запятой)
+и месяц публикации: число объявлений, медиана и перцентили цены за м²,
+число проданных и срок продажи (``sold_at - created_at``) в днях.
+
+Страница и API читают только сводку. Она обновляется инкрементально:
+после сохранения или удаления объявления его группы (старая и новая)
+пересчитываются в фоне. Полный пересчёт — команда
+``rebuild_market_stats``, читающая объявления потоком через
+``iterator()`` по одной группе «тип + месяц» за раз.
+
+Объявления, перенесённые в архив (``realty.archive``), участвуют в
+сводке наравне с живыми.
+"""
+import heapq
+from datetime import datetime, time, timedelta
+
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+
+from .maintenance import BackgroundBatcher
+from .models import ArchivedProperty, MarketStats, Property
+
+FIELDS = ('property_type', 'location', 'price', 'area', 'status', 'created_at', 'sold_at')
+STAT_FIELDS = (
+    'count', 'sold_count', 'price_m2_median', 'price_m2_p25', 'price_m2_p75', 'price_m2_p90',
+    'days_to_sold_median', 'days_to_sold_avg',
+)
+
+
+def city_of(location):
+    city = ' '.join(location.split(',')[0].split())
+    if city.lower().startswith('г.'):
+        city = city[2:].strip()
+    return city[:100]
+
+
+def month_of(created_at):
+    return timezone.localtime(created_at).date().replace(day=1)
+
+
+def month_range(month):
+    """Границы месяца в текущем часовом поясе"""
+    following = month.replace(year=month.year + 1, month=1) if month.month == 12 else month.replace(month=month.month + 1)
+    tz = timezone.get_current_timezone()
+    return datetime.combine(month, time.min, tz), datetime.combine(following, time.min, tz)
+
+
+def bucket_of(property_type, location, created_at):
+    return property_type, city_of(location), month_of(created_at)
+
+
+def compute_stats(rows):
+    """Показатели группы по строкам (… price, area, status, created_at, sold_at)"""
+    price_m2 = np.array([float(row[2]) / row[3] for row in rows if row[3]])
+    days = np.array([
+        (row[6] - row[5]).total_seconds() / 86400 for row in rows if row[4] == 'sold' and row[6] is not None
+    ])
+    p25, p50, p75, p90 = np.percentile(price_m2, [25, 50, 75, 90]) if len(price_m2) else (0, 0, 0, 0)
+    return {
+        'count': len(rows),
+        'sold_count': sum(1 for row in rows if row[4] == 'sold'),
+        'price_m2_median': round(float(p50), 2),
+        'price_m2_p25': round(float(p25), 2),
+        'price_m2_p75': round(float(p75), 2),
+        'price_m2_p90': round(float(p90), 2),
+        'days_to_sold_median': round(float(np.median(days)), 1) if len(days) else None,
+        'days_to_sold_avg': round(float(days.mean()), 1) if len(days) else None,
+    }
+
+
+def save_stats(stats):
+    """Вставка или обновление строк сводки: {(тип, город, месяц): показатели}"""
+    MarketStats.objects.bulk_create(
+        [
+            MarketStats(property_type=property_type, city=city, month=month, **values)
+            for (property_type, city, month), values in stats.items()
+        ],
+        update_conflicts=True,
+        unique_fields=['property_type', 'city', 'month'],
+        update_fields=[*STAT_FIELDS, 'updated_at'],
+        batch_size=500,
+    )
+
+
+def refresh_buckets(buckets):
+    """Пересчёт отдельных групп (тип, город, месяц) по исходным объявлениям"""
+    for property_type, city, month in buckets:
+        start, end = month_range(month)
+        rows = [
+            row for model in (Property, ArchivedProperty) for row in model.objects.filter(
+                property_type=property_type, created_at__gte=start, created_at__lt=end,
+                location__icontains=city,
+            ).values_list(*FIELDS)
+            if city_of(row[1]) == city
+        ]
+        with transaction.atomic():
+            if rows:
+                save_stats({(property_type, city, month): compute_stats(rows)})
+            else:
+                MarketStats.objects.filter(property_type=property_type, city=city, month=month).delete()
+
+
+def rebuild_all(chunk_size=2000, progress=None):
+    """Полный пересчёт с ограниченной памятью; возвращает число групп.
+
+    Объявления читаются потоком по (тип, дата публикации), поэтому в памяти
+    одновременно находится только один месяц одного типа.
+    """
+    started = timezone.now()
+    total = Property.objects.count() + ArchivedProperty.objects.count()
+    done = 0
+    saved = 0
+    current = None
+    groups = {}
+
+    def flush():
+        nonlocal saved
+        if groups:
+            save_stats({
+                (current[0], city, current[1]): compute_stats(rows) for city, rows in groups.items()
+            })
+            saved += len(groups)
+            groups.clear()
+
+    # Два упорядоченных потока (живые и архивные) сливаются в один
+    streams = [
+        model.objects.order_by('property_type', 'created_at').values_list(*FIELDS).iterator(chunk_size=chunk_size)
+        for model in (Property, ArchivedProperty)
+    ]
+    for row in heapq.merge(*streams, key=lambda row: (row[0], row[5])):
+        key = (row[0], month_of(row[5]))
+        if key != current:
+            flush()
+            current = key
+        groups.setdefault(city_of(row[1]), []).append(row)
+        done += 1
+        if progress is not None and done % chunk_size == 0:
+            progress(done, total)
+    flush()
+    # Группы, в которых не осталось объявлений
+    MarketStats.objects.filter(updated_at__lt=started).delete()
+    if progress is not None:
+        progress(done, total)
+    return saved
+
+
+refresh_queue = BackgroundBatcher(refresh_buckets, 'MARKET_STATS_REFRESH_IN_BACKGROUND')
+
+
+def property_pre_save(sender, instance, **kwargs):
+    # Старая группа нужна, если у объявления сменились тип, адрес или дата
+    if instance.pk:
+        previous = Property.objects.filter(pk=instance.pk).values_list('property_type', 'location', 'created_at').first()
+        instance._market_bucket = bucket_of(*previous) if previous else None
+
+
+def property_changed(sender, instance, **kwargs):
+    """post_save и post_delete: пересчитать старую и новую группы"""
+    if instance.created_at is None:
+        return
+    buckets = {bucket_of(instance.property_type, instance.location, instance.created_at)}
+    previous = getattr(instance, '_market_bucket', None)
+    if previous is not None:
+        buckets.add(previous)
+    refresh_queue.schedule(buckets)
+
+
+def market_stats(property_type=None, city=None, months=12):
+    """Строки сводки за последние ``months`` месяцев — один запрос к сводке"""
+    today = timezone.localdate()
+    first = today.replace(day=1)
+    for _ in range(months - 1):
+        first = (first - timedelta(days=1)).replace(day=1)
+    queryset = MarketStats.objects.filter(month__gte=first)
+    if property_type:
+        queryset = queryset.filter(property_type=property_type)
+    if city:
+        queryset = queryset.filter(city=city)
+    return queryset
+
+
+def serialize(stats):
+    return {
+        'property_type': stats.property_type,
+        'property_type_display': stats.get_property_type_display(),
+        'city': stats.city,
+        'month': stats.month.strftime('%Y-%m'),
+        **{field: getattr(stats, field) for field in STAT_FIELDS},
+    }
@@ -4,3 +4,30 @@ from django.apps import AppConfig
 class RealtyConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'realty'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+        from .analytics import property_changed, property_pre_save
+        from .availability import user_saved
+        from .conditional import content_changed
+        from .db import configure_sqlite
+        from .models import Comment, CustomUser, Message, Property, PropertyImage
+        from .recipients import update_search_tokens
+        from .recommendations import property_deleted, property_saved
+        from .saved_searches import property_saved as saved_search_property_saved
+        from .unread import message_saved
+
+        connection_created.connect(configure_sqlite, dispatch_uid='realty_configure_sqlite')
+        post_save.connect(update_search_tokens, sender=CustomUser, dispatch_uid='realty_search_tokens')
+        post_save.connect(user_saved, sender=CustomUser, dispatch_uid='realty_availability')
+        post_save.connect(property_saved, sender=Property, dispatch_uid='realty_recommendations_saved')
+        pre_delete.connect(property_deleted, sender=Property, dispatch_uid='realty_recommendations_deleted')
+        pre_save.connect(property_pre_save, sender=Property, dispatch_uid='realty_market_stats_pre_save')
+        post_save.connect(property_changed, sender=Property, dispatch_uid='realty_market_stats_saved')
+        post_delete.connect(property_changed, sender=Property, dispatch_uid='realty_market_stats_deleted')
+        post_save.connect(saved_search_property_saved, sender=Property, dispatch_uid='realty_saved_searches')
+        post_save.connect(message_saved, sender=Message, dispatch_uid='realty_unread_counter')
+        for model in (Property, PropertyImage, Comment):
+            post_save.connect(content_changed, sender=model, dispatch_uid=f'realty_page_version_saved_{model.__name__}')
+            post_delete.connect(content_changed, sender=model, dispatch_uid=f'realty_page_version_deleted_{model.__name__}')
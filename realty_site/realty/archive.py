@@ -0,0 +1,140 @@
+"""Архив давно проданных и скрытых объявлений.
+
+Каталог читает только таблицу ``Property``, поэтому проданная история в
+ней только замедляет запросы. ``archive_properties`` переносит объявления,
+которые не меняются дольше ``PROPERTY_ARCHIVE_DAYS`` дней, вместе с
+фотографиями и комментариями в таблицы ``ArchivedProperty``,
+``ArchivedPropertyImage`` и ``ArchivedComment`` с теми же id.
+
+Из живой таблицы строки удаляются без сигналов: объявление не удаляется,
+а переезжает, поэтому пересчитывать рекомендации и аналитику не нужно
+(аналитика читает обе таблицы). Каскадно удаляются только производные
+данные: ссылки «похожих», совпадения сохранённых поисков и статистика
+просмотров.
+
+Владелец видит архивные объявления в профиле; ``live_property``
+прозрачно возвращает строку в ``Property`` при редактировании,
+активации или удалении.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.http import Http404
+from django.utils import timezone
+
+from .conditional import bump_versions
+from .maintenance import DEFAULT_BATCH_SIZE, _noop_progress
+from .models import (
+    ArchivedComment, ArchivedProperty, ArchivedPropertyImage, Comment, Property, PropertyImage,
+)
+
+# Пары (живая модель, архивная модель) в порядке вставки
+TABLES = (
+    (Property, ArchivedProperty),
+    (PropertyImage, ArchivedPropertyImage),
+    (Comment, ArchivedComment),
+)
+
+
+def copy_rows(source, target, column, ids):
+    """INSERT ... SELECT строк source с ``column IN ids`` в target.
+
+    Не через bulk_create: он выставил бы auto_now/auto_now_add заново,
+    а даты публикации и комментариев должны сохраниться.
+    """
+    source_columns = {field.column for field in source._meta.concrete_fields}
+    quote = connection.ops.quote_name
+    columns, values, params = [], [], []
+    for field in target._meta.concrete_fields:
+        columns.append(quote(field.column))
+        if field.column in source_columns:
+            values.append(quote(field.column))
+        else:
+            # archived_at
+            values.append('%s')
+            params.append(field.get_db_prep_value(timezone.now(), connection))
+    placeholders = ', '.join(['%s'] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {quote(target._meta.db_table)} ({", ".join(columns)}) '
+            f'SELECT {", ".join(values)} FROM {quote(source._meta.db_table)} '
+            f'WHERE {quote(column)} IN ({placeholders})',
+            params + list(ids),
+        )
+
+
+def raw_delete(models, ids):
+    """Удалить скопированные строки без сигналов — иначе django_cleanup удалит файлы фото"""
+    for model in models:
+        column = 'pk' if model in (Property, ArchivedProperty) else 'property_id'
+        queryset = model._base_manager.filter(**{f'{column}__in': ids})
+        queryset._raw_delete(queryset.db)
+
+
+def delete_live(ids):
+    """Удалить перенесённые объявления и производные от них данные без загрузки объектов"""
+    copied = {live for live, _ in TABLES}
+    for relation in Property._meta.related_objects:
+        if relation.one_to_many and relation.related_model not in copied:
+            relation.related_model._base_manager.filter(**{f'{relation.field.name}__in': ids}).delete()
+    raw_delete([live for live, _ in reversed(TABLES)], ids)
+    # Сигналов не было — версии страниц увеличиваем сами
+    bump_versions('catalog', *(f'property:{pk}' for pk in ids))
+
+
+def archivable(days=None):
+    days = days if days is not None else getattr(settings, 'PROPERTY_ARCHIVE_DAYS', 180)
+    return Property.objects.filter(status__in=('sold', 'hidden'), updated_at__lt=timezone.now() - timedelta(days=days))
+
+
+def archive_properties(days=None, batch_size=DEFAULT_BATCH_SIZE, progress=_noop_progress, dry_run=False):
+    """Перенести давние проданные и скрытые объявления в архив; возвращает их число"""
+    queryset = archivable(days)
+    total = queryset.count()
+    if dry_run:
+        return total
+    done = 0
+    while True:
+        ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            break
+        with transaction.atomic():
+            for live, archived in TABLES:
+                copy_rows(live, archived, 'id' if live is Property else 'property_id', ids)
+            delete_live(ids)
+        done += len(ids)
+        progress(done, total)
+    return done
+
+
+def restore_properties(ids):
+    """Вернуть объявления из архива в живые таблицы без сигналов; возвращает их число.
+
+    Статус не меняется: вызывающий код сохраняет объявление обычным
+    ``save()``, и сигналы видят переход статуса как для любой строки.
+    """
+    with transaction.atomic():
+        ids = list(ArchivedProperty.objects.select_for_update().filter(pk__in=ids).values_list('pk', flat=True))
+        if not ids:
+            return 0
+        for live, archived in TABLES:
+            copy_rows(archived, live, 'id' if live is Property else 'property_id', ids)
+        raw_delete([archived for _, archived in reversed(TABLES)], ids)
+        bump_versions('catalog', *(f'property:{pk}' for pk in ids))
+    return len(ids)
+
+
+def live_property(pk, owner):
+    """Объявление владельца из Property; архивное прозрачно восстанавливается"""
+    found = Property.objects.filter(pk=pk, created_by=owner).first()
+    if found is None and restore_properties(ArchivedProperty.objects.filter(pk=pk, created_by=owner).values('pk')):
+        found = Property.objects.filter(pk=pk, created_by=owner).first()
+    if found is None:
+        raise Http404('Объект не найден')
+    return found
+
+
+def owner_archive(owner):
+    return ArchivedProperty.objects.filter(created_by=owner).prefetch_related('images')
+
@@ -0,0 +1,128 @@
+"""Проверка занятости логина и email при регистрации.
+
+Отрицательный ответ («свободно») чаще всего даёт фильтр Блума в памяти
+процесса без обращения к базе. Если фильтр говорит «возможно занято»,
+выполняется запрос ``LOWER(username) = LOWER(%s)`` по уникальному
+индексу без учёта регистра.
+
+Фильтр строится при первой проверке, пополняется сигналом post_save и
+раз в ``SYNC_INTERVAL`` секунд дочитывает пользователей, созданных другими
+процессами (по возрастанию id). Раз в ``REBUILD_INTERVAL`` он
+перестраивается целиком, чтобы учесть смену email.
+"""
+import hashlib
+import math
+import threading
+import time
+
+from django.db.models import Value
+from django.db.models.functions import Lower
+
+from .models import CustomUser
+
+SYNC_INTERVAL = 5
+REBUILD_INTERVAL = 3600
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1000)
+        self.size = int(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        # Двойное хэширование: k позиций из двух половин одного дайджеста
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class AvailabilityService:
+    FIELDS = ('username', 'email')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._filters = None
+        self._max_id = 0
+        self._synced_at = 0
+        self._built_at = 0
+        self.db_checks = 0
+
+    @staticmethod
+    def normalize(value):
+        return (value or '').strip().lower()
+
+    def _add(self, filters, user):
+        for field in self.FIELDS:
+            value = self.normalize(getattr(user, field))
+            if value:
+                filters[field].add(value)
+
+    def rebuild(self):
+        capacity = CustomUser.objects.count() * 2 + 10_000
+        filters = {field: BloomFilter(capacity) for field in self.FIELDS}
+        max_id = 0
+        for user in CustomUser.objects.only('id', *self.FIELDS).order_by('id').iterator(chunk_size=5000):
+            self._add(filters, user)
+            max_id = user.id
+        with self._lock:
+            self._filters = filters
+            self._max_id = max_id
+            self._built_at = self._synced_at = time.monotonic()
+
+    def _sync(self):
+        now = time.monotonic()
+        if self._filters is None or now - self._built_at > REBUILD_INTERVAL:
+            self.rebuild()
+            return
+        if now - self._synced_at < SYNC_INTERVAL:
+            return
+        with self._lock:
+            new_users = list(CustomUser.objects.filter(id__gt=self._max_id).only('id', *self.FIELDS).order_by('id'))
+            for user in new_users:
+                self._add(self._filters, user)
+                self._max_id = user.id
+            self._synced_at = now
+
+    def add_user(self, user):
+        """Вызывается из post_save: новый логин/email сразу считается занятым"""
+        if self._filters is None:
+            return
+        with self._lock:
+            self._add(self._filters, user)
+
+    def exists(self, field, value, exclude_pk=None):
+        value = (value or '').strip()
+        if not value:
+            return False
+        self._sync()
+        if self.normalize(value) not in self._filters[field]:
+            return False
+        self.db_checks += 1
+        # Регистр приводим средствами базы — так же, как в уникальном индексе
+        queryset = CustomUser.objects.alias(normalized=Lower(field)).filter(normalized=Lower(Value(value)))
+        if exclude_pk is not None:
+            queryset = queryset.exclude(pk=exclude_pk)
+        return queryset.exists()
+
+    def username_taken(self, username):
+        return self.exists('username', username)
+
+    def email_taken(self, email, exclude_pk=None):
+        return self.exists('email', email, exclude_pk=exclude_pk)
+
+
+availability = AvailabilityService()
+
+
+def user_saved(sender, instance, **kwargs):
+    availability.add_user(instance)
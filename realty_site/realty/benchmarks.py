@@ -0,0 +1,527 @@
+"""Бенчмарки страниц через тестовый клиент.
+
+Каждый сценарий — это GET-запрос к представлению; для него считаются
+задержки (p50/p95), число SQL-запросов и пиковое потребление памяти.
+Результаты сохраняются в JSON, чтобы сравнивать прогоны между коммитами.
+
+Отдельный сценарий ``run_write_benchmark`` нагружает базу параллельными
+записями (просмотры ``property_detail``), чтобы сравнить SQLite с разными
+PRAGMA и PostgreSQL.
+
+``run_server_mode_benchmark`` сравнивает одни и те же страницы под WSGI
+(пул потоков-воркеров) и ASGI (одна очередь событий): пропускную
+способность и задержки при заданном числе одновременных клиентов.
+
+``run_template_benchmark`` считает рендеры в секунду для страницы
+каталога с 12 и 48 карточками: сетка карточек на Django и Jinja2 и вся
+страница с кэшированным загрузчиком шаблонов и без него.
+"""
+import asyncio
+import io
+import json
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.asgi import get_asgi_application
+from django.core.paginator import Paginator
+from django.core.wsgi import get_wsgi_application
+from django.db import OperationalError, connection, connections
+from django.db.models import Count
+from django.template import Engine, RequestContext, engines
+from django.template.loader import render_to_string
+from django.test import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from .cards import CARD_TEMPLATE, card_rows, card_values, render_cards
+from .models import CustomUser, Property, Message
+
+
+@dataclass
+class Scenario:
+    name: str
+    url: str
+    user: CustomUser = None
+    headers: dict = field(default_factory=dict)
+
+
+def percentile(values, q):
+    """Перцентиль с линейной интерполяцией (q от 0 до 100)"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(timings):
+    return {
+        'p50_ms': round(percentile(timings, 50) * 1000, 3),
+        'p95_ms': round(percentile(timings, 95) * 1000, 3),
+        'mean_ms': round(sum(timings) / len(timings) * 1000, 3),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def default_scenarios():
+    """Сценарии по данным из текущей базы"""
+    ajax = {'x-requested-with': 'XMLHttpRequest'}
+    list_url = reverse('property_list')
+    scenarios = [
+        Scenario('home', reverse('home')),
+        Scenario('property_list', list_url),
+        Scenario('property_list_ajax', list_url, headers=ajax),
+        Scenario('property_list_page_10', f'{list_url}?page=10'),
+        Scenario('property_list_search', f'{list_url}?search=центр'),
+        Scenario('property_list_rooms', f'{list_url}?rooms=2'),
+        Scenario('property_list_price', f'{list_url}?min_price=3000000&max_price=9000000'),
+    ]
+    for property_type, _ in Property.PROPERTY_TYPES:
+        scenarios.append(Scenario(f'property_list_type_{property_type}', f'{list_url}?type={property_type}'))
+    for sort in ('price', '-price', '-views', 'created_at'):
+        scenarios.append(Scenario(f'property_list_sort_{sort}', f'{list_url}?sort={sort}'))
+
+    prop = Property.objects.filter(status='active').order_by('-views').first()
+    if prop:
+        scenarios.append(Scenario('property_detail', reverse('property_detail', args=[prop.pk])))
+
+    # Самый активный по переписке пользователь и его самый длинный диалог
+    busiest = (
+        Message.objects.values('receiver').annotate(total=Count('id')).order_by('-total').first()
+    )
+    if busiest:
+        user = CustomUser.objects.get(pk=busiest['receiver'])
+        partner = (
+            Message.objects.filter(receiver=user).values('sender')
+            .annotate(total=Count('id')).order_by('-total').first()
+        )
+        scenarios.append(Scenario('message_list', reverse('message_list'), user=user))
+        scenarios.append(Scenario('chat_with_user', reverse('chat_with_user', args=[partner['sender']]), user=user))
+    return scenarios
+
+
+def run_scenario(scenario, repeat=20, warmup=2):
+    client = Client(HTTP_HOST='localhost')
+    if scenario.user is not None:
+        client.force_login(scenario.user)
+
+    for _ in range(warmup):
+        client.get(scenario.url, headers=scenario.headers)
+
+    timings = []
+    queries = []
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = client.get(scenario.url, headers=scenario.headers)
+            timings.append(time.perf_counter() - started)
+        queries.append(len(captured.captured_queries))
+    status = response.status_code
+    size = len(response.content)
+
+    # Память меряем отдельным прогоном: tracemalloc заметно замедляет запрос
+    tracemalloc.start()
+    client.get(scenario.url, headers=scenario.headers)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    result = summarize(timings)
+    result.update({
+        'url': scenario.url,
+        'status': status,
+        'bytes': size,
+        'queries': max(queries),
+        'peak_memory_kb': round(peak_memory / 1024, 1),
+        'repeat': repeat,
+    })
+    return result
+
+
+def run_benchmarks(scenarios=None, repeat=20, warmup=2, only=None):
+    scenarios = scenarios if scenarios is not None else default_scenarios()
+    results = {}
+    for scenario in scenarios:
+        if only and not any(name in scenario.name for name in only):
+            continue
+        results[scenario.name] = run_scenario(scenario, repeat=repeat, warmup=warmup)
+    return {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'database': connection.vendor,
+        'counts': {
+            'users': CustomUser.objects.count(),
+            'properties': Property.objects.count(),
+            'messages': Message.objects.count(),
+        },
+        'results': results,
+    }
+
+
+def save_report(report, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+def load_report(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare_reports(old, new):
+    """Строки сравнения p50/p95 и числа запросов двух прогонов"""
+    lines = []
+    for name, current in new['results'].items():
+        previous = old['results'].get(name)
+        if previous is None:
+            continue
+        parts = []
+        for key in ('p50_ms', 'p95_ms', 'queries'):
+            before, after = previous[key], current[key]
+            change = f'{(after - before) / before * 100:+.1f}%' if before else 'n/a'
+            parts.append(f'{key} {before} → {after} ({change})')
+        lines.append(f'{name}: ' + ', '.join(parts))
+    return lines
+
+
+def run_write_benchmark(threads=8, duration=5.0, seed=0):
+    """Параллельные GET property_detail: каждый увеличивает Property.views.
+
+    Возвращает пропускную способность (запросов в секунду), задержки и
+    число ошибок блокировки базы.
+    """
+    property_ids = list(
+        Property.objects.filter(status='active').order_by('-id').values_list('id', flat=True)[:1000]
+    )
+    if not property_ids:
+        return None
+    # Соединение главного потока закрываем, чтобы не держать блокировку
+    connections.close_all()
+
+    lock = threading.Lock()
+    timings = []
+    errors = []
+    deadline = time.perf_counter() + duration
+
+    def worker(number):
+        rng = random.Random(seed + number)
+        client = Client(HTTP_HOST='localhost')
+        local_timings = []
+        local_errors = 0
+        try:
+            while time.perf_counter() < deadline:
+                url = reverse('property_detail', args=[rng.choice(property_ids)])
+                started = time.perf_counter()
+                try:
+                    client.get(url)
+                except OperationalError:
+                    local_errors += 1
+                    continue
+                local_timings.append(time.perf_counter() - started)
+        finally:
+            connections.close_all()
+        with lock:
+            timings.extend(local_timings)
+            errors.append(local_errors)
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(number,)) for number in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    result = summarize(timings) if timings else {}
+    result.update({
+        'database': connection.vendor,
+        'threads': threads,
+        'requests': len(timings),
+        'errors': sum(errors),
+        'writes_per_second': round(len(timings) / elapsed, 1),
+    })
+    return result
+
+
+def run_ratelimit_benchmark(iterations=20000):
+    """Накладные расходы ограничителя частоты на один запрос (мкс)"""
+    from .ratelimit import check_rate_limit, consume
+
+    request = RequestFactory().post('/', REMOTE_ADDR='10.0.0.1')
+    request.user = AnonymousUser()
+    results = {}
+
+    started = time.perf_counter()
+    for i in range(iterations):
+        consume('benchmark', f'key{i % 1000}', '1000/s', 1000)
+    results['consume_us'] = round((time.perf_counter() - started) / iterations * 1e6, 2)
+
+    with override_settings(RATE_LIMITS={'benchmark': {'rate': '1000/s', 'burst': 1000, 'keys': ('client', 'ip')}}):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            check_rate_limit(request, 'benchmark')
+        results['check_rate_limit_us'] = round((time.perf_counter() - started) / iterations * 1e6, 2)
+
+    results['cache_backend'] = settings.CACHES['default']['BACKEND']
+    results['iterations'] = iterations
+    return results
+
+
+def run_compression_benchmark(levels=None, repeat=5):
+    """Время сжатия (мс) и экономия трафика для страниц из default_scenarios"""
+    from .compression import brotli, compress_bytes
+
+    levels = levels or {'gzip': (1, 6, 9), 'br': (1, 4, 6, 11)}
+    if brotli is None:
+        levels = {'gzip': levels['gzip']}
+    results = {}
+    for scenario in default_scenarios():
+        client = Client(HTTP_HOST='localhost')
+        if scenario.user is not None:
+            client.force_login(scenario.user)
+        # Несжатое тело: без Accept-Encoding middleware ничего не делает
+        body = client.get(scenario.url, headers=scenario.headers).content
+        if not body:
+            continue
+        row = {'bytes': len(body)}
+        for encoding, encoding_levels in levels.items():
+            for level in encoding_levels:
+                timings = []
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    compressed = compress_bytes(body, encoding, level)
+                    timings.append((time.perf_counter() - started) * 1000)
+                row[f'{encoding}{level}'] = {
+                    'ms': round(percentile(timings, 50), 3),
+                    'bytes': len(compressed),
+                    'ratio': round(len(compressed) / len(body), 3),
+                }
+        results[scenario.name] = row
+    return results
+
+
+LOAD_SCENARIOS = ('home', 'property_list_ajax', 'property_detail', 'message_list')
+
+
+def load_requests():
+    """(сценарий, путь, строка запроса, заголовки) для нагрузочного теста"""
+    requests = []
+    for scenario in default_scenarios():
+        if scenario.name not in LOAD_SCENARIOS:
+            continue
+        path, _, query = scenario.url.partition('?')
+        headers = {'host': 'localhost', **{name.lower(): value for name, value in scenario.headers.items()}}
+        if scenario.user is not None:
+            client = Client()
+            client.force_login(scenario.user)
+            cookie = client.cookies[settings.SESSION_COOKIE_NAME]
+            headers['cookie'] = f'{cookie.key}={cookie.value}'
+        requests.append((scenario.name, path, query, headers))
+    return requests
+
+
+def wsgi_environ(path, query, headers):
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+        'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'REMOTE_ADDR': '127.0.0.1', 'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+        'wsgi.url_scheme': 'http', 'wsgi.version': (1, 0), 'wsgi.multithread': True,
+        'wsgi.multiprocess': False, 'wsgi.run_once': False,
+    }
+    for name, value in headers.items():
+        environ['HTTP_' + name.upper().replace('-', '_')] = value
+    return environ
+
+
+def asgi_scope(path, query, headers):
+    return {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+        'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+        'root_path': '', 'headers': [(name.encode(), value.encode()) for name, value in headers.items()],
+        'client': ('127.0.0.1', 50000), 'server': ('localhost', 80),
+    }
+
+
+def load_summary(samples, elapsed):
+    """samples — (сценарий, секунды, HTTP-статус)"""
+    timings = [seconds for _, seconds, _ in samples]
+    result = summarize(timings) if timings else {}
+    result['p99_ms'] = round(percentile(timings, 99) * 1000, 3)
+    result['requests'] = len(samples)
+    result['requests_per_second'] = round(len(samples) / elapsed, 1)
+    result['errors'] = sum(1 for _, _, status in samples if status >= 500)
+    result['scenarios'] = {
+        name: round(percentile([seconds for sample, seconds, _ in samples if sample == name], 50) * 1000, 3)
+        for name in sorted({name for name, _, _ in samples})
+    }
+    return result
+
+
+def run_wsgi_load(requests, concurrency, workers, duration, seed=0):
+    """Клиенты в потоках; одновременно обрабатывается не больше ``workers`` запросов"""
+    handler = get_wsgi_application()
+    slots = threading.BoundedSemaphore(workers)
+    lock = threading.Lock()
+    samples = []
+    deadline = time.perf_counter() + duration
+
+    def client(number):
+        rng = random.Random(seed + number)
+        local = []
+        while time.perf_counter() < deadline:
+            name, path, query, headers = rng.choice(requests)
+            status = []
+            started = time.perf_counter()
+            # Ожидание свободного воркера входит в задержку, как у клиента за балансировщиком
+            with slots:
+                body = handler(wsgi_environ(path, query, headers), lambda line, *args: status.append(int(line[:3])))
+                try:
+                    for _ in body:
+                        pass
+                finally:
+                    body.close()
+            local.append((name, time.perf_counter() - started, status[0]))
+        with lock:
+            samples.extend(local)
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=client, args=(number,)) for number in range(concurrency)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return load_summary(samples, time.perf_counter() - started)
+
+
+def run_asgi_load(requests, concurrency, duration, seed=0):
+    """Клиенты — задачи asyncio в одной очереди событий с приложением ASGI"""
+    application = get_asgi_application()
+
+    async def request(path, query, headers):
+        status = []
+        messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            # Клиент не отключается: Django отменит ожидание после ответа
+            await asyncio.Future()
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+
+        await application(asgi_scope(path, query, headers), receive, send)
+        return status[0]
+
+    async def main():
+        deadline = time.perf_counter() + duration
+        samples = []
+
+        async def client(number):
+            rng = random.Random(seed + number)
+            while time.perf_counter() < deadline:
+                name, path, query, headers = rng.choice(requests)
+                started = time.perf_counter()
+                status = await request(path, query, headers)
+                samples.append((name, time.perf_counter() - started, status))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client(number) for number in range(concurrency)))
+        return load_summary(samples, time.perf_counter() - started)
+
+    return asyncio.run(main())
+
+
+def run_server_mode_benchmark(concurrency=32, workers=8, duration=5.0):
+    """Одинаковая смесь запросов (главная, JSON каталога, карточка, сообщения) под WSGI и ASGI"""
+    requests = load_requests()
+    if not requests:
+        return None
+    # Соединение главного потока не нужно: запросы выполняются в других потоках
+    connections.close_all()
+    return {
+        'database': connection.vendor,
+        'concurrency': concurrency,
+        'workers': workers,
+        'duration': duration,
+        'wsgi': run_wsgi_load(requests, concurrency, workers, duration),
+        'asgi': run_asgi_load(requests, concurrency, duration),
+    }
+
+
+def renders_per_second(render, duration):
+    render()
+    count = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < duration:
+        render()
+        count += 1
+    return round(count / (time.perf_counter() - started), 1)
+
+
+def uncached_engine():
+    """Django-движок без cached.Loader: шаблоны разбираются на каждый рендер"""
+    options = settings.TEMPLATES[0]
+    return Engine(
+        dirs=options['DIRS'],
+        context_processors=options['OPTIONS']['context_processors'],
+        loaders=['django.template.loaders.filesystem.Loader', 'django.template.loaders.app_directories.Loader'],
+    )
+
+
+def run_template_benchmark(sizes=(12, 48), duration=1.0):
+    """Рендеров в секунду: сетка карточек и вся страница каталога для каждого размера"""
+    rows = list(card_values(Property.objects.filter(status='active'))[:max(sizes)])
+    if not rows:
+        return None
+    request = RequestFactory().get(reverse('property_list'))
+    request.user = AnonymousUser()
+    available = [name for name in ('django', 'jinja2') if name in {engine.name for engine in engines.all()}]
+    page_template = uncached_engine()
+
+    results = {}
+    for size in sizes:
+        cards = card_rows((rows * (size // len(rows) + 1))[:size])
+        page_obj = Paginator(cards, size).page(1)
+        row = {}
+        for name in available:
+            template = engines[name].get_template(CARD_TEMPLATE)
+            row[f'cards_{name}'] = renders_per_second(
+                lambda: template.render({'cards': cards, 'variant': 'catalog'}), duration,
+            )
+
+            def page(engine=name):
+                context = {'page_obj': page_obj, 'cards': render_cards(cards, engine=engine),
+                           'property_types': Property.PROPERTY_TYPES}
+                return render_to_string('realty/property_list.html', context, request=request)
+
+            row[f'page_{name}'] = renders_per_second(page, duration)
+
+        def page_uncached():
+            context = {'page_obj': page_obj, 'cards': render_cards(cards, engine='django'),
+                       'property_types': Property.PROPERTY_TYPES}
+            return page_template.get_template('realty/property_list.html').render(RequestContext(request, context))
+
+        row['page_django_uncached'] = renders_per_second(page_uncached, duration)
+        results[size] = row
+    return results
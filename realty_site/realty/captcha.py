@@ -0,0 +1,70 @@
+"""Текстовая капча без хранения состояния на сервере.
+
+Правильный ответ не кладётся в сессию: клиент получает подписанный токен
+с солью и хэшем ответа. При проверке подпись и срок действия проверяются
+через ``django.core.signing``, а одноразовость — отметкой в кэше.
+Благодаря этому страница регистрации не создаёт строк в django_session.
+"""
+import hashlib
+import hmac
+import secrets
+import string
+
+from django.core import signing
+from django.core.cache import cache
+
+SALT = 'realty.captcha'
+MAX_AGE = 15 * 60
+CHARACTERS = string.ascii_uppercase + string.digits
+
+
+def generate_captcha():
+    """Генерация простой текстовой капчи"""
+    return ''.join(secrets.choice(CHARACTERS) for _ in range(6))
+
+
+def _answer_hash(nonce, answer):
+    return hashlib.sha256(f'{nonce}:{answer.strip().upper()}'.encode()).hexdigest()
+
+
+def issue_captcha():
+    """Новая капча: (текст для показа, подписанный токен)"""
+    text = generate_captcha()
+    nonce = secrets.token_hex(8)
+    token = signing.dumps({'n': nonce, 'h': _answer_hash(nonce, text)}, salt=SALT, compress=True)
+    return text, token
+
+
+def _used_key(nonce):
+    return f'captcha-used:{nonce}'
+
+
+def verify_captcha(token, answer):
+    """Ответ верен и токен ещё не использован: nonce токена или None.
+
+    Токен не расходуется — форма с ошибками может отправляться повторно
+    с той же капчей; после успешной проверки формы вызывается ``use_captcha``.
+    """
+    if not token or not answer:
+        return None
+    try:
+        data = signing.loads(token, salt=SALT, max_age=MAX_AGE)
+    except signing.BadSignature:
+        return None
+    if not hmac.compare_digest(data.get('h', ''), _answer_hash(data.get('n', ''), answer)):
+        return None
+    if cache.get(_used_key(data['n'])):
+        return None
+    return data['n']
+
+
+def use_captcha(nonce):
+    """Отметить токен использованным; False, если его уже использовали"""
+    # cache.add атомарен: повторное использование того же токена не пройдёт
+    return cache.add(_used_key(nonce), True, MAX_AGE)
+
+
+def check_captcha(token, answer):
+    """Проверка ответа; каждый токен принимается только один раз"""
+    nonce = verify_captcha(token, answer)
+    return nonce is not None and use_captcha(nonce)
@@ -0,0 +1,64 @@
+"""Карточки объявлений на главной и в каталоге.
+
+Карточка рендерится из словаря с готовыми строками (``card_rows``), а не
+из модели: объявления читаются одним запросом ``values()`` с путём
+основного фото из подзапроса — без prefetch изображений и ``{% with %}``
+на каждую карточку.
+
+Сетка карточек — один шаблон ``realty/includes/property_cards.html``.
+В нём только ``for``/``if`` и вывод переменных — синтаксис, общий для
+Django и Jinja2, поэтому один и тот же файл рендерит любой из движков:
+``CARD_TEMPLATE_ENGINE = 'jinja2'`` (если установлен Jinja2) ускоряет
+самую горячую часть страниц, остальная разметка остаётся на Django.
+"""
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import OuterRef, Subquery
+from django.template import engines
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.safestring import mark_safe
+
+from .models import Property, PropertyImage
+
+CARD_TEMPLATE = 'realty/includes/property_cards.html'
+CARD_FIELDS = ('pk', 'title', 'price', 'property_type', 'area', 'rooms', 'location', 'views', 'created_at')
+TYPE_LABELS = dict(Property.PROPERTY_TYPES)
+
+
+def format_price(price):
+    return '{:,.0f}'.format(price).replace(',', ' ')
+
+
+def card_values(queryset):
+    """Поля карточки и путь основного фото (как ``Property.main_image``) одним запросом"""
+    main_image = (
+        PropertyImage.objects.filter(property=OuterRef('pk')).order_by('-is_main', 'pk').values('image')[:1]
+    )
+    return queryset.values(*CARD_FIELDS, image=Subquery(main_image))
+
+
+def card_rows(rows):
+    """Словари ``card_values`` → строки для шаблона карточки"""
+    return [
+        {
+            'pk': row['pk'],
+            'url': reverse('property_detail', args=[row['pk']]),
+            'title': row['title'],
+            'price': format_price(row['price']),
+            'property_type': TYPE_LABELS.get(row['property_type'], row['property_type']),
+            'area': '{:g}'.format(row['area']).replace('.', ','),
+            'rooms': row['rooms'] or '',
+            'location': row['location'],
+            'views': row['views'],
+            'created': timezone.localtime(row['created_at']).strftime('%d.%m.%Y'),
+            'image_url': default_storage.url(row['image']) if row['image'] else '',
+        }
+        for row in rows
+    ]
+
+
+def render_cards(cards, variant='catalog', engine=None):
+    """HTML сетки карточек; variant — 'catalog' или 'home'"""
+    template = engines[engine or getattr(settings, 'CARD_TEMPLATE_ENGINE', 'django')].get_template(CARD_TEMPLATE)
+    return mark_safe(template.render({'cards': cards, 'variant': variant}))
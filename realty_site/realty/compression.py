@@ -0,0 +1,164 @@
+"""Сжатие HTML и JSON ответов (Brotli или gzip по Accept-Encoding).
+
+В отличие от ``GZipMiddleware`` поддерживает Brotli (если установлен пакет
+``brotli``) и сжимает потоковые ответы по частям, сбрасывая буфер после
+каждого фрагмента, чтобы клиент получал страницу без задержки.
+Изображения и другие уже сжатые форматы не трогаются; ответы меньше
+``COMPRESSION_MIN_SIZE`` байт отдаются как есть.
+"""
+import re
+import zlib
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DEFAULT_LEVELS = {'br': 4, 'gzip': 6}
+DEFAULT_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml', 'image/svg+xml')
+
+ENCODING_RE = _lazy_re_compile(r'\s*([a-z*]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?', re.I)
+
+
+def accepted_encodings(header):
+    """{'br': 1.0, 'gzip': 0.8} из заголовка Accept-Encoding"""
+    result = {}
+    for part in header.split(','):
+        match = ENCODING_RE.match(part)
+        if match:
+            try:
+                result[match[1].lower()] = float(match[2]) if match[2] else 1.0
+            except ValueError:
+                continue
+    return result
+
+
+def choose_encoding(header):
+    accepted = accepted_encodings(header)
+    available = ('br', 'gzip') if brotli is not None else ('gzip',)
+    best = None
+    for encoding in available:
+        quality = accepted.get(encoding, accepted.get('*', 0))
+        if quality > 0 and (best is None or quality > best[1]):
+            best = (encoding, quality)
+    return best[0] if best else None
+
+
+class Compressor:
+    """Единый интерфейс для потокового сжатия gzip и Brotli"""
+
+    def __init__(self, encoding, level=None):
+        level = level if level is not None else getattr(settings, 'COMPRESSION_LEVELS', DEFAULT_LEVELS)[encoding]
+        self.encoding = encoding
+        if encoding == 'br':
+            self._brotli = brotli.Compressor(quality=level)
+        else:
+            # wbits=31: формат gzip с заголовком и контрольной суммой
+            self._zlib = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        if self.encoding == 'br':
+            return self._brotli.process(data)
+        return self._zlib.compress(data)
+
+    def flush(self):
+        if self.encoding == 'br':
+            return self._brotli.flush()
+        return self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._brotli.finish()
+        return self._zlib.flush(zlib.Z_FINISH)
+
+
+def compress_bytes(data, encoding, level=None):
+    compressor = Compressor(encoding, level)
+    return compressor.compress(data) + compressor.finish()
+
+
+def compress_stream(chunks, encoding):
+    compressor = Compressor(encoding)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+async def compress_async_stream(chunks, encoding):
+    compressor = Compressor(encoding)
+    async for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+def is_compressible(response):
+    content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+    types = getattr(settings, 'COMPRESSION_TYPES', DEFAULT_TYPES)
+    return any(content_type.startswith(prefix) for prefix in types)
+
+
+class CompressionMiddleware:
+    """Сжимает ответ, если клиент это поддерживает и ответ того стоит"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        response = self.get_response(request)
+        return self.process_response(request, response)
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        return self.process_response(request, response)
+
+    def process_response(self, request, response):
+        if (
+            response.status_code != 200
+            or request.method == 'HEAD'
+            or response.has_header('Content-Encoding')
+            or not is_compressible(response)
+        ):
+            return response
+        if not response.streaming and len(response.content) < getattr(settings, 'COMPRESSION_MIN_SIZE', 200):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = compress_async_stream(response.streaming_content, encoding)
+            else:
+                response.streaming_content = compress_stream(response.streaming_content, encoding)
+            del response.headers['Content-Length']
+        else:
+            compressed = compress_bytes(response.content, encoding)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        # Сжатое тело отличается побайтно: сильный ETag становится слабым
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
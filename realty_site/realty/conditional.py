@@ -0,0 +1,179 @@
+"""Условные GET-запросы (ETag / Last-Modified) для каталога.
+
+Версия страницы — счётчик в кэше, а не запрос к базе: сигналы
+``post_save``/``post_delete`` объявлений, фотографий и комментариев
+увеличивают версию каталога (``catalog``) и версию объявления
+(``property:<id>``), пересчёт похожих — версию объявления или общую
+``similar``. Поэтому ответ 304 обходится без запросов и без рендеринга.
+Если ключа нет (вытеснен, перезапуск), версия заводится заново от
+текущего времени и не совпадает ни с одной выданной раньше.
+
+Для нескольких процессов кэш должен быть общим (``DJANGO_REDIS_URL``),
+иначе процесс не увидит изменений, сделанных в другом. Поэтому с кэшем в
+памяти процесса проверка выключена (``CONDITIONAL_GET_ENABLED``), и
+представления отвечают как обычно.
+
+Счётчик просмотров в версию не входит (иначе она менялась бы при каждом
+визите), поэтому в закэшированной браузером странице он может отставать.
+Каталог с сортировкой по просмотрам условные запросы не обслуживает.
+Изменения через ``QuerySet.update()`` и ``bulk_create`` сигналов не
+вызывают — такой код увеличивает версии сам (``bump_versions``).
+"""
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from .models import Property
+from .unread import peek
+
+
+def make_etag(*parts):
+    return quote_etag(hashlib.md5(repr(parts).encode()).hexdigest())
+
+
+def viewer_key(request):
+    """Страницы различаются для вошедших пользователей (и их значка непрочитанных) и для AJAX-запросов"""
+    user = getattr(request, 'user', None)
+    user_id = user.pk if user is not None and user.is_authenticated else 0
+    badge = peek(user_id) if user_id else None
+    return user_id, badge, request.headers.get('x-requested-with') == 'XMLHttpRequest'
+
+
+def version_key(name):
+    return f'page-version:{name}'
+
+
+def current_versions(*names):
+    """Версии по именам одним обращением к кэшу; недостающие заводятся"""
+    keys = [version_key(name) for name in names]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, time.time_ns(), None)
+            found[key] = cache.get(key)
+    return tuple(found[key] for key in keys)
+
+
+def _bump(keys):
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Ключа нет: следующее чтение заведёт новую версию
+            pass
+
+
+def bump_versions(*names):
+    """Увеличить версии сразу и ещё раз после фиксации транзакции.
+
+    Первое увеличение видно внутри транзакции, второе закрывает окно, в
+    котором другой запрос успел бы закэшировать старые данные под новой
+    версией.
+    """
+    keys = [version_key(name) for name in names]
+    _bump(keys)
+    transaction.on_commit(lambda: _bump(keys))
+
+
+def content_changed(sender, instance, **kwargs):
+    """post_save и post_delete объявлений, фотографий и комментариев"""
+    if sender is Property:
+        bump_versions('catalog', f'property:{instance.pk}')
+    else:
+        # Фото показаны и в карточках каталога, комментарии — только на странице объявления
+        names = [f'property:{instance.property_id}']
+        if sender._meta.model_name == 'propertyimage':
+            names.append('catalog')
+        bump_versions(*names)
+
+
+def property_validators(request, pk):
+    """(etag, last_modified) страницы объявления"""
+    return make_etag('detail', pk, viewer_key(request), current_versions(f'property:{pk}', 'similar')), None
+
+
+def listing_validators(request):
+    """Версия выборки каталога или None для сортировки по просмотрам"""
+    if request.GET.get('sort', '').lstrip('-') == 'views':
+        # Порядок зависит от счётчиков просмотров, а они версию не меняют
+        return None
+    return make_etag('list', request.GET.urlencode(), viewer_key(request), current_versions('catalog')), None
+
+
+def finish_response(response, etag, timestamp):
+    if response.status_code in (200, 304):
+        response.headers.setdefault('ETag', etag)
+        if timestamp is not None:
+            response.headers.setdefault('Last-Modified', http_date(timestamp))
+        # Браузер хранит копию, но перепроверяет её при каждом запросе
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ('Cookie', 'X-Requested-With'))
+    return response
+
+
+def skip_validation(request):
+    if not getattr(settings, 'CONDITIONAL_GET_ENABLED', True):
+        return True
+    # Непоказанные flash-сообщения должны попасть в страницу
+    return request.method not in ('GET', 'HEAD') or CookieStorage.cookie_name in request.COOKIES
+
+
+def conditional_view(validators, on_not_modified=None):
+    """Декоратор: 304 по If-None-Match / If-Modified-Since для GET и HEAD.
+
+    ``validators(request, *args, **kwargs)`` возвращает (etag, last_modified)
+    или None; ``on_not_modified`` выполняется вместо представления при 304.
+    Для async-представлений обе функции выполняются через ``sync_to_async``.
+    """
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if skip_validation(request):
+                    return await view(request, *args, **kwargs)
+                found = await sync_to_async(validators)(request, *args, **kwargs)
+                if found is None:
+                    return await view(request, *args, **kwargs)
+                etag, last_modified = found
+                timestamp = int(last_modified.timestamp()) if last_modified else None
+
+                response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+                if response is not None:
+                    if on_not_modified is not None:
+                        await sync_to_async(on_not_modified)(request, *args, **kwargs)
+                else:
+                    response = await view(request, *args, **kwargs)
+                return finish_response(response, etag, timestamp)
+
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if skip_validation(request):
+                return view(request, *args, **kwargs)
+            found = validators(request, *args, **kwargs)
+            if found is None:
+                return view(request, *args, **kwargs)
+            etag, last_modified = found
+            timestamp = int(last_modified.timestamp()) if last_modified else None
+
+            response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+            if response is not None:
+                if on_not_modified is not None:
+                    on_not_modified(request, *args, **kwargs)
+            else:
+                response = view(request, *args, **kwargs)
+            return finish_response(response, etag, timestamp)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,14 @@
+from django.conf import settings
+
+from .unread import peek
+
+
+def unread_messages(request):
+    """Значок непрочитанных в меню: только кэш, без запросов к базе"""
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return {}
+    return {
+        'unread_messages_count': peek(user.pk),
+        'unread_poll_interval': getattr(settings, 'UNREAD_POLL_INTERVAL', 60),
+    }
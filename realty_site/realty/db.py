@@ -0,0 +1,112 @@
+"""Настройка соединений с базой данных.
+
+Для SQLite при каждом новом соединении выполняются PRAGMA из
+``SQLITE_PRAGMAS``: журнал WAL позволяет читать во время записи,
+``synchronous=NORMAL`` убирает fsync на каждый коммит, ``busy_timeout``
+заставляет ждать блокировку вместо мгновенной ошибки ``database is locked``.
+
+``gather_queries`` выполняет независимые запросы async-представления
+параллельно, каждый в своём потоке и со своим соединением, если включён
+``ASYNC_PARALLEL_QUERIES`` (по умолчанию выключен: на SQLite отдельные
+соединения медленнее, чем те же запросы подряд).
+"""
+import asyncio
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+DEFAULT_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 128 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+
+def sqlite_pragmas():
+    pragmas = dict(DEFAULT_SQLITE_PRAGMAS)
+    pragmas.update(getattr(settings, 'SQLITE_PRAGMAS', {}))
+    return pragmas
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """Обработчик сигнала connection_created"""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in sqlite_pragmas().items():
+            if value is not None:
+                cursor.execute(f'PRAGMA {name} = {value}')
+
+
+class QueryLogForwarder:
+    """execute_wrapper соединения потока: запросы пишутся в журнал соединения запроса.
+
+    Так их видят ``CaptureQueriesContext``, тесты с ``assertNumQueries``
+    и бенчмарки, хотя выполнены они на другом соединении.
+    """
+
+    def __init__(self, target):
+        self.target = target
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.monotonic()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            if not many:
+                sql = context['connection'].ops.last_executed_query(context['cursor'], sql, params)
+            self.target.queries_log.append({'sql': sql, 'time': f'{time.monotonic() - started:.3f}'})
+
+
+def _request_connections():
+    """(в транзакции ли запрос, {alias: (обёртки execute, соединение с журналом или None)})"""
+    hooks = {
+        connection.alias: (list(connection.execute_wrappers), connection if connection.queries_logged else None)
+        for connection in connections.all(initialized_only=True)
+    }
+    return connections['default'].in_atomic_block, hooks
+
+
+def _run_in_own_connection(func, hooks):
+    with ExitStack() as stack:
+        # Детектор N+1 и подсчёт запросов стоят на соединениях запроса — ставим их и сюда
+        for alias, (wrappers, logged_to) in hooks.items():
+            if not wrappers and logged_to is None:
+                continue
+            connection = connections[alias]
+            # PRAGMA нового соединения — не запросы представления
+            connection.ensure_connection()
+            for wrapper in wrappers:
+                stack.enter_context(connection.execute_wrapper(wrapper))
+            if logged_to is not None:
+                stack.enter_context(connection.execute_wrapper(QueryLogForwarder(logged_to)))
+        try:
+            return func()
+        finally:
+            # Поток из пула переиспользуется: соединение закрываем по CONN_MAX_AGE, как после запроса
+            close_old_connections()
+
+
+async def gather_queries(*funcs):
+    """Результаты синхронных функций с запросами к базе — в порядке аргументов.
+
+    Async ORM выполняет все запросы запроса в одном потоке, поэтому
+    ``asyncio.gather`` над ним не даёт параллельности. С
+    ``ASYNC_PARALLEL_QUERIES`` функции выполняются в пуле потоков, каждая
+    на своём соединении. Без него, внутри транзакции (и в тестах) —
+    последовательно на соединении запроса: другие соединения не видят
+    её незафиксированных данных.
+    """
+    if len(funcs) < 2 or not getattr(settings, 'ASYNC_PARALLEL_QUERIES', False):
+        return [await sync_to_async(func)() for func in funcs]
+    in_transaction, hooks = await sync_to_async(_request_connections)()
+    if in_transaction:
+        return [await sync_to_async(func)() for func in funcs]
+    return await asyncio.gather(*(
+        sync_to_async(_run_in_own_connection, thread_sensitive=False)(func, hooks) for func in funcs
+    ))
@@ -1,50 +1,10 @@
 from django import forms
+from django.conf import settings
 from django.contrib.auth.forms import UserCreationForm
 from django.core.exceptions import ValidationError
 import re
 from .models import CustomUser, Property, Comment, Message, Blacklist, PropertyImage
-
-
-class CustomUserCreationForm(UserCreationForm):
-    email = forms.EmailField(required=True, label='Email')
-    first_name = forms.CharField(max_length=30, required=True, label='Имя')
-    last_name = forms.CharField(max_length=30, required=True, label='Фамилия')
-    phone = forms.CharField(max_length=20, required=False, label='Телефон')
-    bio = forms.CharField(widget=forms.Textarea(attrs={'rows': 4}), required=False, label='О себе')
-    gender = forms.ChoiceField(choices=CustomUser.GENDER_CHOICES, required=False, label='Пол')
-
-    class Meta:
-        model = CustomUser
-        fields = ('username', 'email', 'first_name', 'last_name', 'user_type',
-                  'gender', 'phone', 'bio', 'password1', 'password2')
-
-    def clean_username(self):
-        username = self.cleaned_data.get('username')
-        if CustomUser.objects.filter(username=username).exists():
-            raise ValidationError("Этот логин уже занят")
-        if len(username) < 3:
-            raise ValidationError("Логин должен содержать не менее 3 символов")
-        return username
-
-    def clean_email(self):
-        email = self.cleaned_data.get('email')
-        if CustomUser.objects.filter(email=email).exists():
-            raise ValidationError("Этот email уже используется")
-        return email
-
-    def clean_password1(self):
-        password1 = self.cleaned_data.get('password1')
-        if len(password1) < 5:
-            raise ValidationError("Пароль должен содержать не менее 5 символов")
-        if not re.search(r'[A-Za-z]', password1) or not re.search(r'[0-9]', password1):
-            raise ValidationError("Пароль должен содержать как буквы, так и цифры")
-        return password1
-
-    def clean_phone(self):
-        phone = self.cleaned_data.get('phone')
-        if phone and not re.match(r'^[\d\s\-\+\(\)]+$', phone):
-            raise ValidationError("Введите корректный номер телефона")
-        return phone
+from .availability import availability
 
 
 class ProfileUpdateForm(forms.ModelForm):
@@ -117,7 +77,11 @@ class CustomUserCreationForm(UserCreationForm):
 
     def clean_username(self):
         username = self.cleaned_data.get('username')
-        if CustomUser.objects.filter(username=username).exists():
+        # Логин служебной учётной записи уведомлений (и запасные kupidom_N) зарезервирован
+        sender = re.escape(getattr(settings, 'NOTIFICATIONS_SENDER_USERNAME', 'kupidom'))
+        if re.fullmatch(rf'{sender}(_\d+)?', username, re.IGNORECASE):
+            raise ValidationError("Этот логин зарезервирован")
+        if availability.username_taken(username):
             raise ValidationError("Этот логин уже занят")
         if len(username) < 3:
             raise ValidationError("Логин должен содержать не менее 3 символов")
@@ -125,10 +89,15 @@ class CustomUserCreationForm(UserCreationForm):
 
     def clean_email(self):
         email = self.cleaned_data.get('email')
-        if CustomUser.objects.filter(email=email).exists():
+        if availability.email_taken(email):
             raise ValidationError("Этот email уже используется")
         return email
 
+    def validate_unique(self):
+        # Логин и email уже проверены в clean_username/clean_email без лишних запросов;
+        # одновременную регистрацию отсекают уникальные индексы (IntegrityError во view)
+        pass
+
     def clean_password1(self):
         password1 = self.cleaned_data.get('password1')
         if len(password1) < 5:
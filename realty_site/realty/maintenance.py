@@ -0,0 +1,201 @@
+"""Обслуживание базы: удаления порциями вне обработки запроса.
+
+* Очистка переписки после добавления в черный список. Запись ``Blacklist``
+  с ``messages_purged=False`` служит заданием: после коммита его
+  выполняет фоновый поток, а оставшиеся (например, после перезапуска
+  процесса) подбирает команда ``run_maintenance``.
+* Политика хранения сообщений: сообщения старше ``MESSAGE_RETENTION_DAYS``
+  выгружаются в сжатые JSON Lines файлы и удаляются порциями.
+
+Каждая порция удаляется отдельной короткой транзакцией, поэтому таблица
+сообщений не блокируется надолго даже при длинной истории.
+"""
+import gzip
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from . import unread
+from .models import Blacklist, Message
+
+logger = logging.getLogger('realty.maintenance')
+
+DEFAULT_BATCH_SIZE = 500
+
+
+def _noop_progress(done, total):
+    pass
+
+
+def delete_in_batches(queryset, batch_size=DEFAULT_BATCH_SIZE, sleep=0, progress=_noop_progress, should_stop=None):
+    """Удаляет строки по ``batch_size`` id за транзакцию; возвращает число удалённых"""
+    total = queryset.count()
+    deleted = 0
+    while should_stop is None or not should_stop():
+        ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            break
+        with transaction.atomic():
+            count, _ = queryset.model.objects.filter(pk__in=ids).delete()
+        deleted += count
+        progress(deleted, total)
+        if sleep:
+            time.sleep(sleep)
+    return deleted
+
+
+def purge_blocked_messages(blacklist_id, batch_size=DEFAULT_BATCH_SIZE, sleep=0, progress=_noop_progress):
+    """Удаляет сообщения заблокированного пользователя владельцу черного списка"""
+    entry = Blacklist.objects.filter(pk=blacklist_id, messages_purged=False).first()
+    if entry is None:
+        return 0
+    queryset = Message.objects.filter(sender_id=entry.blocked_user_id, receiver_id=entry.user_id)
+    # Если пользователя успели разблокировать, прекращаем удаление
+    still_blocked = lambda: Blacklist.objects.filter(pk=blacklist_id).exists()
+    deleted = delete_in_batches(queryset, batch_size, sleep, progress, should_stop=lambda: not still_blocked())
+    Blacklist.objects.filter(pk=blacklist_id).update(messages_purged=True)
+    if deleted:
+        unread.invalidate([entry.user_id])
+    return deleted
+
+
+def purge_pending_blacklists(batch_size=DEFAULT_BATCH_SIZE, sleep=0, progress=_noop_progress):
+    total = 0
+    for blacklist_id in Blacklist.objects.filter(messages_purged=False).values_list('pk', flat=True):
+        total += purge_blocked_messages(blacklist_id, batch_size, sleep, progress)
+    return total
+
+
+def create_archive(archive_dir, stem):
+    """Новый файл ``stem.jsonl.gz`` (или ``stem-N``, если имя занято) — существующий не перезаписывается"""
+    for attempt in itertools.count():
+        path = archive_dir / (f'{stem}-{attempt}.jsonl.gz' if attempt else f'{stem}.jsonl.gz')
+        try:
+            return path, gzip.open(path, 'xt', encoding='utf-8')
+        except FileExistsError:
+            continue
+
+
+def archive_old_messages(days=None, archive_dir=None, batch_size=DEFAULT_BATCH_SIZE, sleep=0,
+                         progress=_noop_progress, dry_run=False):
+    """Выгружает сообщения старше ``days`` дней в .jsonl.gz и удаляет их.
+
+    Возвращает (число сообщений, путь к архиву). Каждая порция сначала
+    записывается в архив и только потом удаляется.
+    """
+    days = days if days is not None else getattr(settings, 'MESSAGE_RETENTION_DAYS', None)
+    if not days:
+        return 0, None
+    cutoff = timezone.now() - timedelta(days=days)
+    queryset = Message.objects.filter(created_at__lt=cutoff)
+    total = queryset.count()
+    if dry_run or not total:
+        return total, None
+
+    archive_dir = Path(archive_dir or settings.MESSAGE_ARCHIVE_DIR)
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    # Два запуска в одну секунду получат разные файлы
+    path, archive = create_archive(archive_dir, f'messages-{timezone.now():%Y%m%d-%H%M%S}')
+
+    done = 0
+    last_id = 0
+    fields = ('id', 'sender_id', 'receiver_id', 'content', 'created_at', 'is_read')
+    with archive:
+        while True:
+            rows = list(queryset.filter(pk__gt=last_id).order_by('pk').values(*fields)[:batch_size])
+            if not rows:
+                break
+            for row in rows:
+                row['created_at'] = row['created_at'].isoformat()
+                archive.write(json.dumps(row, ensure_ascii=False) + '\n')
+            archive.flush()
+            last_id = rows[-1]['id']
+            with transaction.atomic():
+                Message.objects.filter(pk__in=[row['id'] for row in rows]).delete()
+                unread.adjust({
+                    receiver_id: -count for receiver_id, count in
+                    Counter(row['receiver_id'] for row in rows if not row['is_read']).items()
+                })
+            done += len(rows)
+            progress(done, total)
+            if sleep:
+                time.sleep(sleep)
+    return done, path
+
+
+def run_in_background(func, *args, **kwargs):
+    """Запуск задачи в фоновом потоке со своим соединением с базой"""
+
+    def target():
+        try:
+            func(*args, **kwargs)
+        except Exception:
+            logger.exception('Ошибка фоновой задачи %s', func.__name__)
+        finally:
+            connections.close_all()
+
+    thread = threading.Thread(target=target, name=f'realty-{func.__name__}', daemon=True)
+    thread.start()
+    return thread
+
+
+class BackgroundBatcher:
+    """Очередь ключей для фоновой обработки после коммита.
+
+    Пока поток обрабатывает пачку, новые ключи копятся и уходят следующей
+    пачкой, поэтому частые изменения не порождают по потоку на каждое.
+    Обработку можно отключить настройкой ``setting`` (тогда работает
+    только соответствующая management-команда).
+    """
+
+    def __init__(self, handler, setting):
+        self.handler = handler
+        self.setting = setting
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._running = False
+
+    def _drain(self):
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._running = False
+                    return
+                batch = set(self._pending)
+                self._pending.clear()
+            try:
+                self.handler(batch)
+            except Exception:
+                with self._lock:
+                    self._running = False
+                raise
+
+    def schedule(self, keys):
+        if not keys or not getattr(settings, self.setting, True):
+            return
+
+        def enqueue():
+            with self._lock:
+                self._pending.update(keys)
+                if self._running:
+                    return
+                self._running = True
+            run_in_background(self._drain)
+
+        transaction.on_commit(enqueue)
+
+
+def schedule_blacklist_purge(blacklist):
+    """Очистка после коммита: в фоне или (BLACKLIST_PURGE_IN_BACKGROUND=False) только командой"""
+    if not getattr(settings, 'BLACKLIST_PURGE_IN_BACKGROUND', True):
+        return
+    transaction.on_commit(lambda: run_in_background(purge_blocked_messages, blacklist.pk))
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from realty.recommendations import rebuild_all, top_k
+
+
+class Command(BaseCommand):
+    help = 'Полный пересчёт похожих объявлений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--k', type=int, default=None, help='Сколько похожих хранить (по умолчанию RECOMMENDATIONS_K)')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+
+        def progress(done, total):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'  {done}/{total}')
+
+        total = rebuild_all(k=options['k'] or top_k(), progress=progress)
+        self.stdout.write(f'Похожие объявления пересчитаны для {total} объектов '
+                          f'за {time.perf_counter() - started:.1f} с')
@@ -0,0 +1,237 @@
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from realty.models import CustomUser, Property, PropertyImage, Comment, Message, Blacklist, UserSearchToken
+from realty.recipients import user_tokens
+
+FIRST_NAMES = ['Анна', 'Иван', 'Мария', 'Дмитрий', 'Елена', 'Алексей', 'Ольга', 'Сергей', 'Наталья', 'Павел']
+LAST_NAMES = ['Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров', 'Соколов', 'Михайлов', 'Новиков', 'Фёдоров']
+CITIES = ['Москва', 'Санкт-Петербург', 'Казань', 'Екатеринбург', 'Новосибирск', 'Уфа', 'Самара', 'Сочи']
+STREETS = ['Ленина', 'Мира', 'Садовая', 'Центральная', 'Лесная', 'Школьная', 'Набережная', 'Советская']
+TITLES = {
+    'apartment': ['Квартира в центре', 'Студия у метро', 'Квартира с ремонтом', 'Просторная квартира'],
+    'house': ['Дом с участком', 'Коттедж у леса', 'Дача у реки', 'Таунхаус'],
+    'land': ['Участок ИЖС', 'Земля под застройку', 'Участок у озера'],
+    'commercial': ['Офис', 'Торговое помещение', 'Склад', 'Помещение свободного назначения'],
+}
+IMAGE_FILES = ['property_images/kv1.jpg', 'property_images/kv2.jpg', 'property_images/banya.jpg']
+WORDS = ['здравствуйте', 'объект', 'ещё', 'актуален', 'можно', 'посмотреть', 'завтра', 'цена', 'торг', 'спасибо']
+
+# Объёмы по умолчанию (при --scale 1)
+DEFAULT_COUNTS = {
+    'users': 10_000,
+    'properties': 50_000,
+    'images': 200_000,
+    'messages': 1_000_000,
+    'comments': 100_000,
+    'blacklists': 5_000,
+}
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+@contextmanager
+def explicit_timestamps(*fields):
+    """Временно отключает auto_now/auto_now_add, чтобы задать даты вручную"""
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = 'Генерация детерминированного синтетического набора данных для бенчмарков'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1.0,
+                            help='Множитель объёмов (0.01 — быстрый прогон)')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--days', type=int, default=730,
+                            help='За сколько дней распределять даты создания')
+        parser.add_argument('--clear', action='store_true',
+                            help='Удалить существующие данные (кроме суперпользователей)')
+        for name, count in DEFAULT_COUNTS.items():
+            parser.add_argument(f'--{name}', type=int, default=None,
+                                help=f'Количество ({count} при --scale 1)')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.verbosity = options['verbosity']
+        self.now = timezone.now().replace(microsecond=0)
+        self.days = options['days']
+        counts = {
+            name: options[name] if options[name] is not None else max(1, int(count * options['scale']))
+            for name, count in DEFAULT_COUNTS.items()
+        }
+
+        if options['clear']:
+            self.clear()
+
+        user_ids, realtor_ids = self.create_users(counts['users'])
+        property_ids = self.create_properties(counts['properties'], realtor_ids)
+        self.create_images(counts['images'], property_ids)
+        self.create_comments(counts['comments'], property_ids, user_ids)
+        self.create_messages(counts['messages'], user_ids, realtor_ids)
+        self.create_blacklists(counts['blacklists'], user_ids)
+        self.stdout.write(self.style.SUCCESS(f'Готово: {counts}'))
+
+    def clear(self):
+        for model in (Message, Comment, PropertyImage, Property, Blacklist):
+            model.objects.all().delete()
+        CustomUser.objects.filter(is_superuser=False).delete()
+
+    def random_date(self):
+        return self.now - timedelta(seconds=self.rng.randrange(self.days * 86400))
+
+    def bulk(self, model, objects, total, **kwargs):
+        """bulk_create порциями с выводом прогресса"""
+        created = 0
+        for batch in batched(objects, self.batch_size):
+            with transaction.atomic():
+                model.objects.bulk_create(batch, batch_size=self.batch_size, **kwargs)
+            created += len(batch)
+            if self.verbosity > 1:
+                self.stdout.write(f'  {model.__name__}: {created}/{total}')
+        self.stdout.write(f'{model.__name__}: создано {created}')
+
+    def create_users(self, count):
+        # Хэш считаем один раз: у всех синтетических пользователей пароль bench12345
+        password = make_password('bench12345')
+        start = CustomUser.objects.count()
+
+        def objects():
+            for i in range(count):
+                first = self.rng.choice(FIRST_NAMES)
+                last = self.rng.choice(LAST_NAMES)
+                yield CustomUser(
+                    username=f'bench_user{start + i:06d}',
+                    email=f'bench_user{start + i:06d}@example.com',
+                    first_name=first,
+                    last_name=last,
+                    password=password,
+                    user_type='realtor' if self.rng.random() < 0.2 else 'client',
+                    gender=self.rng.choice('MF'),
+                )
+
+        self.bulk(CustomUser, objects(), count)
+        users = CustomUser.objects.filter(username__startswith='bench_user').order_by('id')
+        # bulk_create не вызывает post_save — слова для поиска получателей создаём сами
+        tokens = (
+            UserSearchToken(user_id=user.id, token=token)
+            for user in users.filter(search_tokens__isnull=True).only('id', 'username', 'first_name', 'last_name')
+            for token in user_tokens(user)
+        )
+        self.bulk(UserSearchToken, tokens, count * 5, ignore_conflicts=True)
+        user_ids = list(users.values_list('id', flat=True))
+        realtor_ids = list(users.filter(user_type='realtor').values_list('id', flat=True)) or user_ids
+        return user_ids, realtor_ids
+
+    def create_properties(self, count, realtor_ids):
+        def objects():
+            for _ in range(count):
+                property_type = self.rng.choice(list(TITLES))
+                area = round(self.rng.uniform(18, 250), 1)
+                rooms = None if property_type == 'land' else self.rng.randint(1, 6)
+                created_at = self.random_date()
+                status = self.rng.choices(['active', 'sold', 'hidden'], weights=[80, 15, 5])[0]
+                sold_at = None
+                if status == 'sold':
+                    sold_at = min(self.now, created_at + timedelta(days=self.rng.randint(3, 180)))
+                yield Property(
+                    title=self.rng.choice(TITLES[property_type]),
+                    description=' '.join(self.rng.choices(WORDS, k=40)),
+                    price=int(area * self.rng.uniform(60_000, 400_000)) // 1000 * 1000,
+                    property_type=property_type,
+                    area=area,
+                    rooms=rooms,
+                    location=f'{self.rng.choice(CITIES)}, ул. {self.rng.choice(STREETS)}, {self.rng.randint(1, 120)}',
+                    created_by_id=self.rng.choice(realtor_ids),
+                    status=status,
+                    sold_at=sold_at,
+                    views=self.rng.randint(0, 5000),
+                    created_at=created_at,
+                    updated_at=created_at,
+                )
+
+        first_id = (Property.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+        fields = [Property._meta.get_field('created_at'), Property._meta.get_field('updated_at')]
+        with explicit_timestamps(*fields):
+            self.bulk(Property, objects(), count)
+        return list(Property.objects.filter(id__gte=first_id).values_list('id', flat=True))
+
+    def create_images(self, count, property_ids):
+        def objects():
+            # Первое изображение каждого объекта — основное, остальные распределяются случайно
+            for i in range(count):
+                if i < len(property_ids):
+                    yield PropertyImage(property_id=property_ids[i], image=self.rng.choice(IMAGE_FILES), is_main=True)
+                else:
+                    yield PropertyImage(property_id=self.rng.choice(property_ids), image=self.rng.choice(IMAGE_FILES))
+
+        self.bulk(PropertyImage, objects(), count)
+
+    def create_comments(self, count, property_ids, user_ids):
+        def objects():
+            for _ in range(count):
+                yield Comment(
+                    property_id=self.rng.choice(property_ids),
+                    author_id=self.rng.choice(user_ids),
+                    text=' '.join(self.rng.choices(WORDS, k=12)),
+                    created_at=self.random_date(),
+                )
+
+        with explicit_timestamps(Comment._meta.get_field('created_at')):
+            self.bulk(Comment, objects(), count)
+
+    def create_messages(self, count, user_ids, realtor_ids):
+        # Переписка сосредоточена в диалогах: у каждого пользователя несколько собеседников
+        dialogue_count = max(1, count // 20)
+        dialogues = [
+            (self.rng.choice(user_ids), self.rng.choice(realtor_ids))
+            for _ in range(dialogue_count)
+        ]
+        dialogues = [(a, b) for a, b in dialogues if a != b] or [(user_ids[0], realtor_ids[-1])]
+
+        def objects():
+            for _ in range(count):
+                sender, receiver = self.rng.choice(dialogues)
+                if self.rng.random() < 0.5:
+                    sender, receiver = receiver, sender
+                yield Message(
+                    sender_id=sender,
+                    receiver_id=receiver,
+                    content=' '.join(self.rng.choices(WORDS, k=self.rng.randint(2, 20))),
+                    created_at=self.random_date(),
+                    is_read=self.rng.random() < 0.7,
+                )
+
+        with explicit_timestamps(Message._meta.get_field('created_at')):
+            self.bulk(Message, objects(), count)
+
+    def create_blacklists(self, count, user_ids):
+        if len(user_ids) < 2:
+            return
+        pairs = set()
+        attempts = 0
+        while len(pairs) < count and attempts < count * 10:
+            attempts += 1
+            pairs.add(tuple(self.rng.sample(user_ids, 2)))
+        objects = (Blacklist(user_id=user, blocked_user_id=blocked) for user, blocked in sorted(pairs))
+        self.bulk(Blacklist, objects, len(pairs), ignore_conflicts=True)
@@ -0,0 +1,37 @@
+import time
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = 'Удаление просроченных сессий порциями (не блокирует таблицу надолго)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--sleep', type=float, default=0.0,
+                            help='Пауза между порциями, секунды')
+
+    def handle(self, *args, **options):
+        if settings.SESSION_ENGINE.endswith('signed_cookies'):
+            self.stdout.write('Сессии хранятся в cookie — удалять нечего')
+            return
+
+        now = timezone.now()
+        total = 0
+        while True:
+            keys = list(
+                Session.objects.filter(expire_date__lt=now)
+                .values_list('session_key', flat=True)[:options['batch_size']]
+            )
+            if not keys:
+                break
+            deleted, _ = Session.objects.filter(session_key__in=keys).delete()
+            total += deleted
+            if options['verbosity'] > 1:
+                self.stdout.write(f'  удалено {total}')
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        self.stdout.write(f'Удалено просроченных сессий: {total}')
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from realty.analytics import rebuild_all
+
+
+class Command(BaseCommand):
+    help = 'Полный пересчёт сводки рынка (цена за м², сроки продажи)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Сколько объявлений читать из базы за раз')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+
+        def progress(done, total):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'  {done}/{total}')
+
+        groups = rebuild_all(chunk_size=options['chunk_size'], progress=progress)
+        self.stdout.write(f'Сводка пересчитана: {groups} групп за {time.perf_counter() - started:.1f} с')
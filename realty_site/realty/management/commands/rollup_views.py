@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from realty.viewstats import purge_old, rollup
+
+
+class Command(BaseCommand):
+    help = 'Свёртка журнала просмотров в почасовую и посуточную статистику'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=10000,
+                            help='Сколько событий сворачивать в одной транзакции')
+        parser.add_argument('--purge', action='store_true',
+                            help='Удалить свёрнутые события и почасовую статистику старше срока хранения')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        events = rollup(chunk_size=options['chunk_size'])
+        self.stdout.write(f'Свёрнуто событий: {events} за {time.perf_counter() - started:.1f} с')
+        if options['purge']:
+            purged_events, purged_hours = purge_old()
+            self.stdout.write(f'Удалено событий: {purged_events}, почасовых строк: {purged_hours}')
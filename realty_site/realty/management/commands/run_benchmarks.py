@@ -0,0 +1,132 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from realty.benchmarks import (
+    run_benchmarks, run_write_benchmark, run_ratelimit_benchmark, run_compression_benchmark, run_server_mode_benchmark,
+    run_template_benchmark,
+    save_report, load_report, compare_reports,
+)
+
+
+class Command(BaseCommand):
+    help = 'Замер задержек, числа запросов и памяти основных страниц'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--only', nargs='*', help='Запускать только сценарии с этими подстроками')
+        parser.add_argument('--output', help='Сохранить результаты в JSON')
+        parser.add_argument('--compare', help='JSON предыдущего прогона для сравнения')
+        parser.add_argument('--writes', action='store_true',
+                            help='Параллельная запись вместо замера страниц')
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--ratelimit', action='store_true',
+                            help='Накладные расходы ограничителя частоты')
+        parser.add_argument('--compression', action='store_true',
+                            help='Время сжатия и размер страниц для gzip и Brotli')
+        parser.add_argument('--server-modes', action='store_true',
+                            help='Нагрузочный тест: одни и те же страницы под WSGI и ASGI')
+        parser.add_argument('--templates', action='store_true',
+                            help='Рендеров в секунду страницы каталога с 12 и 48 карточками')
+        parser.add_argument('--concurrency', type=int, default=32,
+                            help='Одновременных клиентов для --server-modes')
+        parser.add_argument('--workers', type=int, default=8,
+                            help='Потоков-воркеров WSGI для --server-modes')
+        parser.add_argument('--duration', type=float, default=5.0)
+
+    def handle(self, *args, **options):
+        if options['writes']:
+            return self.handle_writes(options)
+        if options['ratelimit']:
+            for key, value in run_ratelimit_benchmark().items():
+                self.stdout.write(f'{key}: {value}')
+            return
+
+        if options['compression']:
+            return self.handle_compression(options)
+
+        if options['server_modes']:
+            return self.handle_server_modes(options)
+
+        if options['templates']:
+            return self.handle_templates(options)
+
+        # DEBUG и детектор N+1 искажают замеры — отключаем их на время прогона
+        with override_settings(DEBUG=False, NPLUSONE_ENABLED=False, ALLOWED_HOSTS=['localhost']):
+            report = run_benchmarks(repeat=options['repeat'], warmup=options['warmup'], only=options['only'])
+
+        if not report['results']:
+            raise CommandError('Нет сценариев: сгенерируйте данные командой generate_synthetic_data')
+
+        self.stdout.write(f"{'сценарий':<34} {'p50, мс':>9} {'p95, мс':>9} {'запросы':>8} {'память, КБ':>11}")
+        for name, result in report['results'].items():
+            self.stdout.write(
+                f"{name:<34} {result['p50_ms']:>9} {result['p95_ms']:>9} "
+                f"{result['queries']:>8} {result['peak_memory_kb']:>11}"
+            )
+
+        if options['output']:
+            save_report(report, options['output'])
+            self.stdout.write(self.style.SUCCESS(f"Результаты сохранены в {options['output']}"))
+
+        if options['compare']:
+            for line in compare_reports(load_report(options['compare']), report):
+                self.stdout.write(line)
+
+    def handle_writes(self, options):
+        with override_settings(DEBUG=False, NPLUSONE_ENABLED=False, ALLOWED_HOSTS=['localhost']):
+            result = run_write_benchmark(threads=options['threads'], duration=options['duration'])
+        if result is None:
+            raise CommandError('Нет активных объектов: сгенерируйте данные командой generate_synthetic_data')
+        for key, value in result.items():
+            self.stdout.write(f'{key}: {value}')
+        if options['output']:
+            save_report({'writes': result}, options['output'])
+
+    def handle_compression(self, options):
+        with override_settings(DEBUG=False, NPLUSONE_ENABLED=False, ALLOWED_HOSTS=['localhost']):
+            results = run_compression_benchmark()
+        if not results:
+            raise CommandError('Нет сценариев: сгенерируйте данные командой generate_synthetic_data')
+        for name, row in results.items():
+            variants = '  '.join(
+                f"{key}: {value['ms']} мс, {value['bytes']} Б ({value['ratio']:.0%})"
+                for key, value in row.items() if key != 'bytes'
+            )
+            self.stdout.write(f"{name:<34} {row['bytes']:>8} Б  {variants}")
+        if options['output']:
+            save_report({'compression': results}, options['output'])
+
+    def handle_server_modes(self, options):
+        with override_settings(DEBUG=False, NPLUSONE_ENABLED=False, ALLOWED_HOSTS=['localhost']):
+            result = run_server_mode_benchmark(
+                concurrency=options['concurrency'], workers=options['workers'], duration=options['duration'],
+            )
+        if result is None:
+            raise CommandError('Нет сценариев: сгенерируйте данные командой generate_synthetic_data')
+        self.stdout.write(
+            f"{result['concurrency']} клиентов, {result['workers']} воркеров WSGI, {result['database']}"
+        )
+        self.stdout.write(f"{'режим':<6} {'запр/с':>8} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} {'ошибки':>7}")
+        for mode in ('wsgi', 'asgi'):
+            row = result[mode]
+            self.stdout.write(
+                f"{mode:<6} {row['requests_per_second']:>8} {row['p50_ms']:>9} {row['p95_ms']:>9} "
+                f"{row['p99_ms']:>9} {row['errors']:>7}"
+            )
+            for name, p50 in row['scenarios'].items():
+                self.stdout.write(f'    {name:<24} p50 {p50} мс')
+        if options['output']:
+            save_report({'server_modes': result}, options['output'])
+
+    def handle_templates(self, options):
+        with override_settings(DEBUG=False, NPLUSONE_ENABLED=False, ALLOWED_HOSTS=['localhost']):
+            results = run_template_benchmark(duration=options['duration'])
+        if results is None:
+            raise CommandError('Нет активных объектов: сгенерируйте данные командой generate_synthetic_data')
+        for size, row in results.items():
+            self.stdout.write(f'{size} карточек')
+            for name, value in row.items():
+                self.stdout.write(f'    {name:<24} {value:>9} рендеров/с')
+        if options['output']:
+            save_report({'templates': {str(size): row for size, row in results.items()}}, options['output'])
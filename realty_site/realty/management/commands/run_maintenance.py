@@ -0,0 +1,70 @@
+from django.core.management.base import BaseCommand
+
+from realty.archive import archive_properties
+from realty.maintenance import archive_old_messages, purge_pending_blacklists
+from realty.unread import reconcile_recent
+
+
+class Command(BaseCommand):
+    help = 'Очистка сообщений заблокированных пользователей, архивация старых сообщений и объявлений, сверка счётчиков'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--sleep', type=float, default=0.0,
+                            help='Пауза между порциями, секунды')
+        parser.add_argument('--days', type=int, default=None,
+                            help='Срок хранения сообщений (по умолчанию MESSAGE_RETENTION_DAYS)')
+        parser.add_argument('--archive-dir', default=None)
+        parser.add_argument('--skip-blacklists', action='store_true')
+        parser.add_argument('--skip-retention', action='store_true')
+        parser.add_argument('--property-days', type=int, default=None,
+                            help='Через сколько дней проданные и скрытые объявления уходят в архив '
+                                 '(по умолчанию PROPERTY_ARCHIVE_DAYS)')
+        parser.add_argument('--skip-properties', action='store_true')
+        parser.add_argument('--unread-days', type=int, default=14,
+                            help='Сверять счётчики непрочитанных у входивших за столько дней')
+        parser.add_argument('--skip-unread', action='store_true')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только посчитать сообщения и объявления для архивации')
+
+    def progress(self, label):
+        def report(done, total):
+            if self.verbosity > 1 or done == total:
+                self.stdout.write(f'  {label}: {done}/{total}')
+        return report
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        batch = {'batch_size': options['batch_size'], 'sleep': options['sleep']}
+
+        if not options['skip_blacklists']:
+            deleted = purge_pending_blacklists(progress=self.progress('черный список'), **batch)
+            self.stdout.write(f'Удалено сообщений заблокированных пользователей: {deleted}')
+
+        if not options['skip_retention']:
+            count, path = archive_old_messages(
+                days=options['days'], archive_dir=options['archive_dir'], dry_run=options['dry_run'],
+                progress=self.progress('архивация'), **batch,
+            )
+            if options['dry_run']:
+                self.stdout.write(f'Будет архивировано сообщений: {count}')
+            elif path:
+                self.stdout.write(f'Архивировано и удалено сообщений: {count} → {path}')
+            else:
+                self.stdout.write('Архивация: нет сообщений старше срока хранения или срок не задан')
+
+        if not options['skip_properties']:
+            count = archive_properties(
+                days=options['property_days'], batch_size=options['batch_size'], dry_run=options['dry_run'],
+                progress=self.progress('архив объявлений'),
+            )
+            if options['dry_run']:
+                self.stdout.write(f'Будет перенесено в архив объявлений: {count}')
+            else:
+                self.stdout.write(f'Перенесено в архив объявлений: {count}')
+
+        if not options['skip_unread'] and not options['dry_run']:
+            fixed = reconcile_recent(
+                days=options['unread_days'], batch_size=options['batch_size'], progress=self.progress('счётчики'),
+            )
+            self.stdout.write(f'Исправлено счётчиков непрочитанных: {fixed}')
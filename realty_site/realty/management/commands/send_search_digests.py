@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from realty.saved_searches import send_digests
+
+
+class Command(BaseCommand):
+    help = 'Рассылка ежедневной сводки новых объявлений по сохранённым поискам'
+
+    def handle(self, *args, **options):
+        users = send_digests()
+        self.stdout.write(f'Сводки отправлены пользователям: {users}')
@@ -0,0 +1,35 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = 'Копирует основную базу SQLite в файлы-реплики (локальная имитация репликации)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('aliases', nargs='*', help='Какие реплики обновить (по умолчанию все)')
+
+    def handle(self, *args, **options):
+        aliases = options['aliases'] or settings.REPLICA_DATABASES
+        if not aliases:
+            raise CommandError('Реплики не настроены: задайте DJANGO_DB_REPLICAS')
+        if connections['default'].vendor != 'sqlite':
+            raise CommandError('Для PostgreSQL реплики обновляет сам сервер')
+
+        primary = sqlite3.connect(settings.DATABASES['default']['NAME'])
+        try:
+            for alias in aliases:
+                if alias not in settings.REPLICA_DATABASES:
+                    raise CommandError(f'{alias} — не реплика')
+                connections[alias].close()
+                replica = sqlite3.connect(settings.DATABASES[alias]['NAME'])
+                try:
+                    # backup API копирует согласованный снимок даже во время записи
+                    primary.backup(replica)
+                finally:
+                    replica.close()
+                self.stdout.write(f'{alias}: обновлена')
+        finally:
+            primary.close()
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.8 on 2025-11-17 07:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('realty', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='message',
+            options={'ordering': ['created_at']},
+        ),
+        migrations.RemoveField(
+            model_name='message',
+            name='subject',
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='content',
+            field=models.TextField(verbose_name='Сообщение'),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='is_read',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='Dialogue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('participant1', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dialogues1', to=settings.AUTH_USER_MODEL)),
+                ('participant2', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dialogues2', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-updated_at'],
+                'unique_together': {('participant1', 'participant2')},
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:41
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_search_tokens(apps, schema_editor):
+    from realty.recipients import user_tokens
+
+    CustomUser = apps.get_model('realty', 'CustomUser')
+    UserSearchToken = apps.get_model('realty', 'UserSearchToken')
+    batch = []
+    for user in CustomUser.objects.only('id', 'username', 'first_name', 'last_name').iterator(chunk_size=2000):
+        batch.extend(UserSearchToken(user_id=user.id, token=token) for token in user_tokens(user))
+        if len(batch) >= 5000:
+            UserSearchToken.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    UserSearchToken.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('realty', '0002_alter_message_options_remove_message_subject_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=150)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('token', 'user')},
+            },
+        ),
+        migrations.RunPython(fill_search_tokens, migrations.RunPython.noop),
+    ]
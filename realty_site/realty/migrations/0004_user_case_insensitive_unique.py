@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:42
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('realty', '0003_usersearchtoken'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='customuser',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('username'), name='realty_user_username_ci_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='customuser',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('email'), condition=models.Q(('email', ''), _negated=True), name='realty_user_email_ci_unique'),
+        ),
+    ]
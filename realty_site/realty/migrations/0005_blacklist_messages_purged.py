@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('realty', '0004_user_case_insensitive_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blacklist',
+            name='messages_purged',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('realty', '0005_blacklist_messages_purged'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarProperty',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField()),
+                ('property', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_links', to='realty.property')),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_to', to='realty.property')),
+            ],
+            options={
+                'ordering': ['property', 'rank'],
+                'unique_together': {('property', 'similar')},
+            },
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:51
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_sold_at(apps, schema_editor):
+    # Точная дата продажи неизвестна — берём последнее изменение объявления
+    Property = apps.get_model('realty', 'Property')
+    Property.objects.filter(status='sold').update(sold_at=F('updated_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('realty', '0006_similarproperty'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MarketStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('property_type', models.CharField(choices=[('apartment', 'Квартира'), ('house', 'Дом'), ('land', 'Земельный участок'), ('commercial', 'Коммерческая недвижимость')], max_length=20)),
+                ('city', models.CharField(max_length=100)),
+                ('month', models.DateField()),
+                ('count', models.PositiveIntegerField()),
+                ('sold_count', models.PositiveIntegerField()),
+                ('price_m2_median', models.FloatField()),
+                ('price_m2_p25', models.FloatField()),
+                ('price_m2_p75', models.FloatField()),
+                ('price_m2_p90', models.FloatField()),
+                ('days_to_sold_median', models.FloatField(null=True)),
+                ('days_to_sold_avg', models.FloatField(null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['-month', 'property_type', 'city'],
+            },
+        ),
+        migrations.AddField(
+            model_name='property',
+            name='sold_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Продано'),
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(fields=['property_type', 'created_at'], name='realty_prop_propert_4e4fa0_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='marketstats',
+            unique_together={('property_type', 'city', 'month')},
+        ),
+        migrations.RunPython(fill_sold_at, migrations.RunPython.noop),
+    ]
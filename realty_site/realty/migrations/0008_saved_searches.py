@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:53
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('realty', '0007_market_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SavedSearch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('property_type', models.CharField(blank=True, choices=[('apartment', 'Квартира'), ('house', 'Дом'), ('land', 'Земельный участок'), ('commercial', 'Коммерческая недвижимость')], max_length=20, verbose_name='Тип недвижимости')),
+                ('min_price', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True, verbose_name='Цена от')),
+                ('max_price', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True, verbose_name='Цена до')),
+                ('rooms', models.IntegerField(blank=True, null=True, verbose_name='Комнат')),
+                ('search', models.CharField(blank=True, max_length=200, verbose_name='Поиск')),
+                ('notify', models.CharField(choices=[('instant', 'Сразу сообщением'), ('digest', 'Сводкой раз в день')], default='instant', max_length=10, verbose_name='Уведомления')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='saved_searches', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SavedSearchMatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('notified', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('property', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_matches', to='realty.property')),
+                ('saved_search', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='matches', to='realty.savedsearch')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='savedsearch',
+            index=models.Index(fields=['property_type', 'rooms'], name='realty_save_propert_53e1c4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='savedsearch',
+            index=models.Index(fields=['min_price'], name='realty_save_min_pri_2a34f1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='savedsearch',
+            index=models.Index(fields=['max_price'], name='realty_save_max_pri_2b0e22_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='savedsearchmatch',
+            index=models.Index(fields=['notified', 'saved_search'], name='realty_save_notifie_36580f_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='savedsearchmatch',
+            unique_together={('saved_search', 'property')},
+        ),
+    ]
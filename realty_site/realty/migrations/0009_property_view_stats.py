@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('realty', '0008_saved_searches'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupLock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PropertyViewEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('visitor', models.BigIntegerField()),
+                ('viewed_at', models.DateTimeField(db_index=True)),
+                ('rolled_up', models.BooleanField(default=False)),
+                ('property', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='view_events', to='realty.property')),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('rolled_up', False)), fields=['id'], name='realty_viewevent_pending')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PropertyViewStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Час'), ('day', 'День')], max_length=4)),
+                ('bucket', models.DateTimeField()),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('visitors', models.PositiveIntegerField(default=0)),
+                ('visitors_hll', models.BinaryField()),
+                ('property', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='view_stats', to='realty.property')),
+            ],
+            options={
+                'unique_together': {('property', 'period', 'bucket')},
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-19 20:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('realty', '0009_property_view_stats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(fields=['user_type'], name='realty_cust_user_ty_340e26_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['created_at'], name='realty_mess_created_b03342_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(fields=['status'], name='realty_prop_status_7480f9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(fields=['created_at'], name='realty_prop_created_f8801a_idx'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-19 20:06
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('realty', '0010_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedProperty',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('title', models.CharField(max_length=200, verbose_name='Название')),
+                ('description', models.TextField(verbose_name='Описание')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Цена')),
+                ('property_type', models.CharField(choices=[('apartment', 'Квартира'), ('house', 'Дом'), ('land', 'Земельный участок'), ('commercial', 'Коммерческая недвижимость')], max_length=20, verbose_name='Тип недвижимости')),
+                ('area', models.FloatField(verbose_name='Площадь (кв.м)')),
+                ('rooms', models.IntegerField(blank=True, null=True, verbose_name='Количество комнат')),
+                ('location', models.CharField(max_length=300, verbose_name='Местоположение')),
+                ('status', models.CharField(choices=[('active', 'Актуально'), ('sold', 'Продано'), ('hidden', 'Скрыто')], max_length=10, verbose_name='Статус')),
+                ('views', models.IntegerField(default=0, verbose_name='Просмотры')),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('sold_at', models.DateTimeField(blank=True, null=True, verbose_name='Продано')),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('created_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_properties', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Объект в архиве',
+                'verbose_name_plural': 'Архив объектов',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedComment',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('text', models.TextField(verbose_name='Текст комментария')),
+                ('created_at', models.DateTimeField()),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('property', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='comments', to='realty.archivedproperty')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedPropertyImage',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('image', models.ImageField(upload_to='property_images/', verbose_name='Изображение')),
+                ('is_main', models.BooleanField(default=False, verbose_name='Основное изображение')),
+                ('property', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='images', to='realty.archivedproperty')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedproperty',
+            index=models.Index(fields=['property_type', 'created_at'], name='realty_arch_propert_3cba50_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-19 20:37
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import migrations, models
+
+
+def create_sender(apps, schema_editor):
+    # Логин, уже занятый настоящим пользователем, не трогаем — берём свободный с суффиксом
+    CustomUser = apps.get_model('realty', 'CustomUser')
+    base = getattr(settings, 'NOTIFICATIONS_SENDER_USERNAME', 'kupidom')
+    username, suffix = base, 1
+    while CustomUser.objects.filter(username__iexact=username).exists():
+        username, suffix = f'{base}_{suffix}', suffix + 1
+    CustomUser.objects.create(
+        username=username, first_name='КупиДом', password=make_password(None), is_system=True,
+    )
+
+
+def delete_sender(apps, schema_editor):
+    apps.get_model('realty', 'CustomUser').objects.filter(is_system=True).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('realty', '0011_property_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='is_system',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Служебная учётная запись'),
+        ),
+        migrations.AddConstraint(
+            model_name='customuser',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_system', True)), fields=('is_system',), name='realty_user_single_system'),
+        ),
+        migrations.RunPython(create_sender, delete_sender),
+    ]
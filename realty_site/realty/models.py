@@ -1,5 +1,8 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models.functions import Lower
+from django.utils import timezone
+from urllib.parse import urlencode
 import re
 from django.core.exceptions import ValidationError
 
@@ -19,6 +22,21 @@ class CustomUser(AbstractUser):
     bio = models.TextField('О себе', blank=True)
     avatar = models.ImageField('Аватар', upload_to='avatars/', blank=True, null=True)
     gender = models.CharField('Пол', max_length=1, choices=GENDER_CHOICES, blank=True)
+    # Служебная учётная запись уведомлений (saved_searches.notifications_sender), без пароля
+    is_system = models.BooleanField('Служебная учётная запись', default=False, editable=False)
+
+    class Meta(AbstractUser.Meta):
+        indexes = [models.Index(fields=['user_type'])]
+        constraints = [
+            # Не больше одной служебной записи; частичный индекс заодно ищет её
+            models.UniqueConstraint(fields=['is_system'], name='realty_user_single_system', condition=models.Q(is_system=True)),
+            # Логин и email уникальны без учёта регистра; индексы по LOWER(...)
+            # используются и проверкой доступности при регистрации
+            models.UniqueConstraint(Lower('username'), name='realty_user_username_ci_unique'),
+            models.UniqueConstraint(
+                Lower('email'), name='realty_user_email_ci_unique', condition=~models.Q(email=''),
+            ),
+        ]
 
     def clean(self):
         if self.password and len(self.password) < 5:
@@ -34,6 +52,8 @@ class Blacklist(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='blacklist_owner')
     blocked_user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='blocked_by')
     created_at = models.DateTimeField(auto_now_add=True)
+    # Сообщения заблокированного удаляются в фоне порциями (realty.maintenance)
+    messages_purged = models.BooleanField(default=False)
 
     class Meta:
         unique_together = ('user', 'blocked_user')
@@ -42,6 +62,18 @@ class Blacklist(models.Model):
         return f"{self.user} блокировал {self.blocked_user}"
 
 
+class UserSearchToken(models.Model):
+    """Слово из логина или имени пользователя для поиска по началу строки"""
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='search_tokens')
+    token = models.CharField(max_length=150)
+
+    class Meta:
+        unique_together = ('token', 'user')
+
+    def __str__(self):
+        return self.token
+
+
 class Property(models.Model):
     STATUS_CHOICES = (
         ('active', 'Актуально'),
@@ -68,14 +100,50 @@ class Property(models.Model):
     views = models.IntegerField('Просмотры', default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Момент перехода в статус «Продано» — для срока продажи в аналитике
+    sold_at = models.DateTimeField('Продано', blank=True, null=True)
 
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Статус при загрузке: по нему сигналы видят переход в «Актуально»
+        if 'status' in field_names:
+            instance._loaded_status = values[field_names.index('status')]
+        return instance
+
+    def save(self, *args, **kwargs):
+        if self.status == 'sold' and self.sold_at is None:
+            self.sold_at = timezone.now()
+        elif self.status != 'sold':
+            self.sold_at = None
+        super().save(*args, **kwargs)
+
+    @property
+    def main_image(self):
+        """Основное изображение (или первое загруженное).
+
+        Если изображения подгружены через prefetch_related('images'),
+        запрос к базе не выполняется.
+        """
+        prefetched = getattr(self, '_prefetched_objects_cache', {}).get('images')
+        if prefetched is None:
+            return self.images.order_by('-is_main', 'pk').first()
+        images = sorted(prefetched, key=lambda image: (not image.is_main, image.pk))
+        return images[0] if images else None
+
     class Meta:
         verbose_name = 'Объект недвижимости'
         verbose_name_plural = 'Объекты недвижимости'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['property_type', 'created_at']),
+            # Фильтры и сортировка каталога и админки
+            models.Index(fields=['status']),
+            models.Index(fields=['created_at']),
+        ]
 
 
 class PropertyImage(models.Model):
@@ -99,6 +167,190 @@ class Comment(models.Model):
         return f"Комментарий от {self.author.username}"
 
 
+class SimilarProperty(models.Model):
+    """Предрассчитанные похожие объявления (realty/recommendations.py)"""
+    property = models.ForeignKey(Property, on_delete=models.CASCADE, related_name='similar_links')
+    similar = models.ForeignKey(Property, on_delete=models.CASCADE, related_name='similar_to')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        unique_together = ('property', 'similar')
+        ordering = ['property', 'rank']
+
+    def __str__(self):
+        return f"{self.property_id} → {self.similar_id} ({self.score:.3f})"
+
+
+class MarketStats(models.Model):
+    """Сводка рынка по типу, городу и месяцу публикации (realty/analytics.py)"""
+    property_type = models.CharField(max_length=20, choices=Property.PROPERTY_TYPES)
+    city = models.CharField(max_length=100)
+    month = models.DateField()
+    count = models.PositiveIntegerField()
+    sold_count = models.PositiveIntegerField()
+    price_m2_median = models.FloatField()
+    price_m2_p25 = models.FloatField()
+    price_m2_p75 = models.FloatField()
+    price_m2_p90 = models.FloatField()
+    days_to_sold_median = models.FloatField(null=True)
+    days_to_sold_avg = models.FloatField(null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('property_type', 'city', 'month')
+        ordering = ['-month', 'property_type', 'city']
+
+    def __str__(self):
+        return f"{self.get_property_type_display()}, {self.city}, {self.month:%m.%Y}"
+
+
+class SavedSearch(models.Model):
+    """Сохранённые фильтры каталога с уведомлениями о новых объявлениях"""
+    NOTIFY_CHOICES = (
+        ('instant', 'Сразу сообщением'),
+        ('digest', 'Сводкой раз в день'),
+    )
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='saved_searches')
+    property_type = models.CharField('Тип недвижимости', max_length=20, choices=Property.PROPERTY_TYPES, blank=True)
+    min_price = models.DecimalField('Цена от', max_digits=12, decimal_places=2, null=True, blank=True)
+    max_price = models.DecimalField('Цена до', max_digits=12, decimal_places=2, null=True, blank=True)
+    rooms = models.IntegerField('Комнат', null=True, blank=True)
+    search = models.CharField('Поиск', max_length=200, blank=True)
+    notify = models.CharField('Уведомления', max_length=10, choices=NOTIFY_CHOICES, default='instant')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['property_type', 'rooms']),
+            models.Index(fields=['min_price']),
+            models.Index(fields=['max_price']),
+        ]
+
+    def __str__(self):
+        return self.describe()
+
+    def describe(self):
+        parts = [self.get_property_type_display() if self.property_type else 'Все типы']
+        if self.rooms:
+            parts.append(f'{self.rooms} комн.')
+        if self.min_price:
+            parts.append(f'от {self.min_price:,.0f}'.replace(',', ' '))
+        if self.max_price:
+            parts.append(f'до {self.max_price:,.0f}'.replace(',', ' '))
+        if self.search:
+            parts.append(f'«{self.search}»')
+        return ', '.join(parts)
+
+    def query_string(self):
+        """Параметры для property_list"""
+        params = {'type': self.property_type, 'min_price': self.min_price, 'max_price': self.max_price,
+                  'rooms': self.rooms, 'search': self.search}
+        return urlencode({key: value for key, value in params.items() if value not in (None, '')})
+
+
+class SavedSearchMatch(models.Model):
+    """Объявление, подошедшее под сохранённый поиск; notified — уведомление отправлено"""
+    saved_search = models.ForeignKey(SavedSearch, on_delete=models.CASCADE, related_name='matches')
+    property = models.ForeignKey(Property, on_delete=models.CASCADE, related_name='search_matches')
+    notified = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('saved_search', 'property')
+        indexes = [models.Index(fields=['notified', 'saved_search'])]
+
+
+class ArchivedProperty(models.Model):
+    """Давно проданное или скрытое объявление, перенесённое из Property (realty.archive).
+
+    id совпадает с id в Property: ссылки и восстановление его сохраняют.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    title = models.CharField('Название', max_length=200)
+    description = models.TextField('Описание')
+    price = models.DecimalField('Цена', max_digits=12, decimal_places=2)
+    property_type = models.CharField('Тип недвижимости', max_length=20, choices=Property.PROPERTY_TYPES)
+    area = models.FloatField('Площадь (кв.м)')
+    rooms = models.IntegerField('Количество комнат', blank=True, null=True)
+    location = models.CharField('Местоположение', max_length=300)
+    created_by = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='archived_properties')
+    status = models.CharField('Статус', max_length=10, choices=Property.STATUS_CHOICES)
+    views = models.IntegerField('Просмотры', default=0)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    sold_at = models.DateTimeField('Продано', blank=True, null=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Объект в архиве'
+        verbose_name_plural = 'Архив объектов'
+        ordering = ['-created_at']
+        indexes = [models.Index(fields=['property_type', 'created_at'])]
+
+    def __str__(self):
+        return self.title
+
+    @property
+    def main_image(self):
+        images = sorted(self.images.all(), key=lambda image: (not image.is_main, image.pk))
+        return images[0] if images else None
+
+
+class ArchivedPropertyImage(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    property = models.ForeignKey(ArchivedProperty, on_delete=models.CASCADE, related_name='images')
+    image = models.ImageField('Изображение', upload_to='property_images/')
+    is_main = models.BooleanField('Основное изображение', default=False)
+
+
+class ArchivedComment(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    property = models.ForeignKey(ArchivedProperty, on_delete=models.CASCADE, related_name='comments')
+    author = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='+')
+    text = models.TextField('Текст комментария')
+    created_at = models.DateTimeField()
+
+
+class PropertyViewEvent(models.Model):
+    """Просмотр объявления (записывается пачками); rolled_up — уже учтён в сводке"""
+    property = models.ForeignKey(Property, on_delete=models.CASCADE, related_name='view_events', db_constraint=False)
+    visitor = models.BigIntegerField()
+    viewed_at = models.DateTimeField(db_index=True)
+    rolled_up = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            # Свёртка выбирает только несвёрнутые события — индекс остаётся маленьким
+            models.Index(fields=['id'], name='realty_viewevent_pending', condition=models.Q(rolled_up=False)),
+        ]
+
+
+class PropertyViewStats(models.Model):
+    """Просмотры за час или день; visitors_hll — регистры HyperLogLog"""
+    PERIOD_CHOICES = (
+        ('hour', 'Час'),
+        ('day', 'День'),
+    )
+
+    property = models.ForeignKey(Property, on_delete=models.CASCADE, related_name='view_stats')
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    bucket = models.DateTimeField()
+    views = models.PositiveIntegerField(default=0)
+    visitors = models.PositiveIntegerField(default=0)
+    visitors_hll = models.BinaryField()
+
+    class Meta:
+        unique_together = ('property', 'period', 'bucket')
+
+
+class RollupLock(models.Model):
+    """Строка-блокировка свёртки: ``select_for_update`` по имени пускает один процесс за раз"""
+    name = models.CharField(max_length=50, unique=True)
+
+
 class Dialogue(models.Model):
     """Модель диалога между двумя пользователями"""
     participant1 = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='dialogues1')
@@ -126,6 +378,8 @@ class Message(models.Model):
 
     class Meta:
         ordering = ['created_at']
+        # Фильтр по дате в админке и отбор старых сообщений для архивации
+        indexes = [models.Index(fields=['created_at'])]
 
     def __str__(self):
         return f"{self.sender} → {self.receiver}: {self.content[:20]}"
\ No newline at end of file
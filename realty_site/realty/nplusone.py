@@ -0,0 +1,146 @@
+"""Детектор N+1 запросов для разработки и тестов.
+
+Все SQL-запросы одного HTTP-запроса группируются по «отпечатку» —
+тексту запроса, в котором литералы заменены на ``?``. Если запрос одной
+и той же формы выполнился больше ``NPLUSONE_THRESHOLD`` раз, это почти
+всегда цикл по объектам с обращением к связанной модели.
+"""
+import logging
+import re
+import sys
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger('realty.nplusone')
+
+DEFAULT_THRESHOLD = 5
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST_RE = re.compile(r'\bIN\s*\((?:\s*\?\s*,?)+\)', re.IGNORECASE)
+_SPACES_RE = re.compile(r'\s+')
+
+
+class NPlusOneError(AssertionError):
+    """Повторяющиеся запросы в строгом режиме"""
+
+
+def fingerprint(sql):
+    """Нормализация SQL: литералы и списки IN (...) заменяются на ?"""
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = sql.replace('%s', '?')
+    sql = _IN_LIST_RE.sub('IN (...)', sql)
+    return _SPACES_RE.sub(' ', sql).strip()
+
+
+def _is_project_file(filename):
+    base_dir = str(settings.BASE_DIR)
+    return (
+        filename.startswith(base_dir)
+        and 'site-packages' not in filename
+        and filename != __file__
+    )
+
+
+def find_origin():
+    """Место в коде проекта (и строка шаблона), откуда пришёл запрос"""
+    code_origin = None
+    template_origin = None
+    frame = sys._getframe(1)
+    while frame is not None and (code_origin is None or template_origin is None):
+        if code_origin is None and _is_project_file(frame.f_code.co_filename):
+            code_origin = f'{frame.f_code.co_filename}:{frame.f_lineno} in {frame.f_code.co_name}'
+        if template_origin is None and frame.f_code.co_name == 'render_annotated':
+            node = frame.f_locals.get('self')
+            origin = getattr(node, 'origin', None)
+            token = getattr(node, 'token', None)
+            if origin is not None and token is not None:
+                template_origin = f'{origin.template_name or origin.name}:{token.lineno}'
+        frame = frame.f_back
+    return code_origin, template_origin
+
+
+class QueryCollector:
+    """Собирает запросы через ``connection.execute_wrapper``"""
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD):
+        self.threshold = threshold
+        self.queries = defaultdict(list)
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries[fingerprint(sql)].append(find_origin())
+        return execute(sql, params, many, context)
+
+    @property
+    def total(self):
+        return sum(len(origins) for origins in self.queries.values())
+
+    def violations(self):
+        """Список (отпечаток, количество, места вызова) сверх порога"""
+        result = []
+        for sql, origins in self.queries.items():
+            if len(origins) > self.threshold:
+                places = sorted({
+                    ' / '.join(part for part in origin if part) or 'неизвестно'
+                    for origin in origins
+                })
+                result.append((sql, len(origins), places))
+        result.sort(key=lambda item: item[1], reverse=True)
+        return result
+
+    def report(self):
+        lines = []
+        for sql, count, places in self.violations():
+            lines.append(f'{count}x {sql}')
+            lines.extend(f'    {place}' for place in places)
+        return '\n'.join(lines)
+
+
+@contextmanager
+def detect_n_plus_one(threshold=None, strict=None, using=None):
+    """Контекстный менеджер: собирает запросы и сообщает о повторах.
+
+    В строгом режиме (``strict=True`` или ``NPLUSONE_STRICT``)
+    вместо предупреждения в лог выбрасывается ``NPlusOneError``.
+    """
+    if threshold is None:
+        threshold = getattr(settings, 'NPLUSONE_THRESHOLD', DEFAULT_THRESHOLD)
+    if strict is None:
+        strict = getattr(settings, 'NPLUSONE_STRICT', False)
+    aliases = [using] if using else list(connections)
+
+    collector = QueryCollector(threshold)
+    with ExitStack() as stack:
+        for alias in aliases:
+            stack.enter_context(connections[alias].execute_wrapper(collector))
+        yield collector
+
+    if collector.violations():
+        message = 'Обнаружены N+1 запросы:\n' + collector.report()
+        if strict:
+            raise NPlusOneError(message)
+        logger.warning(message)
+
+
+class NPlusOneMiddleware:
+    """Проверяет каждый запрос на N+1; включается ``NPLUSONE_ENABLED``"""
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'NPLUSONE_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with detect_n_plus_one() as collector:
+            response = self.get_response(request)
+            # Шаблонные ответы рендерятся лениво — запросы из шаблона тоже считаем
+            if hasattr(response, 'render') and callable(response.render):
+                response.render()
+        if collector.violations():
+            response['X-NPlusOne'] = str(len(collector.violations()))
+        return response
@@ -0,0 +1,177 @@
+"""Ограничение частоты запросов (token bucket) через общий кэш.
+
+Корзина хранится одним целым числом — «теоретическим временем прибытия»
+(TAT, алгоритм GCRA, эквивалентный token bucket) в миллисекундах.
+Каждый запрос атомарно прибавляет к нему интервал между токенами через
+``cache.incr``; если TAT ушёл дальше, чем на ``burst`` интервалов вперёд,
+запрос отклоняется и прибавка откатывается. Поэтому хватает операций
+add/incr/decr, которые атомарны и в Redis, и в локальном кэше.
+
+Лимиты задаются в ``RATE_LIMITS`` по областям (scope) и применяются
+декоратором ``@rate_limit``, функцией ``check_rate_limit`` или
+middleware по имени URL из ``RATE_LIMIT_VIEWS``.
+
+IP клиента — ``REMOTE_ADDR``. ``X-Forwarded-For`` учитывается, только
+если запрос пришёл от прокси из ``TRUSTED_PROXIES``: заголовок читается
+справа налево до первого адреса, который не является доверенным прокси
+(левые значения может подставить сам клиент).
+"""
+import ipaddress
+import math
+import time
+from functools import lru_cache, wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """'30/m' -> интервал между токенами в миллисекундах"""
+    count, period = rate.split('/')
+    return max(1, round(PERIODS[period] * 1000 / int(count)))
+
+
+@lru_cache(maxsize=8)
+def proxy_networks(proxies):
+    return tuple(ipaddress.ip_network(proxy, strict=False) for proxy in proxies)
+
+
+def is_trusted_proxy(address, networks):
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in networks)
+
+
+def client_ip(request):
+    remote = request.META.get('REMOTE_ADDR', '')
+    networks = proxy_networks(tuple(getattr(settings, 'TRUSTED_PROXIES', ())))
+    if not is_trusted_proxy(remote, networks):
+        return remote
+    hops = [hop.strip() for hop in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if hop.strip()]
+    for hop in reversed(hops):
+        if not is_trusted_proxy(hop, networks):
+            return hop
+    # Вся цепочка из доверенных прокси: клиент — самый левый адрес
+    return hops[0] if hops else remote
+
+
+def client_key(request):
+    """Пользователь для вошедших, IP-адрес для анонимов"""
+    if getattr(request, 'user', None) is not None and request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    return f'ip:{client_ip(request)}'
+
+
+def consume(scope, key, rate, burst):
+    """Забрать токен из корзины: (разрешено, через сколько секунд повторить)"""
+    interval = parse_rate(rate)
+    now = int(time.time() * 1000)
+    cache_key = f'ratelimit:{scope}:{key}'
+    ttl = math.ceil(burst * interval / 1000) + 1
+
+    if cache.add(cache_key, now + interval, ttl):
+        return True, 0
+    try:
+        tat = cache.incr(cache_key, interval)
+    except ValueError:
+        # Ключ истёк между add и incr
+        cache.set(cache_key, now + interval, ttl)
+        return True, 0
+
+    if tat <= now + interval:
+        # Корзина успела наполниться: начинаем отсчёт заново
+        cache.set(cache_key, now + interval, ttl)
+        return True, 0
+    if tat - now > burst * interval:
+        try:
+            cache.decr(cache_key, interval)
+        except ValueError:
+            pass
+        return False, max(1, math.ceil((tat - burst * interval - now) / 1000))
+    # incr не продлевает срок ключа: без touch корзина истекла бы раньше TAT
+    cache.touch(cache_key, math.ceil((tat - now) / 1000) + 1)
+    return True, 0
+
+
+def limits_for(scope):
+    config = settings.RATE_LIMITS[scope]
+    return config['rate'], config.get('burst', 1), config.get('keys', ('client',))
+
+
+def check_rate_limit(request, scope):
+    """None, если запрос разрешён, иначе ответ 429 с Retry-After"""
+    if not getattr(settings, 'RATE_LIMIT_ENABLED', True):
+        return None
+    rate, burst, keys = limits_for(scope)
+    for key_type in keys:
+        key = client_key(request) if key_type == 'client' else f'ip:{client_ip(request)}'
+        allowed, retry_after = consume(scope, key, rate, burst)
+        if not allowed:
+            return too_many_requests(request, retry_after)
+    return None
+
+
+def too_many_requests(request, retry_after):
+    message = 'Слишком много запросов. Попробуйте позже.'
+    if request.headers.get('x-requested-with') == 'XMLHttpRequest' or 'json' in request.headers.get('accept', ''):
+        response = JsonResponse({'error': message, 'retry_after': retry_after}, status=429)
+    else:
+        response = HttpResponse(message, status=429, content_type='text/plain; charset=utf-8')
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def rate_limit(scope, methods=('POST',)):
+    """Декоратор представления: лимит области ``scope`` для указанных методов"""
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method in methods:
+                response = check_rate_limit(request, scope)
+                if response is not None:
+                    return response
+            return view(request, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class RateLimitMiddleware:
+    """Лимиты по имени URL: ``RATE_LIMIT_VIEWS = {'url_name': (scope, methods)}``"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+            # Иначе Django оборачивает process_view в sync_to_async на каждый запрос
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def rule_for(self, request):
+        match = request.resolver_match
+        rule = getattr(settings, 'RATE_LIMIT_VIEWS', {}).get(match.url_name if match else None)
+        if rule is None or request.method not in rule[1]:
+            return None
+        return rule[0]
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        scope = self.rule_for(request)
+        return check_rate_limit(request, scope) if scope else None
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        scope = self.rule_for(request)
+        return await sync_to_async(check_rate_limit)(request, scope) if scope else None
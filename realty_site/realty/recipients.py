@@ -0,0 +1,82 @@
+"""Поиск получателя сообщения по началу логина или имени.
+
+Для каждого пользователя в ``UserSearchToken`` хранятся нормализованные
+слова (логин, имя, фамилия, «имя фамилия»). Поиск — диапазонный запрос
+``token >= q AND token < q + '\\U0010ffff'`` по индексу, поэтому время
+ответа не зависит от числа пользователей и регистра букв.
+"""
+from django.db.models import Q
+
+from .models import CustomUser, Message, UserSearchToken
+
+MAX_LIMIT = 20
+RECENT_MESSAGES = 200
+
+
+def normalize(text):
+    return ' '.join(text.lower().replace('ё', 'е').split())
+
+
+def user_tokens(user):
+    first = normalize(user.first_name)
+    last = normalize(user.last_name)
+    tokens = {normalize(user.username), first, last, f'{first} {last}'.strip(), f'{last} {first}'.strip()}
+    return {token[:150] for token in tokens if token}
+
+
+def update_search_tokens(sender, instance, **kwargs):
+    """post_save для CustomUser: пересобрать слова, если они изменились"""
+    tokens = user_tokens(instance)
+    existing = set(instance.search_tokens.values_list('token', flat=True))
+    if tokens == existing:
+        return
+    instance.search_tokens.exclude(token__in=tokens).delete()
+    UserSearchToken.objects.bulk_create(
+        [UserSearchToken(user=instance, token=token) for token in tokens - existing],
+        ignore_conflicts=True,
+    )
+
+
+def recent_correspondents(user, limit=MAX_LIMIT):
+    """id собеседников по убыванию давности переписки (по последним сообщениям)"""
+    recent = (
+        Message.objects.filter(Q(sender=user) | Q(receiver=user))
+        .order_by('-id')
+        .values_list('sender_id', 'receiver_id')[:RECENT_MESSAGES]
+    )
+    result = []
+    for sender_id, receiver_id in recent:
+        other = receiver_id if sender_id == user.id else sender_id
+        if other not in result:
+            result.append(other)
+            if len(result) >= limit:
+                break
+    return result
+
+
+def search_recipients(user, query, limit=10):
+    """Топ-``limit`` пользователей для поля «Кому»: сначала недавние собеседники"""
+    limit = max(1, min(limit, MAX_LIMIT))
+    query = normalize(query)
+    recent = recent_correspondents(user)
+
+    candidates = CustomUser.objects.exclude(id=user.id).exclude(blacklist_owner__blocked_user=user)
+    if query:
+        matched_ids = (
+            UserSearchToken.objects.filter(token__gte=query, token__lt=query + '\U0010ffff')
+            .values_list('user_id', flat=True)
+        )
+        # Сначала проверяем недавних собеседников, затем берём ограниченную выборку по индексу
+        recent_matches = set(matched_ids.filter(user_id__in=recent))
+        ids = [user_id for user_id in recent if user_id in recent_matches]
+        for user_id in matched_ids.order_by('token')[:limit * 5]:
+            if user_id not in ids:
+                ids.append(user_id)
+    else:
+        ids = recent
+
+    users = candidates.filter(id__in=ids[:limit * 5]).only(
+        'id', 'username', 'first_name', 'last_name', 'user_type'
+    )
+    by_id = {candidate.id: candidate for candidate in users}
+    return [by_id[user_id] for user_id in ids if user_id in by_id][:limit]
@@ -0,0 +1,296 @@
+"""Похожие объявления.
+
+Каждое активное объявление — вектор признаков в матрице NumPy: тип (one-hot),
+стандартизованные логарифмы цены, площади и цены за м², число комнат и
+слова адреса, разложенные хэшированием по ``LOCATION_BUCKETS`` корзинам.
+Ближайшие соседи по евклидову расстоянию считаются блоками по
+``BLOCK_SIZE`` строк (одно матричное умножение на блок), результат —
+``RECOMMENDATIONS_K`` лучших — хранится в ``SimilarProperty``.
+
+При изменении объявления пересчитываются только затронутые строки: само
+объявление, объявления, где оно было в списке, и те, для которых оно
+оказалось ближе их текущего последнего соседа.
+
+Матрица не читается из базы заново на каждое изменение: процесс держит её
+в памяти вместе с параметрами стандартизации и близостью самого слабого
+сохранённого соседа каждой строки. ``refresh`` читает по первичному ключу
+только изменённые объявления, векторизует их с теми же параметрами и
+заменяет их строки. Изменения, сделанные другими процессами, попадают в
+матрицу при перезагрузке — раз в ``RECOMMENDATIONS_MATRIX_TTL`` секунд или
+после полного пересчёта (версия ``similar``); снятые с продажи соседи
+отбрасываются сразу, перед записью списков.
+"""
+import re
+import threading
+import time
+import zlib
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min, OuterRef, Subquery
+
+from .conditional import bump_versions, current_versions
+from .maintenance import BackgroundBatcher
+from .models import Property, PropertyImage, SimilarProperty
+
+DEFAULT_K = 6
+BLOCK_SIZE = 256
+LOCATION_BUCKETS = 64
+WEIGHTS = {'type': 2.0, 'price': 1.5, 'area': 1.0, 'rooms': 0.7, 'price_per_m2': 1.0, 'location': 1.0}
+STOP_WORDS = {'улица', 'город', 'дом', 'просп', 'проспект', 'пер', 'переулок', 'район', 'область', 'шоссе'}
+TOKEN_RE = re.compile(r'[^\W\d_]{3,}')
+NUMERIC = ('price', 'area', 'rooms', 'price_per_m2')
+FIELDS = ('id', 'property_type', 'price', 'area', 'rooms', 'location')
+
+
+def top_k():
+    return getattr(settings, 'RECOMMENDATIONS_K', DEFAULT_K)
+
+
+def location_tokens(location):
+    return [token for token in TOKEN_RE.findall(location.lower().replace('ё', 'е')) if token not in STOP_WORDS]
+
+
+def _columns(rows):
+    """rows: (id, property_type, price, area, rooms, location) -> id, one-hot типа, адрес, числовые признаки"""
+    n = len(rows)
+    types = [code for code, _ in Property.PROPERTY_TYPES]
+    ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=n)
+    price = np.fromiter((float(row[2]) for row in rows), dtype=np.float64, count=n)
+    area = np.fromiter((max(row[3] or 0, 1.0) for row in rows), dtype=np.float64, count=n)
+    rooms = np.fromiter((np.nan if row[4] is None else row[4] for row in rows), dtype=np.float64, count=n)
+
+    one_hot = np.zeros((n, len(types)))
+    location = np.zeros((n, LOCATION_BUCKETS))
+    for i, row in enumerate(rows):
+        if row[1] in types:
+            one_hot[i, types.index(row[1])] = 1
+        for token in location_tokens(row[5]):
+            location[i, zlib.crc32(token.encode()) % LOCATION_BUCKETS] += 1
+    lengths = np.linalg.norm(location, axis=1, keepdims=True)
+    location = np.divide(location, lengths, out=np.zeros_like(location), where=lengths > 0)
+    numeric = {
+        'price': np.log1p(price), 'area': np.log1p(area), 'rooms': rooms, 'price_per_m2': np.log1p(price / area),
+    }
+    return ids, one_hot, location, numeric
+
+
+def column_stats(numeric):
+    """Параметры стандартизации: пропуски комнат — медианой, (среднее, σ) по признакам"""
+    rooms = numeric['rooms']
+    stats = {'rooms_fill': float(np.nanmedian(rooms)) if len(rooms) and not np.isnan(rooms).all() else 0.0}
+    for name in NUMERIC:
+        column = np.where(np.isnan(numeric[name]), stats['rooms_fill'], numeric[name])
+        std = column.std() if len(column) else 0
+        stats[name] = (float(column.mean()) if len(column) else 0.0, float(std) if std > 0 else 1.0)
+    return stats
+
+
+class FeatureMatrix:
+    def __init__(self, ids, vectors, stats, weakest=None):
+        self.ids = ids
+        self.vectors = vectors
+        self.stats = stats
+        self.norms = (vectors * vectors).sum(axis=1)
+        self.index = {pk: row for row, pk in enumerate(ids.tolist())}
+        # Близость самого слабого сохранённого соседа; -inf — список неполный или неизвестен
+        self.weakest = np.full(len(ids), -np.inf) if weakest is None else weakest
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_rows(cls, rows, stats=None):
+        """rows: (id, property_type, price, area, rooms, location); stats — параметры готовой матрицы"""
+        ids, one_hot, location, numeric = _columns(rows)
+        stats = stats or column_stats(numeric)
+        parts = [one_hot * WEIGHTS['type']]
+        for name in NUMERIC:
+            column = np.where(np.isnan(numeric[name]), stats['rooms_fill'], numeric[name])
+            mean, std = stats[name]
+            parts.append(((column - mean) / std)[:, None] * WEIGHTS[name])
+        parts.append(location * WEIGHTS['location'])
+        return cls(ids, np.hstack(parts).astype(np.float32), stats)
+
+    @classmethod
+    def load(cls):
+        rows = list(
+            Property.objects.filter(status='active')
+            .values_list(*FIELDS)
+            .order_by('id')
+            .iterator(chunk_size=5000)
+        )
+        return cls.from_rows(rows)
+
+    def load_weakest(self, k):
+        """Слабейшие соседи из ``SimilarProperty`` (при загрузке матрицы)"""
+        stored = SimilarProperty.objects.values('property_id').annotate(weakest=Min('score'), total=Count('id'))
+        for row in stored.iterator(chunk_size=5000):
+            position = self.index.get(row['property_id'])
+            if position is not None and row['total'] >= k:
+                self.weakest[position] = row['weakest']
+
+    def remember(self, neighbours, k):
+        """Записанные списки соседей обновляют слабейших"""
+        for pk, items in neighbours.items():
+            self.weakest[self.index[pk]] = items[-1][1] if len(items) >= k else -np.inf
+
+    def replace(self, rows, removed):
+        """Новая матрица: строки ``removed`` убраны, ``rows`` векторизованы с прежними параметрами"""
+        added = FeatureMatrix.from_rows(rows, self.stats)
+        keep = ~np.isin(self.ids, np.fromiter(set(removed) | set(added.index), dtype=np.int64))
+        weakest = np.concatenate([self.weakest[keep], added.weakest])
+        return FeatureMatrix(
+            np.concatenate([self.ids[keep], added.ids]), np.vstack([self.vectors[keep], added.vectors]),
+            self.stats, weakest,
+        )
+
+    def scores(self, rows):
+        """Близость (1 / (1 + расстояние)) строк ``rows`` ко всем объявлениям"""
+        block = self.vectors[rows]
+        squared = self.norms[rows, None] + self.norms[None, :] - 2 * block @ self.vectors.T
+        return 1 / (1 + np.sqrt(np.maximum(squared, 0)))
+
+    def neighbours(self, rows, k):
+        """{id: [(id соседа, близость), ...]} для строк ``rows``, блоками"""
+        k = min(k, len(self) - 1)
+        result = {}
+        if k <= 0:
+            return {int(self.ids[row]): [] for row in rows}
+        rows = np.asarray(rows, dtype=np.int64)
+        for start in range(0, len(rows), BLOCK_SIZE):
+            block = rows[start:start + BLOCK_SIZE]
+            scores = self.scores(block)
+            scores[np.arange(len(block)), block] = -1  # сам с собой не сравниваем
+            best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(scores, best, axis=1)
+            order = np.argsort(-best_scores, axis=1, kind='stable')
+            for i, row in enumerate(block):
+                result[int(self.ids[row])] = [
+                    (int(self.ids[best[i, j]]), float(best_scores[i, j])) for j in order[i]
+                ]
+        return result
+
+
+def store(neighbours):
+    """Заменяет сохранённые списки для объявлений из ``neighbours``"""
+    with transaction.atomic():
+        SimilarProperty.objects.filter(property_id__in=list(neighbours)).delete()
+        SimilarProperty.objects.bulk_create(
+            [
+                SimilarProperty(property_id=pk, similar_id=similar_id, rank=rank, score=score)
+                for pk, items in neighbours.items()
+                for rank, (similar_id, score) in enumerate(items)
+            ],
+            batch_size=2000,
+        )
+    bump_versions(*(f'property:{pk}' for pk in neighbours))
+
+
+class MatrixCache:
+    """Матрица процесса для ``refresh``; перечитывается по сроку и после полного пересчёта"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.forget()
+
+    def forget(self):
+        self.matrix = None
+        self.k = None
+        self.version = None
+        self.loaded_at = 0
+
+    def keep(self, matrix, k):
+        self.matrix, self.k = matrix, k
+        self.version = current_versions('similar')
+        self.loaded_at = time.monotonic()
+
+    def get(self, k):
+        expired = time.monotonic() - self.loaded_at > getattr(settings, 'RECOMMENDATIONS_MATRIX_TTL', 600)
+        if self.matrix is None or self.k != k or expired or self.version != current_versions('similar'):
+            matrix = FeatureMatrix.load()
+            matrix.load_weakest(k)
+            self.keep(matrix, k)
+        return self.matrix
+
+
+matrix_cache = MatrixCache()
+
+
+def rebuild_all(k=None, progress=None):
+    """Полный пересчёт; возвращает число объявлений"""
+    k = k or top_k()
+    matrix = FeatureMatrix.load()
+    step = BLOCK_SIZE * 8
+    for start in range(0, len(matrix), step):
+        neighbours = matrix.neighbours(range(start, min(start + step, len(matrix))), k)
+        store(neighbours)
+        matrix.remember(neighbours, k)
+        if progress is not None:
+            progress(min(start + step, len(matrix)), len(matrix))
+    # Проданные и скрытые объявления рекомендаций не получают
+    SimilarProperty.objects.exclude(property__status='active').delete()
+    bump_versions('similar')
+    with matrix_cache.lock:
+        matrix_cache.keep(matrix, k)
+    return len(matrix)
+
+
+def refresh(property_ids, k=None):
+    """Пересчёт строк, затронутых изменением объявлений ``property_ids``"""
+    k = k or top_k()
+    changed = set(property_ids)
+    with matrix_cache.lock:
+        matrix = matrix_cache.get(k).replace(
+            list(Property.objects.filter(pk__in=changed, status='active').values_list(*FIELDS)), changed,
+        )
+        SimilarProperty.objects.filter(property_id__in=changed - set(matrix.index)).delete()
+
+        affected = {pk for pk in changed if pk in matrix.index}
+        affected.update(SimilarProperty.objects.filter(similar_id__in=changed).values_list('property_id', flat=True))
+
+        changed_rows = [matrix.index[pk] for pk in changed if pk in matrix.index]
+        if changed_rows and len(matrix) > 1:
+            # Близость каждого объявления к изменённым: кандидаты — те, у кого она
+            # выше самого слабого сохранённого соседа (или список неполный)
+            closest = matrix.scores(changed_rows).max(axis=0)
+            affected.update(int(pk) for pk in matrix.ids[closest > matrix.weakest])
+
+        while True:
+            rows = [matrix.index[pk] for pk in affected if pk in matrix.index]
+            neighbours = matrix.neighbours(rows, k) if rows else {}
+            referenced = {pk for items in neighbours.values() for pk, _ in items}
+            gone = referenced - set(Property.objects.filter(pk__in=referenced, status='active').values_list('pk', flat=True))
+            if not gone:
+                break
+            # Сняты с продажи или удалены в другом процессе: убираем из матрицы и считаем заново
+            matrix = matrix.replace([], gone)
+        if neighbours:
+            store(neighbours)
+            matrix.remember(neighbours, k)
+        matrix_cache.matrix = matrix
+    return len(neighbours)
+
+
+# Пока идёт пересчёт, новые изменения копятся и обрабатываются одной пачкой
+refresh_queue = BackgroundBatcher(lambda property_ids: refresh(property_ids), 'RECOMMENDATIONS_REFRESH_IN_BACKGROUND')
+
+
+def property_saved(sender, instance, **kwargs):
+    refresh_queue.schedule([instance.pk])
+
+
+def property_deleted(sender, instance, **kwargs):
+    # pre_delete: ссылки на объявление удалятся каскадно, соседей пересчитываем
+    refresh_queue.schedule(list(instance.similar_to.values_list('property_id', flat=True)))
+
+
+def similar_properties(property_id, limit=None):
+    """Похожие активные объявления с путём к главному фото — одним запросом"""
+    main_image = PropertyImage.objects.filter(property=OuterRef('pk')).order_by('-is_main', 'pk').values('image')[:1]
+    return list(
+        Property.objects.filter(similar_to__property_id=property_id, status='active')
+        .annotate(main_image_path=Subquery(main_image))
+        .order_by('similar_to__rank')[:limit or top_k()]
+    )
@@ -0,0 +1,181 @@
+"""Маршрутизация чтения каталога на реплики.
+
+Чтение уходит на реплику только внутри представлений, помеченных
+``@read_from_replica`` (главная, каталог, карточка объекта). Все записи
+и всё остальное чтение идут в ``default``.
+
+Чтобы пользователь сразу видел свои изменения (read-your-writes), после
+POST-запроса с записью в базу в ответ ставится cookie ``REPLICA_PIN_COOKIE``:
+пока она действует, запросы этого клиента читают с основной базы. Служебные
+записи при GET (счётчик просмотров) клиента не привязывают. Реплики, которые
+отстают больше ``REPLICA_MAX_LAG`` секунд, временно исключаются.
+"""
+import random
+import time
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.db.models import Max
+
+_use_replica = ContextVar('realty_use_replica', default=False)
+_pinned = ContextVar('realty_pinned_to_primary', default=False)
+_wrote = ContextVar('realty_wrote', default=False)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# alias -> (время проверки, отставание в секундах)
+_lag_cache = {}
+
+
+def replica_aliases():
+    return list(getattr(settings, 'REPLICA_DATABASES', []))
+
+
+def measure_lag(alias):
+    """Отставание реплики в секундах (None — реплика недоступна).
+
+    Для PostgreSQL берётся время последней применённой транзакции;
+    для локальных реплик-файлов SQLite — разница между самыми свежими
+    ``Property.updated_at`` на основной базе и на реплике.
+    """
+    from .models import Property
+
+    try:
+        connection = connections[alias]
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)'
+                )
+                return float(cursor.fetchone()[0])
+        primary = Property.objects.using('default').aggregate(last=Max('updated_at'))['last']
+        replica = Property.objects.using(alias).aggregate(last=Max('updated_at'))['last']
+    except DatabaseError:
+        return None
+    if primary is None:
+        return 0.0
+    if replica is None:
+        return float('inf')
+    return max(0.0, (primary - replica).total_seconds())
+
+
+def replica_lag(alias):
+    """Отставание с кэшированием на ``REPLICA_LAG_CHECK_INTERVAL`` секунд"""
+    interval = getattr(settings, 'REPLICA_LAG_CHECK_INTERVAL', 5)
+    now = time.monotonic()
+    checked = _lag_cache.get(alias)
+    if checked is None or now - checked[0] > interval:
+        checked = (now, measure_lag(alias))
+        _lag_cache[alias] = checked
+    return checked[1]
+
+
+def healthy_replicas():
+    max_lag = getattr(settings, 'REPLICA_MAX_LAG', 10)
+    result = []
+    for alias in replica_aliases():
+        lag = replica_lag(alias)
+        if lag is not None and lag <= max_lag:
+            result.append(alias)
+    return result
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not _use_replica.get() or _pinned.get() or _wrote.get():
+            return 'default'
+        # Связанные объекты читаем оттуда же, откуда загружен сам объект
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db in replica_aliases():
+            return instance._state.db
+        replicas = healthy_replicas()
+        return random.choice(replicas) if replicas else 'default'
+
+    def db_for_write(self, model, **hints):
+        _wrote.set(True)
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и основная база
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схема на реплики приходит вместе с репликацией
+        return db not in replica_aliases()
+
+
+def read_from_replica(view):
+    """Разрешает представлению читать с реплик (обычному и async)"""
+
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            # sync_to_async копирует контекст в поток ORM — роутер видит флаг
+            token = _use_replica.set(True)
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                _use_replica.reset(token)
+
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        token = _use_replica.set(True)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _use_replica.reset(token)
+
+    return wrapper
+
+
+class ReplicaPinningMiddleware:
+    """Read-your-writes: после записи клиент читает с основной базы"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        tokens = self.start(request)
+        try:
+            return self.finish(request, self.get_response(request))
+        finally:
+            self.reset(tokens)
+
+    async def __acall__(self, request):
+        tokens = self.start(request)
+        try:
+            return self.finish(request, await self.get_response(request))
+        finally:
+            self.reset(tokens)
+
+    def start(self, request):
+        try:
+            pinned_until = float(request.COOKIES.get(getattr(settings, 'REPLICA_PIN_COOKIE', 'replica_pin'), 0))
+        except ValueError:
+            pinned_until = 0
+        return _pinned.set(pinned_until > time.time()), _wrote.set(False)
+
+    def finish(self, request, response):
+        if _wrote.get() and request.method not in SAFE_METHODS and replica_aliases():
+            seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 15)
+            response.set_cookie(
+                getattr(settings, 'REPLICA_PIN_COOKIE', 'replica_pin'), str(time.time() + seconds),
+                max_age=seconds, httponly=True, samesite='Lax',
+            )
+        return response
+
+    def reset(self, tokens):
+        _pinned.reset(tokens[0])
+        _wrote.reset(tokens[1])
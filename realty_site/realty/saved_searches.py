@@ -0,0 +1,205 @@
+"""Сохранённые поиски и уведомления о новых объявлениях.
+
+Когда объявление создаётся или снова становится актуальным, его id
+попадает в фоновую очередь. Пачка объявлений сверяется со всеми
+сохранёнными поисками так:
+
+1. один запрос выбирает поиски-кандидаты по индексам (тип и комнаты,
+   границы цены) для всей пачки сразу;
+2. кандидаты раскладываются в словарь по (тип, комнаты), и каждое
+   объявление проверяется только по своим четырём корзинам
+   (с учётом «любой тип» и «любое число комнат»), текст поиска — в Python.
+
+Совпадения записываются в ``SavedSearchMatch``. Для поисков с
+уведомлением «сразу» пользователь получает одно сообщение на пачку, для
+«сводки» — одно сообщение в день командой ``send_search_digests``.
+"""
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.urls import reverse
+
+from . import unread
+from .maintenance import BackgroundBatcher
+from .models import CustomUser, Message, Property, SavedSearch, SavedSearchMatch
+
+MAX_LINES = 20
+
+
+def search_params(params):
+    """Поля SavedSearch из параметров property_list; некорректные значения отбрасываются"""
+
+    def number(name, kind):
+        try:
+            value = kind(params.get(name) or '')
+        except (InvalidOperation, ValueError):
+            return None
+        return value if value >= 0 else None
+
+    property_type = params.get('type', '')
+    return {
+        'property_type': property_type if property_type in dict(Property.PROPERTY_TYPES) else '',
+        'min_price': number('min_price', Decimal),
+        'max_price': number('max_price', Decimal),
+        'rooms': number('rooms', int),
+        'search': params.get('search', '').strip()[:200],
+    }
+
+
+def notifications_sender():
+    """Служебная учётная запись, от имени которой приходят уведомления.
+
+    Её создаёт миграция 0012 (``is_system=True``, без пароля); поиск идёт по
+    флагу, а не по логину, чтобы не присвоить чужую учётную запись.
+    """
+    user = CustomUser.objects.filter(is_system=True).first()
+    if user is not None:
+        return user
+    # Запись удалили вручную (или очистили таблицу) — создаём заново
+    base = getattr(settings, 'NOTIFICATIONS_SENDER_USERNAME', 'kupidom')
+    username, suffix = base, 1
+    while CustomUser.objects.filter(username__iexact=username).exists():
+        username, suffix = f'{base}_{suffix}', suffix + 1
+    try:
+        with transaction.atomic():
+            user = CustomUser(username=username, first_name='КупиДом', is_system=True)
+            user.set_unusable_password()
+            user.save()
+    except IntegrityError:
+        # Параллельный процесс успел создать её первым
+        user = CustomUser.objects.get(is_system=True)
+    return user
+
+
+def matches(search, prop):
+    if search.min_price is not None and prop.price < search.min_price:
+        return False
+    if search.max_price is not None and prop.price > search.max_price:
+        return False
+    if search.search:
+        needle = search.search.lower()
+        return any(needle in text.lower() for text in (prop.title, prop.description, prop.location))
+    return True
+
+
+class SearchIndex:
+    """Поиски-кандидаты, разложенные по (тип, комнаты); '' и None — «любые»"""
+
+    def __init__(self, searches):
+        self.buckets = defaultdict(list)
+        for search in searches:
+            self.buckets[(search.property_type, search.rooms)].append(search)
+
+    def lookup(self, prop):
+        keys = dict.fromkeys([
+            (prop.property_type, prop.rooms), (prop.property_type, None), ('', prop.rooms), ('', None),
+        ])
+        for key in keys:
+            for search in self.buckets.get(key, ()):
+                if search.user_id != prop.created_by_id and matches(search, prop):
+                    yield search
+
+
+def candidate_searches(properties, sender):
+    """Один запрос: поиски, которые могут подойти хотя бы одному объявлению пачки"""
+    prices = [prop.price for prop in properties]
+    rooms = {prop.rooms for prop in properties} - {None}
+    return (
+        SavedSearch.objects.filter(
+            Q(property_type='') | Q(property_type__in={prop.property_type for prop in properties}),
+            Q(rooms__isnull=True) | Q(rooms__in=rooms),
+            Q(min_price__isnull=True) | Q(min_price__lte=max(prices)),
+            Q(max_price__isnull=True) | Q(max_price__gte=min(prices)),
+        )
+        # Заблокировавшие служебную учётную запись уведомлений не получают
+        .exclude(user__blacklist_owner__blocked_user=sender)
+        .order_by()
+    )
+
+
+def compose(title, items):
+    """Текст уведомления: items — пары (поиск, объявление)"""
+    lines = [title]
+    for search, prop in items[:MAX_LINES]:
+        price = '{:,.0f}'.format(prop.price).replace(',', ' ')
+        lines.append(f'• {prop.title} — {price} руб. — {reverse("property_detail", args=[prop.pk])} ({search.describe()})')
+    if len(items) > MAX_LINES:
+        lines.append(f'…и ещё {len(items) - MAX_LINES}')
+    return '\n'.join(lines)
+
+
+def send_notifications(sender, items_by_user, title):
+    Message.objects.bulk_create([
+        Message(sender=sender, receiver_id=user_id, content=compose(title, items))
+        for user_id, items in items_by_user.items()
+    ])
+    # bulk_create не отправляет post_save; по одному сообщению на пользователя
+    unread.received(items_by_user.keys())
+
+
+def match_properties(property_ids):
+    """Сверяет объявления с сохранёнными поисками; возвращает число новых совпадений"""
+    properties = list(Property.objects.filter(pk__in=property_ids, status='active'))
+    if not properties:
+        return 0
+    sender = notifications_sender()
+    index = SearchIndex(candidate_searches(properties, sender))
+    # Объявление, уже совпадавшее раньше (например, снятое и возвращённое), повторно не присылаем
+    seen = set(
+        SavedSearchMatch.objects.filter(property_id__in=[prop.pk for prop in properties])
+        .values_list('saved_search_id', 'property_id')
+    )
+    found = [
+        (search, prop) for prop in properties for search in index.lookup(prop)
+        if (search.pk, prop.pk) not in seen
+    ]
+    if not found:
+        return 0
+
+    instant = defaultdict(list)
+    for search, prop in found:
+        if search.notify == 'instant':
+            instant[search.user_id].append((search, prop))
+    with transaction.atomic():
+        SavedSearchMatch.objects.bulk_create(
+            [
+                SavedSearchMatch(saved_search=search, property=prop, notified=search.notify == 'instant')
+                for search, prop in found
+            ],
+            ignore_conflicts=True,
+            batch_size=1000,
+        )
+        send_notifications(sender, instant, 'Новые объявления по вашим сохранённым поискам:')
+    return len(found)
+
+
+def send_digests():
+    """Сводка неотправленных совпадений: одно сообщение на пользователя"""
+    pending = list(
+        SavedSearchMatch.objects.filter(notified=False, saved_search__notify='digest')
+        .select_related('saved_search', 'property')
+        .order_by('saved_search__user_id', 'saved_search_id', 'property_id')
+    )
+    by_user = defaultdict(list)
+    for match in pending:
+        if match.property.status == 'active':
+            by_user[match.saved_search.user_id].append((match.saved_search, match.property))
+    with transaction.atomic():
+        if by_user:
+            send_notifications(notifications_sender(), by_user, 'Сводка новых объявлений по вашим сохранённым поискам:')
+        SavedSearchMatch.objects.filter(pk__in=[match.pk for match in pending]).update(notified=True)
+    return len(by_user)
+
+
+match_queue = BackgroundBatcher(match_properties, 'SAVED_SEARCH_MATCH_IN_BACKGROUND')
+
+
+def property_saved(sender, instance, created, **kwargs):
+    """Новое объявление или возврат в «Актуально» ставит его в очередь сверки"""
+    previous = getattr(instance, '_loaded_status', None)
+    instance._loaded_status = instance.status
+    if instance.status == 'active' and (created or previous not in (None, 'active')):
+        match_queue.schedule([instance.pk])
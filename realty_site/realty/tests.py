@@ -1,3 +1,1301 @@
-from django.test import TestCase
+import gzip
+import hashlib
+import threading
+import json
+import tempfile
+import time
+import zlib
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+from django.http import HttpResponse, StreamingHttpResponse
+from django.template import Context, Template, engines
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse, set_script_prefix
+from django.utils import timezone
+
+from . import analytics, ratelimit, recommendations, routers, unread, viewstats
+from .admin import EstimatedCountPaginator
+from .archive import archive_properties, restore_properties
+from .availability import BloomFilter, availability
+from .benchmarks import compare_reports, run_benchmarks, run_ratelimit_benchmark, run_template_benchmark
+from .captcha import check_captcha, issue_captcha
+from .cards import card_rows, card_values, render_cards
+from .compression import CompressionMiddleware, brotli, choose_encoding
+from .db import gather_queries, sqlite_pragmas
+from .forms import CustomUserCreationForm
+from .maintenance import archive_old_messages, purge_pending_blacklists
+from .models import (
+    CustomUser, Property, PropertyImage, Comment, Message, Blacklist, SimilarProperty, MarketStats, SavedSearch,
+    PropertyViewEvent, PropertyViewStats, ArchivedProperty, ArchivedComment,
+)
+from .nplusone import NPlusOneError, detect_n_plus_one, fingerprint
+from .recommendations import FeatureMatrix, rebuild_all, refresh, similar_properties
+from .saved_searches import match_properties, notifications_sender, send_digests
+
+
+def create_user(username, user_type='client', **kwargs):
+    return CustomUser.objects.create_user(
+        username=username, password=kwargs.pop('password', None), user_type=user_type,
+        email=kwargs.pop('email', f'{username}@example.com'), **kwargs
+    )
+
+
+def create_property(owner, title='Квартира', **kwargs):
+    defaults = {
+        'description': 'Описание',
+        'price': 5000000,
+        'property_type': 'apartment',
+        'area': 50,
+        'rooms': 2,
+        'location': 'Москва',
+    }
+    defaults.update(kwargs)
+    return Property.objects.create(created_by=owner, title=title, **defaults)
+
+
+class CatalogDataMixin:
+    """Несколько объектов с изображениями, комментариями и перепиской"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.realtor = create_user('realtor', user_type='realtor')
+        cls.client_user = create_user('client')
+        cls.properties = []
+        for i in range(8):
+            prop = create_property(cls.realtor, title=f'Объект {i}', price=1000000 + i)
+            PropertyImage.objects.create(property=prop, image=f'property_images/{i}.jpg', is_main=True)
+            PropertyImage.objects.create(property=prop, image=f'property_images/{i}_2.jpg')
+            cls.properties.append(prop)
+        for i in range(8):
+            Comment.objects.create(property=cls.properties[0], author=create_user(f'commenter{i}'), text='Текст')
+            Message.objects.create(sender=create_user(f'writer{i}'), receiver=cls.client_user, content='Привет')
+            Message.objects.create(sender=cls.client_user, receiver=cls.realtor, content=f'Вопрос {i}')
+
+
+class FingerprintTests(TestCase):
+    def test_literals_are_replaced(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE id = 15 AND name = 'it''s'  LIMIT 21"),
+            'SELECT * FROM t WHERE id = ? AND name = ? LIMIT ?',
+        )
+
+    def test_in_lists_of_any_length_share_fingerprint(self):
+        self.assertEqual(
+            fingerprint('SELECT * FROM t WHERE id IN (%s, %s, %s)'),
+            fingerprint('SELECT * FROM t WHERE id IN (%s)'),
+        )
+
+
+class DetectorTests(CatalogDataMixin, TestCase):
+    def test_strict_mode_raises_with_origin(self):
+        with self.assertRaises(NPlusOneError) as ctx:
+            with detect_n_plus_one(threshold=3, strict=True):
+                for prop in Property.objects.all():
+                    prop.created_by.username
+        self.assertIn('realty_customuser', str(ctx.exception))
+        self.assertIn('tests.py', str(ctx.exception))
+
+    def test_below_threshold_is_ignored(self):
+        with detect_n_plus_one(threshold=10, strict=True) as collector:
+            for prop in Property.objects.all():
+                prop.created_by.username
+        self.assertEqual(collector.violations(), [])
+        self.assertEqual(collector.total, 9)
+
+    def test_template_line_is_reported(self):
+        template = Template('{% for p in props %}\n{{ p.created_by.username }}{% endfor %}')
+        with self.assertRaises(NPlusOneError) as ctx:
+            with detect_n_plus_one(threshold=3, strict=True):
+                template.render(Context({'props': Property.objects.all()}))
+        self.assertIn('<unknown source>:2', str(ctx.exception))
+
+
+@override_settings(NPLUSONE_ENABLED=True, NPLUSONE_STRICT=True, NPLUSONE_THRESHOLD=3)
+class NoNPlusOneViewTests(CatalogDataMixin, TestCase):
+    """Строгий режим на основных страницах: новый N+1 роняет тест"""
+
+    def test_home(self):
+        self.assertEqual(self.client.get(reverse('home')).status_code, 200)
+
+    def test_property_list(self):
+        self.assertEqual(self.client.get(reverse('property_list')).status_code, 200)
+
+    def test_property_list_ajax(self):
+        response = self.client.get(reverse('property_list'), headers={'x-requested-with': 'XMLHttpRequest'})
+        self.assertEqual(len(response.json()['properties']), 8)
+
+    def test_property_detail(self):
+        response = self.client.get(reverse('property_detail', args=[self.properties[0].pk]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_message_list(self):
+        self.client.force_login(self.client_user)
+        response = self.client.get(reverse('message_list'))
+        self.assertEqual(len(response.context['dialogues']), 9)
+
+    def test_chat(self):
+        self.client.force_login(self.client_user)
+        response = self.client.get(reverse('chat_with_user', args=[self.realtor.pk]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_profile(self):
+        self.client.force_login(self.realtor)
+        self.assertEqual(self.client.get(reverse('profile')).status_code, 200)
+
+
+class SyntheticDataTests(TestCase):
+    def generate(self, **options):
+        options = {'users': 20, 'properties': 30, 'images': 60, 'messages': 200,
+                   'comments': 40, 'blacklists': 5, 'seed': 7, 'clear': True, **options}
+        call_command('generate_synthetic_data', stdout=StringIO(), **options)
+        return list(Property.objects.order_by('id').values_list('title', 'price', 'location', 'status'))
+
+    def test_counts_and_determinism(self):
+        first = self.generate()
+        self.assertEqual(CustomUser.objects.count(), 20)
+        self.assertEqual(PropertyImage.objects.count(), 60)
+        self.assertEqual(Message.objects.count(), 200)
+        self.assertEqual(PropertyImage.objects.filter(is_main=True).count(), 30)
+        self.assertEqual(self.generate(), first)
+
+    def test_benchmark_report(self):
+        self.generate()
+        with override_settings(NPLUSONE_ENABLED=False, ALLOWED_HOSTS=['localhost']):
+            report = run_benchmarks(repeat=2, warmup=0)
+        results = report['results']
+        self.assertIn('chat_with_user', results)
+        self.assertIn('property_list_type_house', results)
+        for name, result in results.items():
+            self.assertEqual(result['status'], 200, name)
+            self.assertLessEqual(result['p50_ms'], result['p95_ms'])
+            self.assertGreater(result['queries'], 0)
+        self.assertEqual(compare_reports(report, report)[0].count('+0.0%'), 3)
+
+
+class DatabaseSettingsTests(TestCase):
+    def test_sqlite_pragmas_applied_on_connect(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], sqlite_pragmas()['busy_timeout'])
+
+    def test_property_detail_does_not_touch_updated_at(self):
+        owner = create_user('owner', user_type='realtor')
+        prop = create_property(owner)
+        updated_at = prop.updated_at
+        self.client.get(reverse('property_detail', args=[prop.pk]))
+        self.client.get(reverse('property_detail', args=[prop.pk]))
+        prop.refresh_from_db()
+        self.assertEqual(prop.views, 2)
+        self.assertEqual(prop.updated_at, updated_at)
+
+
+@override_settings(REPLICA_DATABASES=['replica1', 'replica2'], REPLICA_MAX_LAG=10, REPLICA_PIN_SECONDS=15)
+class ReplicaRouterTests(TestCase):
+    def setUp(self):
+        routers._lag_cache.clear()
+        self.router = routers.ReplicaRouter()
+        patcher = mock.patch.object(routers, 'measure_lag', return_value=0.0)
+        self.measure_lag = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(routers._lag_cache.clear)
+
+    def route(self, request=None, method='get'):
+        """Куда пойдёт чтение каталога внутри представления"""
+        @routers.read_from_replica
+        def view(request):
+            response = HttpResponse(self.router.db_for_read(Property))
+            if request.method == 'POST':
+                self.router.db_for_write(Property)
+            return response
+
+        middleware = routers.ReplicaPinningMiddleware(view)
+        return middleware(request or getattr(RequestFactory(), method)('/'))
+
+    def test_reads_outside_catalog_views_use_primary(self):
+        self.assertEqual(self.router.db_for_read(Property), 'default')
+
+    def test_catalog_reads_use_replicas(self):
+        self.assertIn(self.route().content.decode(), {'replica1', 'replica2'})
+
+    def test_lagging_replicas_fall_back_to_primary(self):
+        self.measure_lag.side_effect = lambda alias: 60.0 if alias == 'replica1' else None
+        self.assertEqual(self.route().content.decode(), 'default')
+
+    def test_lag_checks_are_cached(self):
+        for _ in range(5):
+            self.route()
+        self.assertEqual(self.measure_lag.call_count, 2)
+
+    def test_writes_pin_client_to_primary(self):
+        response = self.route(method='post')
+        self.assertIn('replica_pin', response.cookies)
+
+        request = RequestFactory().get('/')
+        request.COOKIES['replica_pin'] = response.cookies['replica_pin'].value
+        self.assertEqual(self.route(request).content.decode(), 'default')
+
+    def test_get_requests_do_not_pin(self):
+        self.assertNotIn('replica_pin', self.route().cookies)
+
+    def test_expired_pin_is_ignored(self):
+        request = RequestFactory().get('/')
+        request.COOKIES['replica_pin'] = str(time.time() - 1)
+        self.assertNotEqual(self.route(request).content.decode(), 'default')
+
+
+class StatelessCaptchaTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def registration_data(self, **overrides):
+        text, token = issue_captcha()
+        data = {
+            'username': 'newuser', 'email': 'new@example.com', 'first_name': 'Иван',
+            'last_name': 'Петров', 'user_type': 'client', 'password1': 'secret123',
+            'password2': 'secret123', 'captcha': text.lower(), 'captcha_token': token,
+        }
+        data.update(overrides)
+        return data
+
+    def test_anonymous_register_page_creates_no_session(self):
+        response = self.client.get(reverse('register'))
+        self.assertContains(response, response.context['captcha_token'])
+        self.client.get(reverse('register'), {'refresh_captcha': 1})
+        self.assertEqual(Session.objects.count(), 0)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+
+    def test_registration_with_valid_captcha(self):
+        response = self.client.post(reverse('register'), self.registration_data())
+        self.assertEqual(response.json(), {'success': True})
+        self.assertTrue(CustomUser.objects.filter(username='newuser').exists())
+
+    def test_wrong_answer_is_rejected(self):
+        response = self.client.post(reverse('register'), self.registration_data(captcha='XXXXXX'))
+        self.assertIn('captcha', response.json()['errors'])
+
+    def test_form_errors_keep_captcha_token(self):
+        data = self.registration_data(password2='mismatch1')
+        errors = self.client.post(reverse('register'), data).json()['errors']
+        self.assertNotIn('captcha', errors)
+        data['password2'] = 'secret123'
+        self.assertEqual(self.client.post(reverse('register'), data).json(), {'success': True})
+        # После успешной регистрации токен израсходован
+        data.update(username='another', email='another@example.com')
+        self.assertIn('captcha', self.client.post(reverse('register'), data).json()['errors'])
+
+    def test_token_is_single_use(self):
+        text, token = issue_captcha()
+        self.assertTrue(check_captcha(token, text))
+        self.assertFalse(check_captcha(token, text))
+
+    def test_tampered_token_is_rejected(self):
+        text, token = issue_captcha()
+        self.assertFalse(check_captcha(token[:-2] + 'xx', text))
+
+
+class PurgeSessionsTests(TestCase):
+    def test_only_expired_sessions_are_deleted(self):
+        now = timezone.now()
+        for i in range(5):
+            Session.objects.create(session_key=f'old{i}', session_data='', expire_date=now - timedelta(days=1))
+        Session.objects.create(session_key='fresh', session_data='', expire_date=now + timedelta(days=1))
+        call_command('purge_sessions', batch_size=2, stdout=StringIO())
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['fresh'])
+
+
+class RecipientSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.me = create_user('me')
+        cls.ivan = create_user('ivan_p', first_name='Иван', last_name='Петров')
+        cls.ivanov = create_user('zzz', first_name='Пётр', last_name='Иванов')
+        cls.blocker = create_user('ivan_blocker', first_name='Иван')
+        Blacklist.objects.create(user=cls.blocker, blocked_user=cls.me)
+        for i in range(15):
+            create_user(f'other{i}')
+        Message.objects.create(sender=cls.me, receiver=cls.ivanov, content='Привет')
+
+    def search(self, q, **params):
+        self.client.force_login(self.me)
+        response = self.client.get(reverse('recipient_search'), {'q': q, **params})
+        return [row['username'] for row in response.json()['results']]
+
+    def test_case_insensitive_prefix_on_name_and_username(self):
+        self.assertEqual(self.search('ИВА'), ['zzz', 'ivan_p'])
+        self.assertEqual(self.search('иван петров'), ['ivan_p'])
+        self.assertEqual(self.search('петр'), ['zzz', 'ivan_p'])
+
+    def test_excludes_self_and_users_who_blocked_me(self):
+        self.assertNotIn('ivan_blocker', self.search('ivan'))
+        self.assertNotIn('me', self.search('m'))
+
+    def test_recent_correspondents_first_and_limit(self):
+        self.assertEqual(self.search('', limit=5), ['zzz'])
+        self.assertEqual(len(self.search('other', limit=3)), 3)
+
+    def test_tokens_follow_profile_changes(self):
+        self.ivan.first_name = 'Семён'
+        self.ivan.save()
+        self.assertEqual(self.search('семен'), ['ivan_p'])
+        self.assertNotIn('ivan_p', self.search('иван'))
+
+    def test_choose_user_page_is_bounded(self):
+        self.client.force_login(self.me)
+        response = self.client.get(reverse('send_message'))
+        self.assertEqual([user.username for user in response.context['users']], ['zzz'])
+
+
+class AvailabilityTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        availability.rebuild()
+
+    def test_negative_checks_skip_database(self):
+        create_user('taken_name')
+        availability.rebuild()
+        with self.assertNumQueries(0):
+            for i in range(50):
+                self.assertFalse(availability.username_taken(f'free_name_{i}'))
+
+    def test_checks_are_case_insensitive(self):
+        create_user('CaseUser', email='Case@Example.com')
+        self.assertTrue(availability.username_taken('caseuser'))
+        self.assertTrue(availability.email_taken('case@example.COM'))
+
+    def test_new_users_are_visible_immediately(self):
+        self.assertFalse(availability.username_taken('fresh'))
+        create_user('fresh')
+        self.assertTrue(availability.username_taken('fresh'))
+
+    def test_users_created_elsewhere_are_synced(self):
+        CustomUser.objects.bulk_create([CustomUser(username='bulk_user', email='bulk@example.com')])
+        with mock.patch('realty.availability.SYNC_INTERVAL', -1):
+            self.assertTrue(availability.username_taken('BULK_USER'))
+
+    def test_bloom_filter_false_positive_rate(self):
+        bloom = BloomFilter(10_000, error_rate=0.01)
+        for i in range(10_000):
+            bloom.add(f'user{i}')
+        self.assertTrue(all(f'user{i}' in bloom for i in range(10_000)))
+        false_positives = sum(f'other{i}' in bloom for i in range(10_000))
+        self.assertLess(false_positives, 300)
+
+    def test_case_insensitive_unique_index(self):
+        create_user('unique_me', email='')
+        create_user('another', email='')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            create_user('UNIQUE_ME', email='x@example.com')
+
+    def test_registration_form_rejects_taken_email(self):
+        create_user('someone', email='someone@example.com')
+        form = CustomUserCreationForm({
+            'username': 'newbie', 'email': 'SomeOne@example.com', 'first_name': 'А', 'last_name': 'Б',
+            'user_type': 'client', 'password1': 'secret123', 'password2': 'secret123', 'captcha': 'X',
+        })
+        self.assertFalse(form.is_valid())
+        self.assertIn('email', form.errors)
+
+    @override_settings(RATE_LIMITS={'availability': {'rate': '1/m', 'burst': 3}})
+    def test_check_endpoint_is_rate_limited(self):
+        url = reverse('register')
+        statuses = [self.client.get(url, {'check_username': f'name{i}'}).status_code for i in range(5)]
+        self.assertEqual(statuses, [200, 200, 200, 429, 429])
+
+
+class RateLimitTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_bucket_allows_burst_then_refills(self):
+        with mock.patch('realty.ratelimit.time.time', return_value=1000.0) as clock:
+            results = [ratelimit.consume('test', 'k', '1/s', 3)[0] for _ in range(5)]
+            self.assertEqual(results, [True, True, True, False, False])
+            self.assertEqual(ratelimit.consume('test', 'k', '1/s', 3), (False, 1))
+            clock.return_value = 1001.0
+            self.assertEqual([ratelimit.consume('test', 'k', '1/s', 3)[0] for _ in range(2)], [True, False])
+            clock.return_value = 1100.0
+            self.assertEqual([ratelimit.consume('test', 'k', '1/s', 3)[0] for _ in range(4)], [True, True, True, False])
+
+    def test_incr_extends_bucket_ttl(self):
+        with mock.patch('realty.ratelimit.time.time', return_value=1000.0), \
+                mock.patch('realty.ratelimit.cache.touch') as touch:
+            for _ in range(3):
+                ratelimit.consume('test', 'k', '1/s', 3)
+        # TAT ушёл на 3 с вперёд — ключ должен жить не меньше 3 с + 1
+        self.assertEqual(touch.call_args_list[-1], mock.call('ratelimit:test:k', 4))
+
+    def test_client_ip_ignores_forwarded_for_from_untrusted_peer(self):
+        request = RequestFactory().get('/', REMOTE_ADDR='203.0.113.5', HTTP_X_FORWARDED_FOR='1.2.3.4')
+        self.assertEqual(ratelimit.client_ip(request), '203.0.113.5')
+
+    @override_settings(TRUSTED_PROXIES=['10.0.0.0/8'])
+    def test_client_ip_skips_trusted_hops_from_the_right(self):
+        request = RequestFactory().get(
+            '/', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='1.2.3.4, 198.51.100.7, 10.0.0.2',
+        )
+        # 1.2.3.4 мог подставить сам клиент — берём первый недоверенный справа
+        self.assertEqual(ratelimit.client_ip(request), '198.51.100.7')
+        request = RequestFactory().get('/', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(ratelimit.client_ip(request), '10.0.0.1')
+
+    def test_buckets_are_per_key(self):
+        for _ in range(2):
+            ratelimit.consume('test', 'a', '1/m', 2)
+        self.assertFalse(ratelimit.consume('test', 'a', '1/m', 2)[0])
+        self.assertTrue(ratelimit.consume('test', 'b', '1/m', 2)[0])
+
+    @override_settings(RATE_LIMITS={'messages': {'rate': '1/m', 'burst': 2, 'keys': ('client', 'ip')}})
+    def test_middleware_limits_chat_posts(self):
+        sender = create_user('sender')
+        receiver = create_user('receiver')
+        self.client.force_login(sender)
+        url = reverse('chat_with_user', args=[receiver.pk])
+        statuses = [self.client.post(url, {'content': f'msg {i}'}).status_code for i in range(3)]
+        self.assertEqual(statuses, [302, 302, 429])
+        self.assertEqual(Message.objects.count(), 2)
+        response = self.client.post(url, {'content': 'again'})
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        # GET не ограничивается
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    @override_settings(RATE_LIMITS={'recipient_search': {'rate': '1/m', 'burst': 1}})
+    def test_decorator_returns_json_429(self):
+        self.client.force_login(create_user('searcher'))
+        url = reverse('recipient_search')
+        self.assertEqual(self.client.get(url).status_code, 200)
+        response = self.client.get(url, headers={'accept': 'application/json'})
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('retry_after', response.json())
+
+    def test_overhead_benchmark(self):
+        result = run_ratelimit_benchmark(iterations=200)
+        self.assertGreater(result['check_rate_limit_us'], 0)
+
+
+class MaintenanceTests(TestCase):
+    def setUp(self):
+        self.owner = create_user('owner')
+        self.spammer = create_user('spammer')
+        for i in range(7):
+            Message.objects.create(sender=self.spammer, receiver=self.owner, content=f'spam {i}')
+        Message.objects.create(sender=self.owner, receiver=self.spammer, content='ответ')
+
+    def test_blacklist_add_purges_after_commit(self):
+        self.client.force_login(self.owner)
+        with mock.patch('realty.maintenance.run_in_background', side_effect=lambda f, *a: f(*a)) as background:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.get(reverse('blacklist_add', args=[self.spammer.pk]))
+        background.assert_called_once()
+        self.assertFalse(Message.objects.filter(sender=self.spammer).exists())
+        self.assertTrue(Message.objects.filter(sender=self.owner).exists())
+        self.assertTrue(Blacklist.objects.get(user=self.owner).messages_purged)
+
+    @override_settings(BLACKLIST_PURGE_IN_BACKGROUND=False)
+    def test_pending_purge_runs_in_batches(self):
+        self.client.force_login(self.owner)
+        response = self.client.get(reverse('blacklist_add', args=[self.spammer.pk]), follow=True)
+        self.assertContains(response, 'будут удалены в ближайшее время')
+        # До очистки чат уже не показывает сообщения заблокированного
+        response = self.client.get(reverse('chat_with_user', args=[self.spammer.pk]))
+        self.assertEqual([m.content for m in response.context['chat_messages']], ['ответ'])
+        progress = []
+        self.assertEqual(purge_pending_blacklists(batch_size=3, progress=lambda *p: progress.append(p)), 7)
+        self.assertEqual(progress, [(3, 7), (6, 7), (7, 7)])
+        self.assertEqual(purge_pending_blacklists(), 0)
+
+    def test_retention_archives_then_deletes(self):
+        Message.objects.filter(content__in=['spam 0', 'spam 1', 'spam 2']).update(
+            created_at=timezone.now() - timedelta(days=400)
+        )
+        with tempfile.TemporaryDirectory() as archive_dir:
+            self.assertEqual(archive_old_messages(days=365, archive_dir=archive_dir, dry_run=True), (3, None))
+            count, path = archive_old_messages(days=365, archive_dir=archive_dir, batch_size=2)
+            self.assertEqual(count, 3)
+            with gzip.open(path, 'rt', encoding='utf-8') as archive:
+                rows = [json.loads(line) for line in archive]
+        self.assertEqual([row['content'] for row in rows], ['spam 0', 'spam 1', 'spam 2'])
+        self.assertEqual(Message.objects.count(), 5)
+
+    def test_retention_does_not_overwrite_archive_from_same_second(self):
+        old = timezone.now() - timedelta(days=400)
+        Message.objects.filter(content='spam 0').update(created_at=old)
+        frozen = timezone.now()
+        with tempfile.TemporaryDirectory() as archive_dir, \
+                mock.patch('realty.maintenance.timezone.now', return_value=frozen):
+            _, first = archive_old_messages(days=365, archive_dir=archive_dir)
+            Message.objects.filter(content='spam 1').update(created_at=old)
+            _, second = archive_old_messages(days=365, archive_dir=archive_dir)
+            self.assertNotEqual(first, second)
+            contents = []
+            for path in (first, second):
+                with gzip.open(path, 'rt', encoding='utf-8') as archive:
+                    contents.append([json.loads(line)['content'] for line in archive])
+        self.assertEqual(contents, [['spam 0'], ['spam 1']])
+
+    def test_command_reports_progress(self):
+        out = StringIO()
+        call_command('run_maintenance', '--skip-retention', stdout=out)
+        self.assertIn('Удалено сообщений заблокированных пользователей: 0', out.getvalue())
+
+
+# Версии страниц в LocMem годятся для одного процесса — как и тестовый сервер
+@override_settings(CONDITIONAL_GET_ENABLED=True)
+class ConditionalGetTests(CatalogDataMixin, TestCase):
+    @override_settings(CONDITIONAL_GET_ENABLED=False)
+    def test_disabled_without_shared_cache(self):
+        url = reverse('property_detail', args=[Property.objects.first().pk])
+        response = self.client.get(url)
+        self.assertFalse(response.has_header('ETag'))
+        self.assertEqual(self.client.get(url, headers={'if-none-match': '"x"'}).status_code, 200)
+
+    def test_detail_returns_304_without_rendering(self):
+        prop = Property.objects.first()
+        url = reverse('property_detail', args=[prop.pk])
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('no-cache', first['Cache-Control'])
+
+        with self.assertNumQueries(1):  # только счётчик просмотров, версия — из кэша
+            repeat = self.client.get(url, headers={'if-none-match': first['ETag']})
+        self.assertEqual(repeat.status_code, 304)
+        self.assertEqual(repeat.templates, [])
+        self.assertEqual(repeat.content, b'')
+        prop.refresh_from_db()
+        self.assertEqual(prop.views, 2)
+
+    def test_new_comment_changes_etag(self):
+        prop = Property.objects.first()
+        url = reverse('property_detail', args=[prop.pk])
+        etag = self.client.get(url)['ETag']
+        Comment.objects.create(property=prop, author=self.client_user, text='Новый')
+        response = self.client.get(url, headers={'if-none-match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_ajax_listing_poll(self):
+        url = reverse('property_list') + '?type=apartment'
+        ajax = {'x-requested-with': 'XMLHttpRequest'}
+        first = self.client.get(url, headers=ajax)
+        self.assertEqual(first.status_code, 200)
+        # HTML-страница по тому же адресу имеет другую версию
+        self.assertNotEqual(self.client.get(url)['ETag'], first['ETag'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, headers={**ajax, 'if-none-match': first['ETag']}).status_code, 304)
+
+        Property.objects.first().save()
+        self.assertEqual(self.client.get(url, headers={**ajax, 'if-none-match': first['ETag']}).status_code, 200)
+
+    def test_image_and_archive_change_versions(self):
+        url = reverse('property_list')
+        etag = self.client.get(url)['ETag']
+        PropertyImage.objects.create(property=self.properties[1], image='property_images/new.jpg')
+        response = self.client.get(url, headers={'if-none-match': etag})
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+        Property.objects.filter(pk=self.properties[2].pk).update(
+            status='sold', updated_at=timezone.now() - timedelta(days=400),
+        )
+        archive_properties()
+        self.assertEqual(self.client.get(url, headers={'if-none-match': etag}).status_code, 200)
+        # Сортировка по просмотрам всегда рендерится заново
+        self.assertNotIn('ETag', self.client.get(url, {'sort': '-views'}))
+
+
+class CompressionTests(TestCase):
+    body = ('<p>Квартира в центре</p>' * 100).encode()
+
+    def process(self, response, accept='gzip, br'):
+        request = RequestFactory().get('/', headers={'accept-encoding': accept})
+        return CompressionMiddleware(lambda r: response).process_response(request, response)
+
+    def test_negotiation(self):
+        self.assertEqual(choose_encoding('gzip, deflate'), 'gzip')
+        self.assertEqual(choose_encoding('gzip;q=1.0, br;q=0.5'), 'gzip')
+        self.assertIsNone(choose_encoding('identity'))
+        self.assertIsNone(choose_encoding('gzip;q=0'))
+        if brotli is not None:
+            self.assertEqual(choose_encoding('gzip, br'), 'br')
+
+    def test_gzip_response(self):
+        response = self.process(HttpResponse(self.body), accept='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content), self.body)
+
+    def test_brotli_streaming_response(self):
+        if brotli is None:
+            self.skipTest('brotli не установлен')
+        response = self.process(StreamingHttpResponse(iter([self.body, self.body])))
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(b''.join(response.streaming_content)), self.body * 2)
+
+    def test_streaming_chunks_are_flushed(self):
+        response = self.process(StreamingHttpResponse(iter([self.body, self.body])), accept='gzip')
+        chunks = list(response.streaming_content)
+        # Каждый фрагмент отдаётся сразу, а не накапливается до конца
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(zlib.decompress(b''.join(chunks), 31), self.body * 2)
+
+    def test_skips_small_and_binary(self):
+        self.assertFalse(self.process(HttpResponse(b'ok')).has_header('Content-Encoding'))
+        image = self.process(HttpResponse(self.body, content_type='image/jpeg'))
+        self.assertFalse(image.has_header('Content-Encoding'))
+
+    @override_settings(CONDITIONAL_GET_ENABLED=True)
+    def test_conditional_get_with_compressed_etag(self):
+        owner = create_user('owner')
+        prop = create_property(owner)
+        url = reverse('property_detail', args=[prop.pk])
+        first = self.client.get(url, headers={'accept-encoding': 'gzip'})
+        self.assertEqual(first['Content-Encoding'], 'gzip')
+        self.assertTrue(first['ETag'].startswith('W/'))
+        repeat = self.client.get(url, headers={'accept-encoding': 'gzip', 'if-none-match': first['ETag']})
+        self.assertEqual(repeat.status_code, 304)
+
+
+class RecommendationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = create_user('owner', user_type='realtor')
+        cls.flats = [
+            create_property(cls.owner, title=f'Квартира {i}', price=5000000 + i * 100000, area=50 + i,
+                            rooms=2, location=f'Москва, ул. Ленина, {i}')
+            for i in range(5)
+        ]
+        cls.house = create_property(cls.owner, title='Дом', property_type='house', price=30000000, area=250,
+                                    rooms=6, location='Сочи, ул. Морская, 1')
+        PropertyImage.objects.create(property=cls.flats[1], image='property_images/flat.jpg', is_main=True)
+
+    def setUp(self):
+        # Матрица процесса пережила бы откат данных предыдущего теста
+        recommendations.matrix_cache.forget()
+
+    def test_nearest_neighbours(self):
+        rows = [(1, 'apartment', 100, 50, 2, 'Москва'), (2, 'apartment', 110, 52, 2, 'Москва'),
+                (3, 'house', 900, 300, 6, 'Сочи'), (4, 'apartment', 105, 51, 2, 'Москва')]
+        result = FeatureMatrix.from_rows(rows).neighbours([0], k=2)
+        self.assertEqual([pk for pk, _ in result[1]], [4, 2])
+
+    def test_detail_page_serves_precomputed_list(self):
+        rebuild_all(k=3)
+        self.assertEqual(SimilarProperty.objects.filter(property=self.flats[0]).count(), 3)
+        with self.assertNumQueries(1):
+            similar = similar_properties(self.flats[0].pk)
+        self.assertNotIn(self.house, similar)
+        self.assertEqual(similar[0].main_image_path, 'property_images/flat.jpg')
+        response = self.client.get(reverse('property_detail', args=[self.flats[0].pk]))
+        self.assertContains(response, 'Похожие объявления')
+
+    def test_incremental_refresh(self):
+        rebuild_all(k=3)
+        # Дом становится квартирой рядом с остальными — попадает в их списки
+        Property.objects.filter(pk=self.house.pk).update(
+            property_type='apartment', price=5200000, area=52, rooms=2, location='Москва, ул. Ленина, 7'
+        )
+        refresh([self.house.pk], k=3)
+        self.assertTrue(SimilarProperty.objects.filter(similar=self.house).exists())
+        self.assertEqual(SimilarProperty.objects.filter(property=self.house).count(), 3)
+
+        Property.objects.filter(pk=self.house.pk).update(status='sold')
+        refresh([self.house.pk], k=3)
+        self.assertFalse(SimilarProperty.objects.filter(Q(similar=self.house) | Q(property=self.house)).exists())
+
+    def test_refresh_reads_only_changed_rows(self):
+        rebuild_all(k=3)
+        Property.objects.filter(pk=self.flats[4].pk).update(price=5050000)
+        with mock.patch.object(FeatureMatrix, 'load', side_effect=AssertionError('full reload')):
+            self.assertGreater(refresh([self.flats[4].pk], k=3), 0)
+            # Снято с продажи без refresh (как в другом процессе) — в списки не попадает
+            Property.objects.filter(pk=self.flats[3].pk).update(status='sold')
+            refresh([self.flats[2].pk], k=3)
+        self.assertFalse(SimilarProperty.objects.filter(property=self.flats[2], similar=self.flats[3]).exists())
+        self.assertEqual(SimilarProperty.objects.filter(property=self.flats[2]).count(), 3)
+
+    @override_settings(RECOMMENDATIONS_K=3)
+    def test_save_schedules_refresh(self):
+        with mock.patch('realty.maintenance.run_in_background', side_effect=lambda f: f()):
+            with self.captureOnCommitCallbacks(execute=True):
+                prop = create_property(self.owner, title='Новая', location='Москва, ул. Ленина, 9')
+        self.assertEqual(SimilarProperty.objects.filter(property=prop).count(), 3)
+
+
+class MarketAnalyticsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = create_user('owner', user_type='realtor')
+        for price in (4000000, 5000000, 9000000):
+            create_property(cls.owner, price=price, area=50, location='г. Казань, ул. Баумана, 1')
+        create_property(cls.owner, property_type='house', price=20000000, area=200, location='Казань')
+
+    def test_rebuild_streams_groups(self):
+        self.assertEqual(analytics.rebuild_all(chunk_size=2), 2)
+        row = MarketStats.objects.get(property_type='apartment', city='Казань')
+        self.assertEqual(row.count, 3)
+        self.assertEqual(row.price_m2_median, 100000)
+        self.assertEqual(row.month, timezone.localdate().replace(day=1))
+        self.assertIsNone(row.days_to_sold_median)
+
+    def test_sold_transition_and_incremental_refresh(self):
+        analytics.rebuild_all()
+        prop = Property.objects.filter(property_type='apartment').first()
+        Property.objects.filter(pk=prop.pk).update(created_at=timezone.now() - timedelta(days=10))
+        prop.refresh_from_db()
+        with mock.patch('realty.maintenance.run_in_background', side_effect=lambda f: f()):
+            with self.captureOnCommitCallbacks(execute=True):
+                prop.status = 'sold'
+                prop.property_type = 'commercial'
+                prop.save()
+        self.assertIsNotNone(prop.sold_at)
+        moved = MarketStats.objects.get(property_type='commercial', city='Казань', month=analytics.month_of(prop.created_at))
+        self.assertEqual((moved.count, moved.sold_count), (1, 1))
+        self.assertAlmostEqual(moved.days_to_sold_median, 10, places=0)
+        # Старая группа пересчитана без этого объявления
+        if analytics.month_of(prop.created_at) == timezone.localdate().replace(day=1):
+            self.assertEqual(MarketStats.objects.get(property_type='apartment').count, 2)
+
+        prop.status = 'active'
+        prop.save()
+        self.assertIsNone(prop.sold_at)
+
+    def test_api_reads_only_rollup(self):
+        analytics.rebuild_all()
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('market_analytics_api'), {'type': 'house', 'city': 'Казань'})
+        self.assertEqual([row['price_m2_median'] for row in response.json()['results']], [100000])
+        self.assertContains(self.client.get(reverse('market_analytics')), 'Казань')
+
+
+class SavedSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.realtor = create_user('realtor', user_type='realtor')
+        cls.buyer = create_user('buyer')
+        cls.flat_search = SavedSearch.objects.create(user=cls.buyer, property_type='apartment', rooms=2, max_price=6000000)
+        cls.text_search = SavedSearch.objects.create(user=cls.buyer, search='ленина', notify='digest')
+        SavedSearch.objects.create(user=cls.buyer, property_type='house')
+        SavedSearch.objects.create(user=create_user('other'), min_price=10000000)
+        notifications_sender()
+
+    def notifications(self):
+        return Message.objects.filter(sender__username='kupidom', receiver=self.buyer)
+
+    def test_batch_matching_uses_constant_queries(self):
+        props = [create_property(self.realtor, price=5000000 + i, location='Москва, ул. Ленина, 1') for i in range(5)]
+        props.append(create_property(self.realtor, price=50000000, location='Сочи'))
+        with self.assertNumQueries(8):
+            self.assertEqual(match_properties([prop.pk for prop in props]), 11)
+        self.assertEqual(self.flat_search.matches.count(), 5)
+        self.assertEqual(self.text_search.matches.filter(notified=False).count(), 5)
+        # Одно сообщение на пачку, а не на каждое совпадение
+        self.assertEqual(self.notifications().count(), 1)
+        self.assertIn(reverse('property_detail', args=[props[0].pk]), self.notifications().get().content)
+        self.assertEqual(match_properties([prop.pk for prop in props]), 0)
+
+    def test_digest(self):
+        prop = create_property(self.realtor, price=9000000, location='Казань, ул. Ленина, 5')
+        match_properties([prop.pk])
+        self.assertEqual(self.notifications().count(), 0)
+        out = StringIO()
+        call_command('send_search_digests', stdout=out)
+        self.assertIn('пользователям: 1', out.getvalue())
+        self.assertIn('Сводка', self.notifications().get().content)
+        self.assertEqual(send_digests(), 0)
+
+    def test_notifications_increment_cached_unread_counter(self):
+        unread.store(self.buyer.pk, 3)
+        flat = create_property(self.realtor, price=5000000, location='Москва, ул. Ленина, 1')
+        with self.captureOnCommitCallbacks(execute=True):
+            match_properties([flat.pk])
+        # Два совпадения одного пользователя — одно сообщение
+        self.assertEqual(unread.peek(self.buyer.pk), 4)
+        with self.captureOnCommitCallbacks(execute=True):
+            send_digests()
+        self.assertEqual(unread.peek(self.buyer.pk), 5)
+
+    def test_sender_never_takes_over_real_account(self):
+        CustomUser.objects.filter(is_system=True).delete()
+        real = create_user('KupiDom')
+        sender = notifications_sender()
+        self.assertEqual((sender.username, sender.is_system), ('kupidom_1', True))
+        self.assertFalse(sender.has_usable_password())
+        self.assertEqual(notifications_sender(), sender)
+        self.assertEqual(CustomUser.objects.get(pk=real.pk).password, real.password)
+        self.assertFalse(CustomUser.objects.get(pk=real.pk).is_system)
+
+    def test_sender_username_is_reserved(self):
+        form = CustomUserCreationForm({'username': 'KUPIDOM_2'})
+        self.assertEqual(form.errors['username'], ['Этот логин зарезервирован'])
+
+    def test_reactivation_schedules_matching(self):
+        prop = create_property(self.realtor, status='sold')
+        prop = Property.objects.get(pk=prop.pk)
+        with mock.patch('realty.saved_searches.match_queue.schedule') as schedule:
+            prop.status = 'active'
+            prop.save()
+            prop.title = 'Новое название'
+            prop.save()
+        schedule.assert_called_once_with([prop.pk])
+
+    def test_blocked_sender_is_respected(self):
+        Blacklist.objects.create(user=self.buyer, blocked_user=notifications_sender())
+        self.assertEqual(match_properties([create_property(self.realtor).pk]), 0)
+
+    def test_save_search_from_catalog(self):
+        self.client.force_login(self.buyer)
+        response = self.client.post(reverse('saved_search_create'), {
+            'type': 'land', 'min_price': 'abc', 'max_price': '100000', 'rooms': '', 'search': ' дача ', 'notify': 'digest',
+        })
+        saved = SavedSearch.objects.get(user=self.buyer, property_type='land')
+        self.assertEqual((saved.min_price, saved.max_price, saved.search, saved.notify), (None, 100000, 'дача', 'digest'))
+        self.assertRedirects(response, reverse('property_list') + '?type=land&max_price=100000&search=%D0%B4%D0%B0%D1%87%D0%B0',
+                             fetch_redirect_response=False)
+        self.assertContains(self.client.get(reverse('saved_search_list')), 'Земельный участок')
+
+
+@override_settings(VIEW_EVENTS_BUFFER_SIZE=3, VIEW_EVENTS_FLUSH_IN_BACKGROUND=False)
+class ViewStatsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.realtor = create_user('realtor', user_type='realtor', password='pass')
+        cls.client_user = create_user('client', password='pass')
+        cls.prop = create_property(cls.realtor)
+
+    def setUp(self):
+        viewstats.view_events._take()
+
+    def view(self, times=1, **headers):
+        for _ in range(times):
+            self.client.get(reverse('property_detail', args=[self.prop.pk]), **headers)
+
+    def test_hyperloglog(self):
+        def digest(value):
+            return int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), 'big')
+
+        first, second = viewstats.HyperLogLog(), viewstats.HyperLogLog()
+        for value in range(5000):
+            (first if value % 2 else second).add(digest(value))
+            first.add(digest(1))
+        self.assertAlmostEqual(first.count(), 2500, delta=250)
+        merged = viewstats.HyperLogLog(first.to_bytes()).merge(second)
+        self.assertAlmostEqual(merged.count(), 5000, delta=500)
+        small = viewstats.HyperLogLog()
+        for value in (1, 2, 3, 2, 1):
+            small.add(digest(value))
+        self.assertEqual(small.count(), 3)
+
+    def test_buffered_events_are_rolled_up(self):
+        self.view(2, HTTP_USER_AGENT='first')
+        # Пока буфер не заполнен, в базу ничего не пишется
+        self.assertEqual(PropertyViewEvent.objects.count(), 0)
+        self.view(HTTP_USER_AGENT='second')
+        self.assertEqual(PropertyViewEvent.objects.count(), 3)
+        day = PropertyViewStats.objects.get(property=self.prop, period='day')
+        hour = PropertyViewStats.objects.get(property=self.prop, period='hour')
+        self.assertEqual((day.views, day.visitors), (3, 2))
+        self.assertEqual((hour.views, hour.visitors), (3, 2))
+
+        self.client.force_login(self.client_user)
+        self.view()
+        self.assertEqual(viewstats.view_events.flush(), 1)
+        day.refresh_from_db()
+        self.assertEqual((day.views, day.visitors), (4, 3))
+        self.assertEqual(viewstats.rollup(), 0)
+
+    def test_rollup_skips_deleted_properties(self):
+        gone = create_property(self.realtor)
+        gone_pk = gone.pk
+        gone.delete()
+        # Буфер мог записать просмотр уже удалённого объявления
+        PropertyViewEvent.objects.bulk_create([
+            PropertyViewEvent(property_id=gone_pk, visitor=1, viewed_at=timezone.now()),
+            PropertyViewEvent(property=self.prop, visitor=1, viewed_at=timezone.now()),
+        ])
+        self.assertEqual(viewstats.rollup(), 2)
+        self.assertEqual(PropertyViewStats.objects.filter(period='day').count(), 1)
+
+    def test_purge_keeps_events_not_rolled_up(self):
+        old = timezone.now() - timedelta(days=40)
+        PropertyViewEvent.objects.create(property=self.prop, visitor=1, viewed_at=old)
+        viewstats.rollup()
+        PropertyViewEvent.objects.create(property=self.prop, visitor=2, viewed_at=old)
+        self.assertEqual(viewstats.purge_old(), (1, 1))
+        self.assertEqual(PropertyViewEvent.objects.count(), 1)
+        self.assertTrue(PropertyViewStats.objects.filter(period='day').exists())
+
+    def test_late_committed_lower_pk_is_rolled_up(self):
+        now = timezone.now()
+        PropertyViewEvent.objects.create(pk=100, property=self.prop, visitor=1, viewed_at=now)
+        self.assertEqual(viewstats.rollup(), 1)
+        # Пачка другого процесса получила меньший pk, но зафиксировалась позже
+        PropertyViewEvent.objects.create(pk=50, property=self.prop, visitor=2, viewed_at=now)
+        self.assertEqual(viewstats.rollup(), 1)
+        self.assertEqual(PropertyViewStats.objects.get(period='day').views, 2)
+        self.assertFalse(PropertyViewEvent.objects.filter(rolled_up=False).exists())
+
+    def test_owner_charts(self):
+        self.view(3)
+        self.client.force_login(self.realtor)
+        response = self.client.get(reverse('profile'))
+        self.assertContains(response, 'class="view-chart-bar"', count=14)
+        self.assertContains(response, 'За 14 дней: 3 просм., ~1 уник. посетителей')
+
+        data = self.client.get(reverse('property_view_stats', args=[self.prop.pk]), {'period': 'hour', 'count': 24}).json()
+        self.assertEqual(len(data['points']), 24)
+        self.assertEqual((data['views'], data['points'][-1]['views']), (3, 3))
+
+        self.client.force_login(self.client_user)
+        self.assertEqual(self.client.get(reverse('property_view_stats', args=[self.prop.pk])).status_code, 404)
+
+
+class AdminChangelistTests(TestCase):
+    """Число запросов к спискам админки не зависит от числа строк"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = create_user('admin', is_staff=True, is_superuser=True)
+
+    def setUp(self):
+        self.client.force_login(self.admin_user)
+
+    def add_rows(self, start, count):
+        for i in range(start, start + count):
+            owner = create_user(f'owner{i}')
+            prop = create_property(owner, title=f'Объект {i}')
+            PropertyImage.objects.create(property=prop, image=f'property_images/{i}.jpg')
+            Comment.objects.create(property=prop, author=owner, text='Текст')
+            Message.objects.create(sender=owner, receiver=self.admin_user, content='Привет')
+            Blacklist.objects.create(user=self.admin_user, blocked_user=owner)
+
+    def changelist_queries(self, model):
+        url = reverse(f'admin:realty_{model}_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(queries)
+
+    def test_query_count_is_constant(self):
+        models = ('customuser', 'property', 'propertyimage', 'comment', 'message', 'blacklist')
+        self.add_rows(0, 2)
+        few = {model: self.changelist_queries(model) for model in models}
+        self.add_rows(2, 10)
+        many = {model: self.changelist_queries(model) for model in models}
+        self.assertEqual(few, many)
+
+    def test_estimated_count_without_filters(self):
+        self.add_rows(0, 3)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        queryset = Property.objects.order_by('-pk')
+        with override_settings(ADMIN_ESTIMATED_COUNT_THRESHOLD=1):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(EstimatedCountPaginator(queryset, 50).count, 3)
+            self.assertNotIn('COUNT(', queries[0]['sql'])
+            # С фильтром — точный подсчёт
+            self.assertEqual(EstimatedCountPaginator(queryset.filter(status='sold'), 50).count, 0)
+        self.assertEqual(EstimatedCountPaginator(queryset, 50).count, 3)
+
+    def test_autocomplete_widgets(self):
+        prop = create_property(self.admin_user)
+        response = self.client.get(reverse('admin:realty_message_add'))
+        self.assertContains(response, 'admin-autocomplete')
+        self.assertNotContains(response, '<option value="%d">' % self.admin_user.pk)
+        response = self.client.get(reverse('admin:autocomplete'), {
+            'app_label': 'realty', 'model_name': 'comment', 'field_name': 'property', 'term': prop.title,
+        })
+        self.assertEqual(response.json()['results'][0]['id'], str(prop.pk))
+
+
+class AsyncViewTests(CatalogDataMixin, TestCase):
+    """Представления через AsyncClient: middleware в async-режиме, как под ASGI"""
+
+    @override_settings(CONDITIONAL_GET_ENABLED=True)
+    async def test_catalog_pages(self):
+        response = await self.async_client.get(reverse('home'))
+        self.assertEqual(response.context['properties_count'], 8)
+        self.assertEqual(response.context['realtors_count'], 1)
+
+        response = await self.async_client.get(
+            reverse('property_list'), {'page': 2, 'sort': 'price'}, headers={'x-requested-with': 'XMLHttpRequest'},
+        )
+        data = json.loads(response.content)
+        # Страница вне диапазона — последняя, как у Paginator.get_page
+        self.assertEqual([item['title'] for item in data['properties']], [f'Объект {i}' for i in range(8)])
+        self.assertEqual(data['current_page'], 1)
+        response = await self.async_client.get(reverse('property_list'), {'page': 'x'})
+        self.assertEqual(len(response.context['page_obj']), 8)
+
+        prop = self.properties[0]
+        response = await self.async_client.get(reverse('property_detail', args=[prop.pk]))
+        self.assertEqual(len(response.context['comments']), 8)
+        self.assertEqual(response.context['property'].views, 1)
+        response = await self.async_client.get(
+            reverse('property_detail', args=[prop.pk]), headers={'if-none-match': response['ETag']},
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual((await Property.objects.aget(pk=prop.pk)).views, 2)
+
+    async def test_message_list(self):
+        response = await self.async_client.get(reverse('message_list'))
+        self.assertEqual(response.status_code, 302)
+        await self.async_client.aforce_login(self.client_user)
+        response = await self.async_client.get(reverse('message_list'))
+        self.assertEqual(len(response.context['dialogues']), 9)
+        self.assertEqual(sum(dialogue['unread_count'] for dialogue in response.context['dialogues']), 8)
+
+
+class GatherQueriesTests(SimpleTestCase):
+    @override_settings(ASYNC_PARALLEL_QUERIES=True)
+    async def test_parallel_outside_transaction(self):
+        results = await gather_queries(lambda: 1, threading.get_ident, lambda: 3)
+        self.assertEqual((results[0], results[2]), (1, 3))
+        self.assertNotEqual(results[1], threading.get_ident())
+
+    async def test_sequential_by_default(self):
+        self.assertEqual(await gather_queries(lambda: 1, lambda: 2), [1, 2])
+
+
+@override_settings(VIEW_EVENTS_ENABLED=False)
+class AsyncViewQueryCountTests(CatalogDataMixin, TestCase):
+    """Число запросов async-представлений видно CaptureQueriesContext (и бенчмаркам)"""
+
+    def assertViewQueries(self, expected, url):
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(len(captured), expected, [query['sql'] for query in captured])
+
+    def test_query_counts(self):
+        self.assertViewQueries(3, reverse('home'))  # карточки + два агрегата
+        self.assertViewQueries(2, reverse('property_list'))  # число строк + страница
+        # объявление, фото, счётчик просмотров, комментарии, похожие
+        self.assertViewQueries(5, reverse('property_detail', args=[self.properties[0].pk]))
+        self.client.force_login(self.client_user)
+        # сессия, пользователь, последние сообщения, непрочитанные
+        self.assertViewQueries(4, reverse('message_list'))
+
+
+# Фоновые потоки после on_commit держали бы общую in-memory базу во время flush
+@override_settings(
+    ASYNC_PARALLEL_QUERIES=True,
+    BLACKLIST_PURGE_IN_BACKGROUND=False,
+    RECOMMENDATIONS_REFRESH_IN_BACKGROUND=False,
+    MARKET_STATS_REFRESH_IN_BACKGROUND=False,
+    SAVED_SEARCH_MATCH_IN_BACKGROUND=False,
+    VIEW_EVENTS_FLUSH_IN_BACKGROUND=False,
+)
+class ParallelQueryHooksTests(CatalogDataMixin, TransactionTestCase):
+    """Запросы на соединениях пула потоков видят подсчёт и детектор N+1"""
+
+    def setUp(self):
+        # TransactionTestCase не вызывает setUpTestData
+        self.setUpTestData()
+
+    def test_worker_queries_are_captured(self):
+        threads = set()
+        with CaptureQueriesContext(connection) as captured, \
+                detect_n_plus_one(strict=True) as collector:
+            home = self.client.get(reverse('home'))
+        self.assertEqual(home.status_code, 200)
+        self.assertEqual(len(captured), 3)
+        self.assertEqual(collector.total, 3)
+
+        with CaptureQueriesContext(connection) as captured:
+            results = async_to_sync(gather_queries)(
+                lambda: threads.add(threading.get_ident()) or Property.objects.count(),
+                lambda: threads.add(threading.get_ident()) or Comment.objects.count(),
+            )
+        self.assertEqual(results, [8, 8])
+        self.assertNotIn(threading.get_ident(), threads)
+        self.assertEqual(len(captured), 2)
+
+
+class ArchiveTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = create_user('owner', user_type='realtor')
+        cls.active = create_property(cls.owner, title='Актуальное', location='Казань')
+        cls.sold = create_property(cls.owner, title='Давно продано', status='sold', location='Казань')
+        PropertyImage.objects.create(property=cls.sold, image='property_images/sold.jpg', is_main=True)
+        Comment.objects.create(property=cls.sold, author=create_user('reader'), text='Уже продано?')
+        cls.created_at = timezone.now() - timedelta(days=400)
+        Property.objects.filter(pk=cls.sold.pk).update(
+            created_at=cls.created_at, updated_at=timezone.now() - timedelta(days=200),
+        )
+
+    def test_archive_moves_rows_with_same_ids(self):
+        self.assertEqual(archive_properties(dry_run=True), 1)
+        self.assertEqual(archive_properties(days=365), 0)
+        self.assertEqual(archive_properties(batch_size=1), 1)
+        self.assertFalse(Property.objects.filter(pk=self.sold.pk).exists())
+        archived = ArchivedProperty.objects.get(pk=self.sold.pk)
+        self.assertEqual(archived.created_at, self.created_at)
+        self.assertEqual(archived.main_image.image.name, 'property_images/sold.jpg')
+        self.assertEqual(ArchivedComment.objects.get(property=archived).text, 'Уже продано?')
+        self.assertFalse(Comment.objects.exists())
+        # Каталог archived-строк не видит, аналитика считает обе таблицы
+        self.assertNotContains(self.client.get(reverse('property_list')), 'Давно продано')
+        analytics.rebuild_all()
+        self.assertEqual(sum(MarketStats.objects.values_list('count', flat=True)), 2)
+
+    def test_reactivate_restores_from_archive(self):
+        archive_properties()
+        self.client.force_login(self.owner)
+        response = self.client.get(reverse('profile'))
+        self.assertContains(response, 'Давно продано')
+        self.assertContains(response, reverse('property_reactivate', args=[self.sold.pk]))
+
+        self.client.post(reverse('property_reactivate', args=[self.sold.pk]))
+        prop = Property.objects.get(pk=self.sold.pk)
+        self.assertEqual(prop.status, 'active')
+        self.assertEqual(prop.created_at, self.created_at)
+        self.assertEqual(prop.images.get().image.name, 'property_images/sold.jpg')
+        self.assertEqual(prop.comments.count(), 1)
+        self.assertFalse(ArchivedProperty.objects.exists())
+        self.assertEqual(restore_properties([self.sold.pk]), 0)
+
+    def test_archive_keeps_image_files(self):
+        # Перенос — не удаление: django_cleanup не должен стирать файлы фото
+        with mock.patch('django.core.files.storage.FileSystemStorage.delete') as delete, \
+                self.captureOnCommitCallbacks(execute=True):
+            archive_properties()
+            restore_properties([self.sold.pk])
+        delete.assert_not_called()
+
+    def test_archive_is_owner_only(self):
+        archive_properties()
+        self.client.force_login(create_user('stranger', user_type='realtor'))
+        self.assertEqual(self.client.post(reverse('property_reactivate', args=[self.sold.pk])).status_code, 404)
+        self.assertTrue(ArchivedProperty.objects.filter(pk=self.sold.pk).exists())
+
+    def test_run_maintenance_archives_properties(self):
+        out = StringIO()
+        call_command('run_maintenance', '--skip-blacklists', '--skip-retention', stdout=out, verbosity=0)
+        self.assertIn('Перенесено в архив объявлений: 1', out.getvalue())
+
+
+class PropertyCardTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        owner = create_user('owner', user_type='realtor')
+        cls.prop = create_property(owner, title='<b>Студия</b>', price=4500000, area=30.5, rooms=None)
+        PropertyImage.objects.create(property=cls.prop, image='property_images/second.jpg')
+        PropertyImage.objects.create(property=cls.prop, image='property_images/main.jpg', is_main=True)
+
+    def test_rows_from_single_query(self):
+        with self.assertNumQueries(1):
+            card = card_rows(card_values(Property.objects.all()))[0]
+        self.assertEqual(card['url'], reverse('property_detail', args=[self.prop.pk]))
+        self.assertEqual(card['image_url'], self.prop.main_image.image.url)
+        self.assertEqual((card['price'], card['area'], card['rooms']), ('4 500 000', '30,5', ''))
+
+    def test_url_survives_script_prefix_with_zero(self):
+        set_script_prefix('/0/')
+        self.addCleanup(set_script_prefix, '/')
+        card = card_rows(card_values(Property.objects.all()))[0]
+        self.assertEqual(card['url'], f'/0/property/{self.prop.pk}/')
+
+    @skipUnless('jinja2' in {engine.name for engine in engines.all()}, 'Jinja2 не установлен')
+    def test_engines_render_same_html(self):
+        cards = card_rows(card_values(Property.objects.all()))
+        for variant in ('catalog', 'home'):
+            html = render_cards(cards, variant, engine='django')
+            self.assertIn('&lt;b&gt;Студия&lt;/b&gt;', html)
+            self.assertEqual(html.split(), render_cards(cards, variant, engine='jinja2').split())
+
+    def test_catalog_uses_shared_partial(self):
+        response = self.client.get(reverse('property_list'))
+        self.assertTemplateUsed(response, 'realty/includes/property_cards.html')
+        self.assertContains(response, 'property_images/main.jpg')
+        self.assertContains(self.client.get(reverse('home')), reverse('property_detail', args=[self.prop.pk]))
+
+    def test_template_benchmark(self):
+        results = run_template_benchmark(sizes=(2,), duration=0.01)
+        self.assertGreater(results[2]['cards_django'], 0)
+        self.assertIn('page_django_uncached', results[2])
+
+
+class UnreadCounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = create_user('reader', password='pass')
+        cls.writer = create_user('writer')
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def send(self, count=1):
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(count):
+                Message.objects.create(sender=self.writer, receiver=self.reader, content='Привет')
+
+    def test_counter_follows_commits(self):
+        self.send()
+        # Ключа не было: incr пропущен, число берётся из базы
+        self.assertIsNone(unread.peek(self.reader.pk))
+        self.assertEqual(unread.unread_count(self.reader.pk), 1)
+        self.send(2)
+        self.assertEqual(unread.peek(self.reader.pk), 3)
+        # Откат транзакции счётчик не трогает
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Message.objects.create(sender=self.writer, receiver=self.reader, content='Черновик')
+            raise IntegrityError
+        self.assertEqual(unread.peek(self.reader.pk), 3)
+
+        self.client.force_login(self.reader)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('chat_with_user', args=[self.writer.pk]))
+        self.assertEqual(unread.peek(self.reader.pk), 0)
+
+    def test_badge_reads_cache_only(self):
+        self.send(2)
+        self.client.force_login(self.reader)
+        self.assertEqual(self.client.get(reverse('unread_count_api')).json(), {'unread': 2})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('saved_search_list'))
+        self.assertFalse([query for query in queries if 'realty_message' in query['sql']])
+        self.assertContains(response, 'data-known="1"')
+        self.assertEqual(response.context['unread_messages_count'], 2)
+
+    def test_purge_and_archive_adjust_counter(self):
+        self.send(2)
+        unread.unread_count(self.reader.pk)
+        Message.objects.filter(receiver=self.reader).update(created_at=timezone.now() - timedelta(days=400))
+        with tempfile.TemporaryDirectory() as archive_dir, self.captureOnCommitCallbacks(execute=True):
+            archive_old_messages(days=365, archive_dir=archive_dir)
+        self.assertEqual(unread.peek(self.reader.pk), 0)
+
+        self.send()
+        unread.unread_count(self.reader.pk)
+        entry = Blacklist.objects.create(user=self.reader, blocked_user=self.writer)
+        with self.captureOnCommitCallbacks(execute=True):
+            purge_pending_blacklists()
+        self.assertTrue(Blacklist.objects.get(pk=entry.pk).messages_purged)
+        self.assertIsNone(unread.peek(self.reader.pk))
+
+    def test_reconcile_fixes_drift(self):
+        self.send()
+        unread.store(self.reader.pk, 5)
+        self.assertEqual(unread.reconcile([self.reader.pk, self.writer.pk]), 1)
+        self.assertEqual(unread.peek(self.reader.pk), 1)
+        self.assertIsNone(unread.peek(self.writer.pk))
+
+        unread.store(self.reader.pk, 7)
+        CustomUser.objects.filter(pk=self.reader.pk).update(last_login=timezone.now())
+        out = StringIO()
+        call_command('run_maintenance', '--skip-blacklists', '--skip-retention', '--skip-properties',
+                     stdout=out, verbosity=0)
+        self.assertIn('Исправлено счётчиков непрочитанных: 1', out.getvalue())
+        self.assertEqual(unread.peek(self.reader.pk), 1)
@@ -0,0 +1,126 @@
+"""Счётчик непрочитанных сообщений для значка в меню.
+
+Вместо ``COUNT`` по ``Message`` на каждой странице число хранится в кэше
+под ключом ``unread:<id пользователя>`` и меняется атомарными
+``incr``/``decr`` только после фиксации транзакции (``on_commit``):
+новое сообщение (+1), прочтение диалога в ``chat_with_user`` и архивация
+старых сообщений (минус удалённые непрочитанные). После очистки по
+черному списку ключ сбрасывается и считается заново.
+
+Страницы только читают кэш (``peek``) — без запросов к базе, что важно
+и для async-представлений. Если ключа нет, значок подгружает скрипт из
+``unread_count_api``: он посчитает число по базе и положит в кэш.
+
+Расхождения (``incr`` в момент пересчёта, удаление сообщений в админке
+или каскадом вместе с пользователем, сбой кэша) живут не дольше
+``UNREAD_COUNTER_TTL`` и исправляются ``reconcile``: список диалогов
+всё равно считает точное число, а ``run_maintenance`` сверяет счётчики
+недавно входивших пользователей.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import CustomUser, Message
+
+
+def cache_key(user_id):
+    return f'unread:{user_id}'
+
+
+def counter_ttl():
+    return getattr(settings, 'UNREAD_COUNTER_TTL', 3600)
+
+
+def peek(user_id):
+    """Число из кэша без обращения к базе или None, если ключа нет"""
+    value = cache.get(cache_key(user_id))
+    return None if value is None else max(value, 0)
+
+
+def unread_count(user_id):
+    value = peek(user_id)
+    if value is None:
+        value = Message.objects.filter(receiver_id=user_id, is_read=False).count()
+        cache.add(cache_key(user_id), value, counter_ttl())
+    return value
+
+
+def store(user_id, value):
+    """Точное число, посчитанное вызывающим кодом"""
+    cache.set(cache_key(user_id), value, counter_ttl())
+
+
+def _apply(deltas):
+    for user_id, delta in deltas.items():
+        if not delta:
+            continue
+        try:
+            cache.incr(cache_key(user_id), delta)
+        except ValueError:
+            # Ключа нет: число посчитается по базе при следующем чтении
+            pass
+
+
+def adjust(deltas):
+    """Прибавить {user_id: delta} к счётчикам после фиксации транзакции"""
+    deltas = dict(deltas)
+    if deltas:
+        transaction.on_commit(lambda: _apply(deltas))
+
+
+def received(receiver_ids):
+    """Новые непрочитанные сообщения для получателей (id могут повторяться)"""
+    adjust(Counter(receiver_ids))
+
+
+def invalidate(user_ids):
+    keys = [cache_key(user_id) for user_id in user_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def message_saved(sender, instance, created, **kwargs):
+    """post_save сообщения; bulk_create вызывает ``received`` сам"""
+    if created and not instance.is_read:
+        received([instance.receiver_id])
+
+
+def reconcile(user_ids):
+    """Сверить закэшированные счётчики с базой; возвращает число исправленных"""
+    user_ids = list(user_ids)
+    cached = cache.get_many([cache_key(user_id) for user_id in user_ids])
+    if not cached:
+        return 0
+    counts = dict(
+        Message.objects.filter(receiver_id__in=user_ids, is_read=False)
+        .values('receiver').annotate(count=Count('id')).values_list('receiver', 'count')
+    )
+    fixed = {
+        cache_key(user_id): counts.get(user_id, 0) for user_id in user_ids
+        if cache_key(user_id) in cached and cached[cache_key(user_id)] != counts.get(user_id, 0)
+    }
+    cache.set_many(fixed, counter_ttl())
+    return len(fixed)
+
+
+def reconcile_recent(days=14, batch_size=1000, progress=None):
+    """``reconcile`` для пользователей, входивших за последние ``days`` дней"""
+    users = CustomUser.objects.filter(last_login__gte=timezone.now() - timedelta(days=days))
+    total = users.count()
+    done = fixed = 0
+    last_id = 0
+    while True:
+        ids = list(users.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            break
+        fixed += reconcile(ids)
+        done += len(ids)
+        last_id = ids[-1]
+        if progress is not None:
+            progress(done, total)
+    return fixed
@@ -17,6 +17,7 @@ urlpatterns = [
     # Недвижимость
     path('properties/', views.property_list, name='property_list'),
     path('property/<int:pk>/', views.property_detail, name='property_detail'),
+    path('property/<int:pk>/stats/', views.property_view_stats, name='property_view_stats'),
     path('property/create/', views.property_create, name='property_create'),
     path('property/<int:pk>/edit/', views.property_edit, name='property_edit'),
 
@@ -30,11 +31,22 @@ urlpatterns = [
     path('property/image/<int:image_id>/delete/', views.delete_property_image, name='delete_property_image'),
     path('property/image/<int:image_id>/set_main/', views.set_main_image, name='set_main_image'),
 
+    # Сохранённые поиски
+    path('searches/', views.saved_search_list, name='saved_search_list'),
+    path('searches/save/', views.saved_search_create, name='saved_search_create'),
+    path('searches/<int:pk>/delete/', views.saved_search_delete, name='saved_search_delete'),
+
+    # Аналитика рынка
+    path('analytics/', views.market_analytics, name='market_analytics'),
+    path('analytics/api/', views.market_analytics_api, name='market_analytics_api'),
+
     # Сообщения
     path('messages/', views.message_list, name='message_list'),
     path('messages/send/', views.send_message, name='send_message'),
+    path('messages/recipients/', views.recipient_search, name='recipient_search'),
     path('messages/send/<int:user_id>/', views.send_message, name='message_send_to'),  # 👈 ДОБАВЬТЕ ЭТУ СТРОКУ
     path('messages/chat/<int:user_id>/', views.chat_with_user, name='chat_with_user'),
+    path('messages/unread/', views.unread_count_api, name='unread_count_api'),
 
     # Черный список
     path('blacklist/', views.blacklist_view, name='blacklist_view'),
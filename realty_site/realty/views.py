@@ -1,25 +1,36 @@
 import json
-import random
-import string
 from datetime import datetime
-from django.shortcuts import render, get_object_or_404, redirect
+from django.conf import settings
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, get_object_or_404, aget_object_or_404, redirect
 from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Q
+from django.db import IntegrityError
+from django.db.models import Q, Case, When, F, Max, Count
 from django.views.decorators.csrf import csrf_exempt
 from django.core.paginator import Paginator
-from .models import CustomUser, Property, Comment, Message, Blacklist, PropertyImage
+from .models import CustomUser, Property, Comment, Message, Blacklist, PropertyImage, MarketStats, SavedSearch
 from .forms import CustomUserCreationForm, ProfileUpdateForm, PropertyForm, CommentForm, MessageForm
+from .routers import read_from_replica
+from .db import gather_queries
+from .captcha import issue_captcha, use_captcha, verify_captcha
+from .recipients import search_recipients
+from .availability import availability
+from .ratelimit import check_rate_limit, rate_limit
+from .maintenance import schedule_blacklist_purge
+from .archive import live_property, owner_archive
+from .cards import card_rows, card_values, render_cards
+from .recommendations import similar_properties
+from .saved_searches import search_params
+from .analytics import market_stats, serialize as serialize_market_stats
+from .conditional import conditional_view, listing_validators, property_validators
+from .viewstats import view_events, view_series, visitor_id
+from . import unread
 from django.contrib.auth import logout
 from django.shortcuts import redirect
 from django.http import JsonResponse
-
-
-def generate_captcha():
-    """Генерация простой текстовой капчи"""
-    characters = string.ascii_uppercase + string.digits
-    return ''.join(random.choice(characters) for _ in range(6))
+from django.urls import reverse
 
 
 @csrf_exempt
@@ -28,32 +39,31 @@ def register(request):
 
     # GET запросы
     if request.method == 'GET':
-        # Проверка логина
-        if 'check_username' in request.GET:
-            username = request.GET.get('check_username')
-            exists = CustomUser.objects.filter(username=username).exists()
-            return JsonResponse({'exists': exists})
-
-        # Проверка email
-        if 'check_email' in request.GET:
-            email = request.GET.get('check_email')
-            exists = CustomUser.objects.filter(email=email).exists()
+        # Проверка логина и email (фильтр Блума + индекс без учёта регистра)
+        if 'check_username' in request.GET or 'check_email' in request.GET:
+            limited = check_rate_limit(request, 'availability')
+            if limited:
+                return limited
+            if 'check_username' in request.GET:
+                exists = availability.username_taken(request.GET.get('check_username'))
+            else:
+                exists = availability.email_taken(request.GET.get('check_email'))
             return JsonResponse({'exists': exists})
 
-        # Обновление капчи
+        # Обновление капчи (ответ хранится в подписанном токене, а не в сессии)
         if 'refresh_captcha' in request.GET:
-            captcha_text = generate_captcha()
-            request.session['captcha_answer'] = captcha_text
-            request.session.modified = True
-            return JsonResponse({'captcha_text': captcha_text})
+            limited = check_rate_limit(request, 'captcha')
+            if limited:
+                return limited
+            captcha_text, captcha_token = issue_captcha()
+            return JsonResponse({'captcha_text': captcha_text, 'captcha_token': captcha_token})
 
         # Обычный GET - показать форму
-        captcha_text = generate_captcha()
-        request.session['captcha_answer'] = captcha_text
-        request.session.modified = True
+        captcha_text, captcha_token = issue_captcha()
 
         return render(request, 'realty/register.html', {
-            'captcha_text': captcha_text
+            'captcha_text': captcha_text,
+            'captcha_token': captcha_token,
         })
 
     # POST запрос - обработка регистрации
@@ -64,31 +74,34 @@ def register(request):
         except:
             data = request.POST.dict()
 
-        # Проверяем капчу
-        user_captcha = data.get('captcha', '').strip().upper()
-        correct_captcha = request.session.get('captcha_answer', '').upper()
-
-        if user_captcha != correct_captcha:
-            return JsonResponse({
-                'success': False,
-                'errors': {'captcha': [{'message': 'Неверный код проверки'}]}
-            })
+        # Проверяем капчу (токен тратится, только когда форма заполнена верно)
+        captcha_error = lambda: JsonResponse({
+            'success': False,
+            'errors': {'captcha': [{'message': 'Неверный код проверки'}]}
+        })
+        captcha_nonce = verify_captcha(data.get('captcha_token', ''), data.get('captcha', ''))
+        if captcha_nonce is None:
+            return captcha_error()
 
         # Создаем форму
         form = CustomUserCreationForm(data)
 
         if form.is_valid():
+            if not use_captcha(captcha_nonce):
+                return captcha_error()
+
             # Сохраняем пользователя
-            user = form.save()
+            try:
+                user = form.save()
+            except IntegrityError:
+                return JsonResponse({
+                    'success': False,
+                    'errors': {'username': [{'message': 'Этот логин или email уже занят'}]}
+                })
 
             # Логиним пользователя
             login(request, user)
 
-            # Очищаем капчу
-            if 'captcha_answer' in request.session:
-                del request.session['captcha_answer']
-                request.session.modified = True
-
             return JsonResponse({'success': True})
         else:
             # Возвращаем ошибки
@@ -99,26 +112,60 @@ def register(request):
 
     return JsonResponse({'success': False, 'errors': {'__all__': [{'message': 'Неизвестная ошибка'}]}})
 # Остальные функции views (добавляем их обратно)
-def home(request):
-    """Главная страница с статистикой"""
-    properties = Property.objects.filter(status='active')[:6]
+async def async_user(request):
+    """Пользователь в async-представлении.
+
+    Шаблоны и контекстные процессоры читают ``request.user`` синхронно,
+    поэтому ленивый объект заменяется уже загруженным.
+    """
+    request.user = await request.auser()
+    return request.user
+
+
+async def paginate(queryset, per_page, page_number):
+    """Paginator и страница: число строк и строки страницы запрашиваются параллельно"""
+    paginator = Paginator(queryset, per_page)
+    try:
+        number = int(page_number)
+    except (TypeError, ValueError):
+        number = 1
+    offset = max(number - 1, 0) * per_page
+    paginator.count, rows = await gather_queries(
+        queryset.count, lambda: list(queryset[offset:offset + per_page]),
+    )
+    page_obj = paginator.get_page(page_number)
+    # Номер вне диапазона: get_page вернул другую страницу — читаем её
+    page_obj.object_list = rows if page_obj.number == number else await sync_to_async(list)(page_obj.object_list)
+    return paginator, page_obj
+
 
-    # Статистика для главной страницы
-    properties_count = Property.objects.filter(status='active').count()
-    users_count = CustomUser.objects.count()
-    realtors_count = CustomUser.objects.filter(user_type='realtor').count()
-    sold_count = Property.objects.filter(status='sold').count()
+@read_from_replica
+async def home(request):
+    """Главная страница с статистикой"""
+    await async_user(request)
+    # Три независимых запроса выполняются параллельно
+    properties, property_stats, user_stats = await gather_queries(
+        lambda: card_rows(card_values(Property.objects.filter(status='active'))[:6]),
+        lambda: Property.objects.aggregate(
+            active=Count('pk', filter=Q(status='active')), sold=Count('pk', filter=Q(status='sold')),
+        ),
+        lambda: CustomUser.objects.aggregate(
+            users=Count('pk'), realtors=Count('pk', filter=Q(user_type='realtor')),
+        ),
+    )
 
     return render(request, 'realty/home.html', {
         'properties': properties,
-        'properties_count': properties_count,
-        'users_count': users_count,
-        'realtors_count': realtors_count,
-        'sold_count': sold_count,
+        'cards': render_cards(properties, 'home'),
+        'properties_count': property_stats['active'],
+        'users_count': user_stats['users'],
+        'realtors_count': user_stats['realtors'],
+        'sold_count': property_stats['sold'],
     })
 
 
-def property_list(request):
+def filtered_properties(request):
+    """Активные объявления с фильтрами каталога из GET-параметров"""
     properties = Property.objects.filter(status='active')
 
     # Фильтрация
@@ -142,6 +189,14 @@ def property_list(request):
         )
     if rooms:
         properties = properties.filter(rooms=rooms)
+    return properties
+
+
+@read_from_replica
+@conditional_view(listing_validators)
+async def property_list(request):
+    await async_user(request)
+    properties = filtered_properties(request)
 
     # Сортировка
     sort = request.GET.get('sort', '-created_at')
@@ -149,26 +204,25 @@ def property_list(request):
         properties = properties.order_by(sort)
 
     # Пагинация
-    paginator = Paginator(properties, 12)
-    page_number = request.GET.get('page', 1)
-    page_obj = paginator.get_page(page_number)
+    paginator, page_obj = await paginate(card_values(properties), 12, request.GET.get('page', 1))
+    cards = card_rows(page_obj.object_list)
 
     # AJAX запрос для фильтрации
     if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-        properties_data = []
-        for prop in page_obj:
-            main_image = prop.images.filter(is_main=True).first()
-            properties_data.append({
-                'id': prop.id,
-                'title': prop.title,
-                'price': '{:,.0f}'.format(prop.price).replace(',', ' '),
-                'location': prop.location,
-                'property_type': prop.get_property_type_display(),
-                'area': prop.area,
-                'rooms': prop.rooms,
-                'views': prop.views,
-                'image_url': main_image.image.url if main_image else '/static/images/no-image.jpg',
-            })
+        properties_data = [
+            {
+                'id': card['pk'],
+                'title': card['title'],
+                'price': card['price'],
+                'location': card['location'],
+                'property_type': card['property_type'],
+                'area': row['area'],
+                'rooms': row['rooms'],
+                'views': card['views'],
+                'image_url': card['image_url'] or '/static/images/no-image.jpg',
+            }
+            for row, card in zip(page_obj.object_list, cards)
+        ]
         return JsonResponse({
             'properties': properties_data,
             'has_next': page_obj.has_next(),
@@ -179,33 +233,51 @@ def property_list(request):
 
     context = {
         'page_obj': page_obj,
+        'cards': render_cards(cards),
         'property_types': Property.PROPERTY_TYPES,
     }
     return render(request, 'realty/property_list.html', context)
 
 
-def property_detail(request, pk):
-    property_obj = get_object_or_404(Property, pk=pk)
-    property_obj.views += 1
-    property_obj.save()
+def count_view(request, pk):
+    # Счётчик увеличиваем одним UPDATE без перезаписи всей строки и updated_at
+    Property.objects.filter(pk=pk).update(views=F('views') + 1)
+    # Событие для графиков по времени — в буфер, в базу пачкой
+    view_events.record(pk, visitor_id(request))
+
 
-    comments = property_obj.comments.all()
+@read_from_replica
+@conditional_view(property_validators, on_not_modified=count_view)
+async def property_detail(request, pk):
+    user = await async_user(request)
+    property_obj = await aget_object_or_404(
+        Property.objects.select_related('created_by').prefetch_related('images'), pk=pk
+    )
 
-    if request.method == 'POST' and request.user.is_authenticated:
+    if request.method == 'POST' and user.is_authenticated:
         comment_form = CommentForm(request.POST)
         if comment_form.is_valid():
             comment = comment_form.save(commit=False)
             comment.property = property_obj
-            comment.author = request.user
-            comment.save()
+            comment.author = user
+            await comment.asave()
             return redirect('property_detail', pk=pk)
     else:
         comment_form = CommentForm()
 
+    # Счётчик, комментарии и похожие объявления друг от друга не зависят
+    _, comments, similar = await gather_queries(
+        lambda: count_view(request, pk),
+        lambda: list(property_obj.comments.select_related('author')),
+        lambda: similar_properties(pk),
+    )
+    property_obj.views += 1
+
     return render(request, 'realty/property_detail.html', {
         'property': property_obj,
         'comments': comments,
         'comment_form': comment_form,
+        'similar_properties': similar,
     })
 
 
@@ -241,7 +313,7 @@ def property_create(request):
 
 @login_required
 def property_edit(request, pk):
-    property_obj = get_object_or_404(Property, pk=pk, created_by=request.user)
+    property_obj = live_property(pk, request.user)
 
     if request.method == 'POST':
         form = PropertyForm(request.POST, request.FILES, instance=property_obj)
@@ -280,44 +352,54 @@ def profile_update(request):
     else:
         form = ProfileUpdateForm(instance=request.user)
 
-    user_properties = Property.objects.filter(created_by=request.user)
+    user_properties = list(Property.objects.filter(created_by=request.user).prefetch_related('images'))
+    series = view_series([prop.pk for prop in user_properties])
+    for prop in user_properties:
+        prop.view_chart = series[prop.pk]
     return render(request, 'realty/profile.html', {
         'form': form,
-        'properties': user_properties
+        'properties': user_properties,
+        'archived_properties': owner_archive(request.user),
     })
 
 
 @login_required
-def message_list(request):
+async def message_list(request):
     """Простой список сообщений - последние диалоги"""
-    # Получаем последнее сообщение с каждым пользователем
-    sent_messages = Message.objects.filter(sender=request.user)
-    received_messages = Message.objects.filter(receiver=request.user)
-
-    # Собираем уникальных собеседников
-    users = set()
-    for msg in sent_messages:
-        users.add(msg.receiver)
-    for msg in received_messages:
-        users.add(msg.sender)
-
-    # Для каждого пользователя находим последнее сообщение
-    dialogues = []
-    for user in users:
-        last_msg = Message.objects.filter(
-            Q(sender=request.user, receiver=user) | Q(sender=user, receiver=request.user)
-        ).order_by('-created_at').first()
-
-        unread_count = Message.objects.filter(sender=user, receiver=request.user, is_read=False).count()
+    current_user = await async_user(request)
+    # Последнее сообщение с каждым собеседником - одним запросом с группировкой
+    partner = Case(When(sender=current_user, then=F('receiver')), default=F('sender'))
+    last_ids = (
+        Message.objects.filter(Q(sender=current_user) | Q(receiver=current_user))
+        .annotate(partner=partner)
+        .values('partner')
+        .annotate(last_id=Max('id'))
+        .values('last_id')
+    )
+    last_messages, unread_counts = await gather_queries(
+        lambda: list(Message.objects.filter(id__in=last_ids).select_related('sender', 'receiver')),
+        # Непрочитанные по отправителям
+        lambda: dict(
+            Message.objects.filter(receiver=current_user, is_read=False)
+            .values('sender')
+            .annotate(count=Count('id'))
+            .values_list('sender', 'count')
+        ),
+    )
 
+    dialogues = []
+    for last_msg in last_messages:
+        user = last_msg.receiver if last_msg.sender_id == current_user.id else last_msg.sender
         dialogues.append({
             'user': user,
             'last_message': last_msg,
-            'unread_count': unread_count
+            'unread_count': unread_counts.get(user.id, 0)
         })
 
     # Сортируем по времени последнего сообщения
     dialogues.sort(key=lambda x: x['last_message'].created_at if x['last_message'] else datetime.min, reverse=True)
+    # Точное число уже посчитано — заодно исправляем счётчик значка
+    unread.store(current_user.pk, sum(unread_counts.values()))
 
     return render(request, 'realty/messages.html', {'dialogues': dialogues})
 
@@ -340,7 +422,8 @@ def chat_with_user(request, user_id):
         return redirect('message_list')
 
     # Проверяем, не заблокировали ли мы пользователя
-    if Blacklist.objects.filter(user=request.user, blocked_user=other_user).exists():
+    blocked = Blacklist.objects.filter(user=request.user, blocked_user=other_user).exists()
+    if blocked:
         message_framework.warning(request, 'Этот пользователь находится в вашем черном списке.')
 
     if request.method == 'POST':
@@ -361,16 +444,26 @@ def chat_with_user(request, user_id):
     messages_list = Message.objects.filter(
         Q(sender=request.user, receiver=other_user) | Q(sender=other_user, receiver=request.user)
     ).order_by('created_at')
+    if blocked:
+        # Фоновая очистка могла ещё не дойти до этих сообщений
+        messages_list = messages_list.exclude(sender=other_user)
 
     # Помечаем сообщения как прочитанные
-    Message.objects.filter(sender=other_user, receiver=request.user, is_read=False).update(is_read=True)
+    read = Message.objects.filter(sender=other_user, receiver=request.user, is_read=False).update(is_read=True)
+    unread.adjust({request.user.pk: -read})
 
     return render(request, 'realty/chat.html', {
         'other_user': other_user,
-        'messages': messages_list
+        'chat_messages': messages_list
     })
 
 
+@login_required
+def unread_count_api(request):
+    """Число непрочитанных сообщений для значка в меню"""
+    return JsonResponse({'unread': unread.unread_count(request.user.pk)})
+
+
 @login_required
 def send_message(request, user_id=None):
     """Отправить сообщение с проверкой черного списка"""
@@ -395,8 +488,116 @@ def send_message(request, user_id=None):
         # ИЗМЕНИТЕ ЭТУ СТРОКУ: simple_message.html → send_message.html
         return render(request, 'realty/send_message.html', {'other_user': other_user})
 
-    users = CustomUser.objects.exclude(id=request.user.id)
+    # Вместо всех пользователей - недавние собеседники, остальных ищем через recipient_search
+    users = search_recipients(request.user, '', limit=10)
     return render(request, 'realty/choose_user.html', {'users': users})
+
+
+@login_required
+@rate_limit('recipient_search', methods=('GET',))
+def recipient_search(request):
+    """Подсказки для выбора получателя (JSON)"""
+    try:
+        limit = int(request.GET.get('limit', 10))
+    except ValueError:
+        limit = 10
+    users = search_recipients(request.user, request.GET.get('q', ''), limit=limit)
+    return JsonResponse({'results': [
+        {
+            'id': user.id,
+            'username': user.username,
+            'full_name': user.get_full_name(),
+            'user_type': user.get_user_type_display(),
+            'url': reverse('chat_with_user', args=[user.id]),
+        }
+        for user in users
+    ]})
+
+
+def market_filters(request):
+    try:
+        months = max(1, min(int(request.GET.get('months', 12)), 60))
+    except ValueError:
+        months = 12
+    return request.GET.get('type') or None, request.GET.get('city') or None, months
+
+
+@read_from_replica
+def market_analytics(request):
+    """Аналитика рынка: цена за м² и сроки продажи по типам, городам и месяцам"""
+    property_type, city, months = market_filters(request)
+    return render(request, 'realty/analytics.html', {
+        'stats': market_stats(property_type, city, months),
+        'cities': MarketStats.objects.values_list('city', flat=True).distinct().order_by('city'),
+        'property_types': Property.PROPERTY_TYPES,
+        'month_options': (3, 6, 12, 24),
+        'selected': {'type': property_type or '', 'city': city or '', 'months': months},
+    })
+
+
+@read_from_replica
+def market_analytics_api(request):
+    """Та же сводка в JSON"""
+    property_type, city, months = market_filters(request)
+    return JsonResponse({'results': [serialize_market_stats(row) for row in market_stats(property_type, city, months)]})
+
+
+@login_required
+def property_view_stats(request, pk):
+    """Просмотры объявления по часам или дням (только для владельца)"""
+    property_obj = get_object_or_404(Property.objects.only('pk'), pk=pk, created_by=request.user)
+    period = 'hour' if request.GET.get('period') == 'hour' else 'day'
+    try:
+        count = min(max(int(request.GET.get('count', 48 if period == 'hour' else 30)), 1), 366)
+    except ValueError:
+        count = 30
+    series = view_series([property_obj.pk], period, count)[property_obj.pk]
+    return JsonResponse({
+        'period': period,
+        'views': series['views'],
+        'visitors': series['visitors'],
+        'points': [
+            {'bucket': point['bucket'].isoformat(), 'views': point['views'], 'visitors': point['visitors']}
+            for point in series['points']
+        ],
+    })
+
+
+@login_required
+def saved_search_list(request):
+    """Сохранённые поиски пользователя"""
+    return render(request, 'realty/saved_searches.html', {
+        'saved_searches': request.user.saved_searches.all(),
+    })
+
+
+@login_required
+def saved_search_create(request):
+    """Сохранить текущие фильтры каталога"""
+    if request.method != 'POST':
+        return redirect('property_list')
+    if request.user.saved_searches.count() >= settings.SAVED_SEARCH_LIMIT:
+        messages.error(request, f'Можно сохранить не больше {settings.SAVED_SEARCH_LIMIT} поисков.')
+        return redirect('saved_search_list')
+    notify = request.POST.get('notify')
+    saved_search = SavedSearch.objects.create(
+        user=request.user,
+        notify=notify if notify in dict(SavedSearch.NOTIFY_CHOICES) else 'instant',
+        **search_params(request.POST),
+    )
+    messages.success(request, f'Поиск «{saved_search.describe()}» сохранён. Мы сообщим о новых объявлениях.')
+    return redirect(f"{reverse('property_list')}?{saved_search.query_string()}")
+
+
+@login_required
+def saved_search_delete(request, pk):
+    """Удалить сохранённый поиск"""
+    if request.method == 'POST':
+        SavedSearch.objects.filter(pk=pk, user=request.user).delete()
+        messages.success(request, 'Поиск удалён')
+    return redirect('saved_search_list')
+
+
 @login_required
 def blacklist_add(request, user_id):
     """Добавить пользователя в черный список"""
@@ -404,18 +605,17 @@ def blacklist_add(request, user_id):
 
     if user_to_block != request.user:
         # Добавляем в черный список
-        Blacklist.objects.get_or_create(
+        entry, created = Blacklist.objects.get_or_create(
             user=request.user,
             blocked_user=user_to_block
         )
 
-        # Удаляем все сообщения от этого пользователя
-        Message.objects.filter(
-            sender=user_to_block,
-            receiver=request.user
-        ).delete()
+        # Сообщения от этого пользователя удаляются в фоне после коммита;
+        # до завершения очистки чат их уже не показывает
+        if created:
+            schedule_blacklist_purge(entry)
 
-        messages.success(request, f'Пользователь {user_to_block.username} добавлен в черный список. Сообщения удалены.')
+        messages.success(request, f'Пользователь {user_to_block.username} добавлен в черный список. Его сообщения скрыты и будут удалены в ближайшее время.')
 
     return redirect('profile')
 
@@ -452,7 +652,7 @@ def custom_logout(request):
 @login_required
 def property_mark_sold(request, pk):
     """Пометить объект как проданный"""
-    property_obj = get_object_or_404(Property, pk=pk, created_by=request.user)
+    property_obj = live_property(pk, request.user)
     property_obj.status = 'sold'
     property_obj.save()
     messages.success(request, f'Объект "{property_obj.title}" помечен как проданный')
@@ -461,7 +661,7 @@ def property_mark_sold(request, pk):
 @login_required
 def property_hide(request, pk):
     """Скрыть объект"""
-    property_obj = get_object_or_404(Property, pk=pk, created_by=request.user)
+    property_obj = live_property(pk, request.user)
     property_obj.status = 'hidden'
     property_obj.save()
     messages.success(request, f'Объект "{property_obj.title}" скрыт')
@@ -470,7 +670,7 @@ def property_hide(request, pk):
 @login_required
 def property_reactivate(request, pk):
     """Вернуть объект в активные"""
-    property_obj = get_object_or_404(Property, pk=pk, created_by=request.user)
+    property_obj = live_property(pk, request.user)
     property_obj.status = 'active'
     property_obj.save()
     messages.success(request, f'Объект "{property_obj.title}" активирован')
@@ -479,7 +679,7 @@ def property_reactivate(request, pk):
 @login_required
 def property_delete(request, pk):
     """Удалить объект"""
-    property_obj = get_object_or_404(Property, pk=pk, created_by=request.user)
+    property_obj = live_property(pk, request.user)
     property_obj.delete()
     messages.success(request, f'Объект "{property_obj.title}" удален')
     return redirect('profile')
@@ -0,0 +1,282 @@
+"""Статистика просмотров объявлений по времени.
+
+1. ``property_detail`` кладёт событие просмотра в буфер процесса
+   (``view_events.record``) — без обращения к базе.
+2. Когда в буфере набирается ``VIEW_EVENTS_BUFFER_SIZE`` событий или с
+   прошлой записи прошло ``VIEW_EVENTS_FLUSH_INTERVAL`` секунд, пачка
+   записывается одним ``bulk_create`` в журнал ``PropertyViewEvent``
+   (в фоновом потоке) и сразу сворачивается.
+3. Свёртка (``rollup``) забирает ещё не учтённые события журнала
+   (``rolled_up=False``), добавляет просмотры в почасовые и посуточные
+   строки ``PropertyViewStats`` и в той же транзакции помечает события
+   учтёнными. Уникальные посетители считаются приближённо
+   через HyperLogLog: регистры хранятся в строке и объединяются
+   поэлементным максимумом, поэтому суточные значения можно складывать
+   в недельные без повторного чтения журнала.
+
+Позиция по pk здесь не годится: в PostgreSQL пачка с меньшими pk может
+зафиксироваться позже пачки с большими, и такие события навсегда
+остались бы позади позиции. Помеченные события видны свёртке, как только
+зафиксированы, а очистка удаляет только их. Параллельные свёртки
+(несколько процессов, команда ``rollup_views``) упорядочивает
+``select_for_update`` строки ``RollupLock``. События, не
+записанные до аварийного завершения процесса, теряются — это
+приемлемая цена за отсутствие записи в базу на каждый просмотр.
+"""
+import atexit
+import hashlib
+import logging
+import math
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .maintenance import delete_in_batches, run_in_background
+from .models import Property, PropertyViewEvent, PropertyViewStats, RollupLock
+from .ratelimit import client_ip
+
+logger = logging.getLogger('realty.viewstats')
+
+ROLLUP_LOCK = 'property_views'
+HLL_PRECISION = 10
+HLL_REGISTERS = 1 << HLL_PRECISION
+MASK_64 = (1 << 64) - 1
+
+
+class HyperLogLog:
+    """Оценка числа уникальных значений: 1024 регистра, погрешность ~3%"""
+
+    def __init__(self, registers=None):
+        if registers:
+            self.registers = np.frombuffer(bytes(registers), dtype=np.uint8).copy()
+        else:
+            self.registers = np.zeros(HLL_REGISTERS, dtype=np.uint8)
+
+    def add(self, value):
+        value &= MASK_64
+        index = value >> (64 - HLL_PRECISION)
+        rest = (value << HLL_PRECISION) & MASK_64
+        rank = 64 - rest.bit_length() + 1 if rest else 64 - HLL_PRECISION + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values):
+        """Добавить сразу много значений — векторно, без цикла по Python-объектам"""
+        values = np.array([value & MASK_64 for value in values], dtype=np.uint64)
+        if not len(values):
+            return
+        index = (values >> np.uint64(64 - HLL_PRECISION)).astype(np.intp)
+        rest = values << np.uint64(HLL_PRECISION)
+        # Длина в битах по двум 32-битным половинам: во float64 они точны
+        high = (rest >> np.uint64(32)).astype(np.float64)
+        low = (rest & np.uint64(0xFFFFFFFF)).astype(np.float64)
+        bits = np.where(high > 0, np.frexp(high)[1] + 32, np.frexp(low)[1])
+        rank = np.where(rest > 0, 64 - bits + 1, 64 - HLL_PRECISION + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self):
+        alpha = 0.7213 / (1 + 1.079 / HLL_REGISTERS)
+        estimate = alpha * HLL_REGISTERS ** 2 / np.sum(np.exp2(-self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * HLL_REGISTERS and zeros:
+            # Поправка для малых значений (linear counting)
+            estimate = HLL_REGISTERS * math.log(HLL_REGISTERS / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self):
+        return self.registers.tobytes()
+
+
+def visitor_id(request):
+    """Хэш посетителя: пользователь или IP + User-Agent, без хранения исходных данных"""
+    if getattr(request, 'user', None) is not None and request.user.is_authenticated:
+        raw = f'user:{request.user.pk}'
+    else:
+        raw = f"anon:{client_ip(request)}|{request.headers.get('user-agent', '')}"
+    digest = hashlib.blake2b(raw.encode(), digest_size=8, key=settings.SECRET_KEY.encode()[:64]).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+class ViewEventBuffer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = []
+        self._flushed_at = time.monotonic()
+
+    def record(self, property_id, visitor, viewed_at=None):
+        if not getattr(settings, 'VIEW_EVENTS_ENABLED', True):
+            return
+        event = PropertyViewEvent(property_id=property_id, visitor=visitor, viewed_at=viewed_at or timezone.now())
+        with self._lock:
+            self._events.append(event)
+            due = (
+                len(self._events) >= getattr(settings, 'VIEW_EVENTS_BUFFER_SIZE', 200)
+                or time.monotonic() - self._flushed_at >= getattr(settings, 'VIEW_EVENTS_FLUSH_INTERVAL', 5)
+            )
+            if not due:
+                return
+            batch = self._take()
+        if getattr(settings, 'VIEW_EVENTS_FLUSH_IN_BACKGROUND', True):
+            transaction.on_commit(lambda: run_in_background(write_events, batch))
+        else:
+            write_events(batch)
+
+    def _take(self):
+        batch, self._events = self._events, []
+        self._flushed_at = time.monotonic()
+        return batch
+
+    def flush(self):
+        """Записать всё накопленное синхронно (при остановке процесса, в тестах)"""
+        with self._lock:
+            batch = self._take()
+        if batch:
+            write_events(batch)
+        return len(batch)
+
+    def __len__(self):
+        return len(self._events)
+
+
+def write_events(batch):
+    PropertyViewEvent.objects.bulk_create(batch, batch_size=1000)
+    rollup()
+
+
+def hour_of(moment):
+    return timezone.localtime(moment).replace(minute=0, second=0, microsecond=0)
+
+
+def apply_events(events):
+    """Добавить события (id, property_id, visitor, viewed_at) в строки сводки"""
+    existing_properties = set(
+        Property.objects.filter(pk__in={event[1] for event in events}).values_list('pk', flat=True)
+    )
+    visitors = defaultdict(list)
+    for _, property_id, visitor, viewed_at in events:
+        if property_id not in existing_properties:
+            continue
+        hour = hour_of(viewed_at)
+        visitors[(property_id, 'hour', hour)].append(visitor)
+        visitors[(property_id, 'day', hour.replace(hour=0))].append(visitor)
+    if not visitors:
+        return
+
+    stored = {
+        (row.property_id, row.period, row.bucket): row
+        for row in PropertyViewStats.objects.filter(
+            property_id__in={key[0] for key in visitors}, bucket__in={key[2] for key in visitors},
+        )
+    }
+    rows = []
+    for (property_id, period, bucket), values in visitors.items():
+        row = stored.get((property_id, period, bucket))
+        if row is None:
+            row = PropertyViewStats(property_id=property_id, period=period, bucket=bucket)
+        hll = HyperLogLog(row.visitors_hll)
+        hll.update(values)
+        row.views += len(values)
+        row.visitors = hll.count()
+        row.visitors_hll = hll.to_bytes()
+        rows.append(row)
+    # Вставка с обновлением при конфликте: bulk_update строит CASE на каждую строку и на порядок медленнее
+    PropertyViewStats.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=['property', 'period', 'bucket'],
+        update_fields=['views', 'visitors', 'visitors_hll'],
+        batch_size=500,
+    )
+
+
+def rollup(chunk_size=10000):
+    """Свернуть новые события журнала; возвращает их число"""
+    total = 0
+    while True:
+        with transaction.atomic():
+            RollupLock.objects.select_for_update().get_or_create(name=ROLLUP_LOCK)
+            events = list(
+                PropertyViewEvent.objects.filter(rolled_up=False).order_by('pk')
+                .values_list('pk', 'property_id', 'visitor', 'viewed_at')[:chunk_size]
+            )
+            if not events:
+                return total
+            apply_events(events)
+            # Именно прочитанные pk: события, зафиксированные после чтения, дождутся следующей свёртки
+            PropertyViewEvent.objects.filter(pk__in=[event[0] for event in events]).update(rolled_up=True)
+        total += len(events)
+
+
+def purge_old(event_days=None, hourly_days=None, batch_size=5000):
+    """Удалить свёрнутые события и почасовую статистику старше срока хранения"""
+    now = timezone.now()
+    event_days = event_days or getattr(settings, 'VIEW_EVENTS_RETENTION_DAYS', 30)
+    hourly_days = hourly_days or getattr(settings, 'VIEW_STATS_HOURLY_RETENTION_DAYS', 30)
+    events = delete_in_batches(
+        PropertyViewEvent.objects.filter(rolled_up=True, viewed_at__lt=now - timedelta(days=event_days)),
+        batch_size,
+    )
+    hours = delete_in_batches(
+        PropertyViewStats.objects.filter(period='hour', bucket__lt=now - timedelta(days=hourly_days)),
+        batch_size,
+    )
+    return events, hours
+
+
+def view_series(property_ids, period='day', count=14):
+    """{property_id: {'points': [...], 'views': n, 'visitors': n}} — одним запросом.
+
+    Уникальные посетители за весь период — объединение HyperLogLog по точкам.
+    """
+    step = timedelta(hours=1) if period == 'hour' else timedelta(days=1)
+    last = hour_of(timezone.now())
+    if period == 'day':
+        last = last.replace(hour=0)
+    slots = [last - step * i for i in reversed(range(count))]
+    rows = PropertyViewStats.objects.filter(
+        property_id__in=property_ids, period=period, bucket__gte=slots[0],
+    )
+    found = defaultdict(dict)
+    for row in rows:
+        found[row.property_id][timezone.localtime(row.bucket)] = row
+
+    result = {}
+    for property_id in property_ids:
+        stored = found.get(property_id, {})
+        merged = HyperLogLog()
+        points = []
+        for slot in slots:
+            row = stored.get(slot)
+            if row is not None:
+                merged.merge(HyperLogLog(row.visitors_hll))
+            points.append({'bucket': slot, 'views': row.views if row else 0, 'visitors': row.visitors if row else 0})
+        peak = max(point['views'] for point in points) or 1
+        for point in points:
+            point['height'] = round(point['views'] * 100 / peak)
+        result[property_id] = {
+            'points': points,
+            'views': sum(point['views'] for point in points),
+            'visitors': merged.count() if stored else 0,
+        }
+    return result
+
+
+view_events = ViewEventBuffer()
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        view_events.flush()
+    except Exception:
+        logger.exception('Не удалось записать буфер просмотров при остановке')
@@ -22,21 +22,38 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'realty.compression.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'realty.ratelimit.RateLimitMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'realty.routers.ReplicaPinningMiddleware',
+    'realty.nplusone.NPlusOneMiddleware',
 ]
 
+# Сжатие ответов (realty/compression.py): Brotli при наличии пакета brotli,
+# иначе gzip; уровни сжатия, минимальный размер тела и сжимаемые типы
+COMPRESSION_LEVELS = {'br': 4, 'gzip': 6}
+COMPRESSION_MIN_SIZE = 200
+COMPRESSION_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml', 'image/svg+xml')
+
+# Детектор N+1 запросов (realty/nplusone.py): в режиме разработки пишет
+# предупреждение в лог, в строгом режиме падает с NPlusOneError
+NPLUSONE_ENABLED = DEBUG
+NPLUSONE_THRESHOLD = 5
+NPLUSONE_STRICT = False
+
 ROOT_URLCONF = 'realty_site.urls'
 
+# Шаблоны разбираются один раз на процесс (cached.Loader) и при DEBUG:
+# runserver сбрасывает кэш при изменении файла шаблона
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.debug',
@@ -44,20 +61,219 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'django.template.context_processors.media',  # Добавляем медиа контекст
+                'realty.context_processors.unread_messages',
+            ],
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
             ],
         },
     },
 ]
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Карточки объявлений (realty/cards.py): движок сетки карточек на главной
+# и в каталоге — 'django' или 'jinja2' (если установлен пакет Jinja2);
+# Jinja2 читает только общий шаблон карточек из realty/templates
+try:
+    import jinja2
+except ImportError:
+    jinja2 = None
+
+if jinja2 is not None:
+    TEMPLATES.append({
+        'BACKEND': 'django.template.backends.jinja2.Jinja2',
+        'NAME': 'jinja2',
+        'DIRS': [BASE_DIR / 'realty' / 'templates'],
+        'APP_DIRS': False,
+    })
+CARD_TEMPLATE_ENGINE = os.environ.get('DJANGO_CARD_TEMPLATE_ENGINE', 'django')
+
+# База данных выбирается переменными окружения.
+# DJANGO_DB_ENGINE=postgres — PostgreSQL (нужен psycopg 3, для пула — psycopg[pool]);
+# по умолчанию — SQLite в одноузловом режиме.
+DB_ENGINE = os.environ.get('DJANGO_DB_ENGINE', 'sqlite')
+
+if DB_ENGINE in ('postgres', 'postgresql'):
+    DB_POOL = os.environ.get('DJANGO_DB_POOL', '').lower() in ('1', 'true', 'yes')
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DJANGO_DB_NAME', 'realty'),
+            'USER': os.environ.get('DJANGO_DB_USER', 'realty'),
+            'PASSWORD': os.environ.get('DJANGO_DB_PASSWORD', ''),
+            'HOST': os.environ.get('DJANGO_DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DJANGO_DB_PORT', '5432'),
+            # Встроенный пул и постоянные соединения взаимоисключающие
+            'CONN_MAX_AGE': 0 if DB_POOL else int(os.environ.get('DJANGO_DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'pool': {
+                    'min_size': int(os.environ.get('DJANGO_DB_POOL_MIN', 2)),
+                    'max_size': int(os.environ.get('DJANGO_DB_POOL_MAX', 10)),
+                    'timeout': int(os.environ.get('DJANGO_DB_POOL_TIMEOUT', 10)),
+                },
+            } if DB_POOL else {},
+        }
     }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DJANGO_SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                # Блокировка на запись берётся в начале транзакции, поэтому
+                # ожидание идёт через timeout, а не SQLITE_BUSY посреди транзакции
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': int(os.environ.get('DJANGO_SQLITE_TIMEOUT', 20)),
+            },
+        }
+    }
+
+# Реплики для чтения каталога (realty/routers.py): DJANGO_DB_REPLICAS — через
+# запятую пути к файлам SQLite или хосты PostgreSQL. Локально файлы-реплики
+# обновляются командой sync_replicas.
+REPLICA_DATABASES = []
+for number, replica in enumerate(filter(None, os.environ.get('DJANGO_DB_REPLICAS', '').split(',')), 1):
+    alias = f'replica{number}'
+    DATABASES[alias] = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
+    if DATABASES['default']['ENGINE'].endswith('sqlite3'):
+        DATABASES[alias]['NAME'] = replica.strip()
+    else:
+        DATABASES[alias]['HOST'] = replica.strip()
+    REPLICA_DATABASES.append(alias)
+
+DATABASE_ROUTERS = ['realty.routers.ReplicaRouter']
+REPLICA_MAX_LAG = int(os.environ.get('DJANGO_REPLICA_MAX_LAG', 10))
+REPLICA_LAG_CHECK_INTERVAL = 5
+REPLICA_PIN_SECONDS = 15
+
+# PRAGMA для каждого нового соединения SQLite (realty/db.py), дополняют значения по умолчанию
+SQLITE_PRAGMAS = {
+    'busy_timeout': int(os.environ.get('DJANGO_SQLITE_TIMEOUT', 20)) * 1000,
+}
+
+# Общий кэш: Redis (DJANGO_REDIS_URL) для нескольких процессов, иначе память процесса
+if os.environ.get('DJANGO_REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['DJANGO_REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Условные GET (realty/conditional.py): версии страниц — счётчики в кэше, поэтому
+# 304 отдаются только с кэшем, общим для процессов. Кэш в памяти процесса —
+# лишь при DJANGO_CONDITIONAL_GET=1 и единственном процессе, иначе процесс не
+# увидит изменений, сделанных другим, и ответит 304 на устаревшую страницу
+CONDITIONAL_GET_ENABLED = (
+    not CACHES['default']['BACKEND'].endswith(('.LocMemCache', '.DummyCache'))
+    or os.environ.get('DJANGO_CONDITIONAL_GET') == '1'
+)
+
+# Хранилище сессий: db (по умолчанию), cached_db или signed_cookies
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
 }
+SESSION_ENGINE = SESSION_ENGINES[os.environ.get('DJANGO_SESSION_ENGINE', 'db')]
+
+# Flash-сообщения храним в cookie, а не в сессии
+MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
 
 AUTH_USER_MODEL = 'realty.CustomUser'
 
+# Ограничение частоты запросов (realty/ratelimit.py): скорость пополнения корзины,
+# её ёмкость (burst) и ключи — 'client' (пользователь или IP анонима) и 'ip'
+RATE_LIMIT_ENABLED = True
+RATE_LIMITS = {
+    'messages': {'rate': '20/m', 'burst': 10, 'keys': ('client', 'ip')},
+    'comments': {'rate': '6/m', 'burst': 5, 'keys': ('client', 'ip')},
+    'captcha': {'rate': '10/m', 'burst': 5, 'keys': ('ip',)},
+    'availability': {'rate': '3/s', 'burst': 30, 'keys': ('ip',)},
+    'recipient_search': {'rate': '5/s', 'burst': 20},
+}
+# Адреса и подсети обратных прокси, которым верим в X-Forwarded-For;
+# для остальных запросов IP клиента — REMOTE_ADDR
+TRUSTED_PROXIES = [
+    proxy.strip() for proxy in os.environ.get('DJANGO_TRUSTED_PROXIES', '').split(',') if proxy.strip()
+]
+# Лимиты, которые middleware применяет по имени URL: (область, методы)
+RATE_LIMIT_VIEWS = {
+    'chat_with_user': ('messages', ('POST',)),
+    'message_send_to': ('messages', ('POST',)),
+    'property_detail': ('comments', ('POST',)),
+}
+
+# Обслуживание сообщений (realty/maintenance.py, команда run_maintenance):
+# очистка после черного списка в фоновом потоке и срок хранения переписки
+# (None — не архивировать), архивы .jsonl.gz пишутся в MESSAGE_ARCHIVE_DIR
+BLACKLIST_PURGE_IN_BACKGROUND = True
+MESSAGE_RETENTION_DAYS = int(os.environ['DJANGO_MESSAGE_RETENTION_DAYS']) if os.environ.get('DJANGO_MESSAGE_RETENTION_DAYS') else None
+MESSAGE_ARCHIVE_DIR = Path(os.environ.get('DJANGO_MESSAGE_ARCHIVE_DIR', BASE_DIR / 'archive'))
+
+# Архив объявлений (realty/archive.py): проданные и скрытые объекты, которые
+# не менялись дольше срока, run_maintenance переносит в архивные таблицы
+PROPERTY_ARCHIVE_DAYS = 180
+
+# Значок непрочитанных сообщений (realty/unread.py): счётчик в кэше живёт
+# UNREAD_COUNTER_TTL секунд, страница опрашивает его раз в UNREAD_POLL_INTERVAL
+# секунд (0 — без опроса)
+UNREAD_COUNTER_TTL = 3600
+UNREAD_POLL_INTERVAL = 60
+
+# Похожие объявления (realty/recommendations.py): сколько хранить на объявление;
+# после изменения объявления соседи пересчитываются в фоновом потоке,
+# полный пересчёт — командой build_recommendations. Матрица признаков живёт
+# в памяти процесса и перечитывается из базы раз в RECOMMENDATIONS_MATRIX_TTL секунд
+RECOMMENDATIONS_K = 6
+RECOMMENDATIONS_REFRESH_IN_BACKGROUND = True
+RECOMMENDATIONS_MATRIX_TTL = 600
+
+# Аналитика рынка (realty/analytics.py): группы сводки пересчитываются
+# в фоне после изменения объявлений, полностью — командой rebuild_market_stats
+MARKET_STATS_REFRESH_IN_BACKGROUND = True
+
+# Сохранённые поиски (realty/saved_searches.py): новые и возвращённые в продажу
+# объявления сверяются с поисками в фоне; уведомления приходят от служебной
+# учётной записи (создаётся миграцией 0012, логин зарезервирован при
+# регистрации), сводки рассылает команда send_search_digests
+SAVED_SEARCH_MATCH_IN_BACKGROUND = True
+SAVED_SEARCH_LIMIT = 20
+NOTIFICATIONS_SENDER_USERNAME = 'kupidom'
+
+# Статистика просмотров (realty/viewstats.py): события копятся в памяти процесса
+# и записываются пачкой по размеру буфера или интервалу (секунды), затем
+# сворачиваются в почасовые и посуточные строки; rollup_views --purge
+# удаляет старые события и почасовые строки
+VIEW_EVENTS_ENABLED = True
+VIEW_EVENTS_BUFFER_SIZE = 200
+VIEW_EVENTS_FLUSH_INTERVAL = 5
+VIEW_EVENTS_FLUSH_IN_BACKGROUND = True
+VIEW_EVENTS_RETENTION_DAYS = 30
+VIEW_STATS_HOURLY_RETENTION_DAYS = 30
+
+# Админка (realty/admin.py): списки без фильтров в таблицах больше порога
+# показывают оценку числа строк из статистики базы вместо COUNT(*)
+ADMIN_ESTIMATED_COUNT_THRESHOLD = 100000
+
+# Async-представления (главная, каталог, карточка, сообщения): независимые
+# запросы можно выполнять параллельно на отдельных соединениях (realty/db.py).
+# Только для PostgreSQL и по DJANGO_ASYNC_PARALLEL_QUERIES=1: на SQLite
+# это медленнее, чем те же запросы подряд
+ASYNC_PARALLEL_QUERIES = (
+    DATABASES['default']['ENGINE'].endswith('postgresql')
+    and os.environ.get('DJANGO_ASYNC_PARALLEL_QUERIES') == '1'
+)
+
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
 